@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# Bakes the glyphs into an importable Python package, so scripts can draw the fonts without Pillow or any image decoding.
+# The variants are generated from the source image the same way generate_sheets.py does, so this doesn't depend on which
+# formats were last written to assets/.
+# Each subsheet becomes one module holding its code point and name tables plus zlib-compressed bitplanes for each variant.
+# The package's own code only imports subsheet modules and decompresses variants when a font is first requested.
+import os
+import os.path
+import pprint
+import shutil
+import zlib
+import common
+import generate_sheets
+
+FONT_MODULE_PACKAGE_NAME = 'omelette_glyphs'
+FONT_MODULE_OUTPUT_FOLDER = os.path.join(common.FONT_OUTPUT_FOLDER, 'python', FONT_MODULE_PACKAGE_NAME)
+FONT_MODULE_BYTES_PER_LINE = 48
+
+RUNTIME_SOURCE = '''"""Omelette pixel font glyphs, generated by bake_glyph_module.py. Only needs the Python standard library.
+
+    font = omelette_glyphs.get_font('thin', 'plain')
+    width, height, indexes = font.render('Hello')
+    rgba = font.to_rgba(indexes)
+
+Glyph pixels are palette indexes, row-major. Index 0 is transparent, and font.palette maps the rest to RGBA colors.
+"""
+import importlib
+import zlib
+
+FONTS = %(fonts)s
+
+class Font:
+    def __init__(self, module, variant_name):
+        self.name = module.NAME
+        self.variant_name = variant_name
+        self.glyph_size = module.GLYPH_SIZE
+        self.ascent, self.descent = module.ASCENT_DESCENT
+        self.code_points = module.CODE_POINTS
+        self.names = module.NAMES
+        self.fallback_code_point = module.FALLBACK_CODE_POINT
+        self.palette, self._plane_count, self._compressed = module.VARIANTS[variant_name]
+        self._glyph_indexes = {code_point: glyph_index for glyph_index, code_point in enumerate(self.code_points) if code_point >= 0}
+        self._data = None
+
+    @property
+    def data(self):
+        # All glyphs, one after another. Decompressed on first use, then kept.
+        if self._data is None:
+            planes = zlib.decompress(self._compressed)
+            plane_size = len(planes) // self._plane_count
+            pixel_count = plane_size * 8
+            value = 0
+            for plane in range(self._plane_count):
+                # Spreading each bit to its own byte leaves room to OR the other planes into the same bytes.
+                bits = b''.join(_BITS[byte] for byte in planes[plane * plane_size:(plane + 1) * plane_size])
+                value |= int.from_bytes(bits, 'big') << plane
+            glyph_width, glyph_height = self.glyph_size
+            self._data = value.to_bytes(pixel_count, 'big')[:len(self.code_points) * glyph_width * glyph_height]
+        return self._data
+
+    def get_glyph_index(self, code_point):
+        glyph_index = self._glyph_indexes.get(code_point)
+        if glyph_index is None:
+            glyph_index = self._glyph_indexes[self.fallback_code_point]
+        return glyph_index
+
+    def get_glyph(self, code_point):
+        glyph_width, glyph_height = self.glyph_size
+        block_size = glyph_width * glyph_height
+        glyph_index = self.get_glyph_index(code_point)
+        return self.data[glyph_index * block_size:(glyph_index + 1) * block_size]
+
+    def render(self, text):
+        # Returns (width, height, indexes) for the text, one glyph cell per character, with a line per '\\n'.
+        glyph_width, glyph_height = self.glyph_size
+        lines = text.split('\\n')
+        width = max(len(line) for line in lines) * glyph_width
+        height = len(lines) * glyph_height
+        indexes = bytearray(width * height)
+
+        for line_index, line in enumerate(lines):
+            for column, character in enumerate(line):
+                glyph = self.get_glyph(ord(character))
+                offset = line_index * glyph_height * width + column * glyph_width
+                for j in range(glyph_height):
+                    indexes[offset + j * width:offset + j * width + glyph_width] = glyph[j * glyph_width:(j + 1) * glyph_width]
+
+        return width, height, indexes
+
+    def to_rgba(self, indexes):
+        colors = [bytes(color) for color in self.palette]
+        return b''.join(colors[index] for index in indexes)
+
+_BITS = [bytes((byte >> (7 - i)) & 1 for i in range(8)) for byte in range(256)]
+_FONT_CACHE = {}
+
+def get_font(subsheet_name, variant_name='plain'):
+    key = (subsheet_name, variant_name)
+    font = _FONT_CACHE.get(key)
+    if font is None:
+        if variant_name not in FONTS.get(subsheet_name, ()):
+            raise KeyError('No baked font for subsheet "' + subsheet_name + '" variant "' + variant_name + '"')
+        module = importlib.import_module('.' + FONTS[subsheet_name][variant_name], __name__)
+        font = Font(module, variant_name)
+        _FONT_CACHE[key] = font
+    return font
+'''
+
+def get_plane_count(bank):
+    max_index = max(bank.data.tobytes()) if len(bank) else 0
+    return max(max_index.bit_length(), 1)
+
+def encode_bitplanes(bank, plane_count):
+    # Bit plane p holds bit p of every pixel's palette index, packed most significant bit first.
+    data = bank.data.tobytes()
+    data += bytes(-len(data) % 8)
+    planes = b''
+
+    for plane in range(plane_count):
+        bit_lookup = bytes(ord('0') + ((i >> plane) & 1) for i in range(256))
+        bits = data.translate(bit_lookup)
+        planes += int(bits, 2).to_bytes(len(data) // 8, 'big')
+
+    return zlib.compress(planes, 9)
+
+def format_bytes(data, indent):
+    lines = [repr(data[i:i + FONT_MODULE_BYTES_PER_LINE]) for i in range(0, len(data), FONT_MODULE_BYTES_PER_LINE)] or ["b''"]
+    return '(\n' + ''.join(indent + '    ' + line + '\n' for line in lines) + indent + ')'
+
+def write_subsheet_module(output_file, subsheet, variants):
+    code_point_map = common.get_code_point_map(subsheet.name)
+    bank = variants[0][1]
+
+    output_file.write('# Generated by bake_glyph_module.py from the "' + subsheet.name + '" subsheet. Do not edit.\n')
+    output_file.write('NAME = ' + repr(subsheet.name) + '\n')
+    output_file.write('GLYPH_SIZE = ' + repr(tuple(subsheet.glyph_size)) + '\n')
+    output_file.write('ASCENT_DESCENT = ' + repr(tuple(subsheet.ascent_descent)) + '\n')
+    output_file.write('FALLBACK_CODE_POINT = ' + repr(code_point_map.fallback_code_point) + '\n')
+    output_file.write('CODE_POINTS = ' + repr(tuple(bank.code_points)) + '\n')
+    output_file.write('NAMES = ' + repr(tuple(bank.names)) + '\n')
+    output_file.write('VARIANTS = {\n')
+
+    for variant_name, bank in variants:
+        plane_count = get_plane_count(bank)
+        palette = tuple(bank.colors[:1 << plane_count])
+        output_file.write('    ' + repr(variant_name) + ': (' + repr(palette) + ', ' + str(plane_count) + ', ' + format_bytes(encode_bitplanes(bank, plane_count), '    ') + '),\n')
+
+    output_file.write('}\n')
+
+def bake_glyph_module(force_replace, subsheet_filter=None, variant_filter=None):
+    if force_replace:
+        try:
+            shutil.rmtree(FONT_MODULE_OUTPUT_FOLDER)
+        except FileNotFoundError:
+            pass
+
+    if os.path.exists(FONT_MODULE_OUTPUT_FOLDER):
+        print('Path "' + FONT_MODULE_OUTPUT_FOLDER + '" already exists.')
+        return
+
+    generate_sheets.create_directory_verbose(FONT_MODULE_OUTPUT_FOLDER)
+
+    subsheets = [subsheet for subsheet_name, subsheet in generate_sheets.FONT_SUBSHEETS.items()
+        if subsheet_filter is None or subsheet_name in subsheet_filter]
+    source_pages = generate_sheets.FontSourcePages(subsheets)
+    fonts = {}
+
+    for subsheet in subsheets:
+        subsheet_name = subsheet.name
+        print('Processing "' + subsheet_name + '" subsheet...')
+        subsheet_source_image = generate_sheets.load_subsheet_source(source_pages, subsheet)
+        variants = []
+
+        for variant_name in subsheet.variants:
+            if variant_filter is not None and variant_name not in variant_filter:
+                continue
+
+            variant = generate_sheets.FONT_VARIANTS[variant_name]
+            print('  - Generating variant "' + variant_name + '"...')
+            rgba_image = variant.generate_func(subsheet_source_image, subsheet, variant)
+            if rgba_image is None:
+                print('  - Not implemented, skipping variant "' + variant_name + '".')
+                continue
+
+            variants.append((variant_name, generate_sheets.GlyphBank.from_indexed_image(subsheet, generate_sheets.generate_indexed_image(rgba_image))))
+
+        if not variants:
+            continue
+
+        module_name = '_' + subsheet_name
+        with generate_sheets.open_file_verbose(os.path.join(FONT_MODULE_OUTPUT_FOLDER, module_name + '.py'), 'w') as output_file:
+            write_subsheet_module(output_file, subsheet, variants)
+
+        fonts[subsheet_name] = {variant_name: module_name for variant_name, bank in variants}
+
+    with generate_sheets.open_file_verbose(os.path.join(FONT_MODULE_OUTPUT_FOLDER, '__init__.py'), 'w') as output_file:
+        output_file.write(RUNTIME_SOURCE % {'fonts': pprint.pformat(fonts, indent=4)})
+
+    print('')
+    print('BAKING COMPLETE.')
+
+if __name__ == '__main__':
+    import sys
+
+    force_replace = False
+    subsheet_filter = None
+    variant_filter = None
+
+    for arg in sys.argv[1:]:
+        if arg == '--force-replace':
+            force_replace = True
+        elif arg.startswith('--subsheets='):
+            subsheet_filter = common.parse_name_filter(arg[len('--subsheets='):], generate_sheets.FONT_SUBSHEETS, 'subsheet')
+        elif arg.startswith('--variants='):
+            variant_filter = common.parse_name_filter(arg[len('--variants='):], generate_sheets.FONT_VARIANTS, 'variant')
+        else:
+            raise Exception('Unrecognized argument "' + arg + "'")
+
+    bake_glyph_module(force_replace, subsheet_filter, variant_filter)
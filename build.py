@@ -2,7 +2,7 @@
 import subprocess
 import re
 
-def run_script(path, args):
+def start_script(path, args):
     with open(path) as f:
         line = f.readline()
         print(line)
@@ -10,32 +10,71 @@ def run_script(path, args):
         command = match.group(2)
     
     print(command + ' ' + path + ' ' + args)
-    result = subprocess.run(command + ' ' + path + ' ' + args)
-    result.check_returncode()
+    return subprocess.Popen(command + ' ' + path + ' ' + args)
+
+def run_script(path, args):
+    process = start_script(path, args)
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, path)
+
+def run_script_shards(path, args, shard_count):
+    if shard_count is None:
+        run_script(path, args)
+        return
+
+    # The shards are independent, so they run side by side, then one merge puts their outputs together.
+    processes = [start_script(path, ' '.join(['--shard=' + str(index) + '/' + str(shard_count), args]))
+        for index in range(1, shard_count + 1)]
+    for process in processes:
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, path)
+
+    run_script(path, ' '.join(['--merge-shards=' + str(shard_count), args]))
 
 if __name__ == '__main__':
     import sys 
 
     force_replace = False
+    generate_args = []
+    convert_args = []
+    bake_args = []
+    shard_count = None
 
     for arg in sys.argv[1:]:
         if arg == '--force-replace':
             force_replace = True
+        elif arg.startswith('--subsheets=') or arg.startswith('--variants='):
+            generate_args.append(arg)
+            convert_args.append(arg)
+            bake_args.append(arg)
+        elif arg.startswith('--formats=') or arg.startswith('--themes=') or arg.startswith('--sdf-upscale=') or arg.startswith('--sdf-spread=') or arg.startswith('--upscales=') or arg.startswith('--profile=') or arg.startswith('--trace-memory=') or arg.startswith('--trace-memory-top='):
+            generate_args.append(arg)
+        elif arg.startswith('--shards='):
+            shard_count = int(arg[len('--shards='):])
         else:
             raise Exception('Unrecognized argument "' + arg + "'")
 
+    if force_replace:
+        generate_args.insert(0, '--force-replace')
+        convert_args.insert(0, '--force-replace')
+        bake_args.insert(0, '--force-replace')
+
     print('GENERATING FONT SHEETS...')
     print('')
 
-    run_script('generate_sheets.py',
-        ('--force-replace' if force_replace else ''))    
+    run_script_shards('generate_sheets.py', ' '.join(generate_args), shard_count)
+
+    print('')
+    print('BAKING PYTHON GLYPH MODULE...')
+    print('')
+
+    run_script('bake_glyph_module.py', ' '.join(bake_args))
 
     print('')
     print('USING FONTFORGE TO CONVERT TO TTF...')
     print('')
 
-    run_script('fontforge_convert_to_ttf.py',
-        ('--force-replace' if force_replace else ''))    
+    run_script_shards('fontforge_convert_to_ttf.py', ' '.join(convert_args), shard_count)
 
     print('')
     print('DONE ALL BUILD STEPS!')
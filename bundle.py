@@ -1,42 +1,246 @@
 #!/usr/bin/env python
-import common
+# Packs the font into a zip. Everything under the current folder is included, except hidden files and anything matched by .gitignore.
+# Entries are written in a fixed order with fixed timestamps, so the same files always give the same zip.
+# Members whose contents did not change since the previous zip are copied over as-is instead of being compressed again.
+import collections
+import concurrent.futures
+import os
+import os.path
+import re
+import struct
+import time
 import zipfile
-import glob
+import zlib
+import common
 
-def make_zip():
-    print('Scanning for files...')
-    files = set(glob.glob('*') + glob.glob('**/*', recursive=True))
-    excluded = set(glob.glob('.*'))
+BUNDLE_COMPRESSION_LEVEL = 9
+BUNDLE_DOS_TIME = 0
+BUNDLE_DOS_DATE = (1980 - 1980) << 9 | 1 << 5 | 1
+BUNDLE_VERSION = 20
+BUNDLE_MAX_ENTRIES = 0xFFFF
+BUNDLE_MAX_SIZE = 0xFFFFFFFF
+
+IgnorePattern = collections.namedtuple('IgnorePattern', ['regex', 'negate', 'directory_only'])
+BundleEntry = collections.namedtuple('BundleEntry', ['name', 'path', 'is_directory', 'mode'])
+BundleMember = collections.namedtuple('BundleMember', ['entry', 'crc', 'file_size', 'method', 'data'])
+
+def compile_ignore_pattern(line):
+    # Follows .gitignore rules: "!" re-includes, a trailing "/" only matches folders,
+    # a pattern with a "/" elsewhere is relative to the top folder, and one without matches a name at any depth.
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+
+    directory_only = line.endswith('/')
+    line = line.rstrip('/')
+
+    anchored = '/' in line
+    line = line.lstrip('/')
+
+    regex = ''
+    i = 0
+    while i < len(line):
+        if line.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif line.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif line[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif line[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif line[i] == '[' and ']' in line[i + 2:]:
+            end = line.index(']', i + 2)
+            characters = line[i + 1:end]
+            if characters.startswith('!'):
+                characters = '^' + characters[1:]
+            regex += '[' + characters.replace('\\', '\\\\') + ']'
+            i = end + 1
+        else:
+            regex += re.escape(line[i])
+            i += 1
+
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+
+    return IgnorePattern(re.compile(regex + '$'), negate, directory_only)
+
+def load_ignore_patterns(path):
+    patterns = []
 
-    print('Excluding .gitignore...')
-    with open('.gitignore') as gitignore:
-        for line in gitignore:
+    with open(path) as ignore_file:
+        for line in ignore_file:
             line = line.strip()
-            excluded = excluded.union(glob.glob(line))
-            if '*' in line:
-                excluded = excluded.union(glob.glob('**/' + line, recursive=True))
+            if line and not line.startswith('#'):
+                patterns.append(compile_ignore_pattern(line))
+
+    return patterns
+
+def is_ignored(patterns, name, is_directory):
+    # The last matching pattern wins, like git.
+    ignored = False
+
+    for pattern in patterns:
+        if pattern.directory_only and not is_directory:
+            continue
+        if pattern.regex.match(name):
+            ignored = not pattern.negate
+
+    return ignored
+
+def find_bundle_entries(patterns, excluded_names):
+    # One walk over the tree. Ignored folders are not entered at all.
+    entries = []
+
+    for folder, folder_names, file_names in os.walk('.'):
+        prefix = '' if folder == '.' else os.path.relpath(folder).replace(os.sep, '/') + '/'
+
+        kept_folder_names = []
+        for folder_name in sorted(folder_names):
+            name = prefix + folder_name
+            if not folder_name.startswith('.') and not is_ignored(patterns, name, True):
+                kept_folder_names.append(folder_name)
+                entries.append(BundleEntry(name + '/', os.path.join(folder, folder_name), True, 0o755))
+        folder_names[:] = kept_folder_names
+
+        for file_name in sorted(file_names):
+            name = prefix + file_name
+            if name in excluded_names or file_name.startswith('.') and name != '.gitignore' or is_ignored(patterns, name, False):
+                continue
+            path = os.path.join(folder, file_name)
+            entries.append(BundleEntry(name, path, False, 0o755 if os.stat(path).st_mode & 0o111 else 0o644))
+
+    entries.sort(key=lambda entry: entry.name)
+    return entries
+
+def read_previous_members(zipname):
+    try:
+        with zipfile.ZipFile(zipname) as previous_zip:
+            return {info.filename: info for info in previous_zip.infolist()}
+    except (FileNotFoundError, zipfile.BadZipFile):
+        return {}
 
+def read_raw_member_data(previous_file, info):
+    previous_file.seek(info.header_offset)
+    header = previous_file.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise Exception('Bad local header for "' + info.filename + '" in previous zip')
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    previous_file.seek(info.header_offset + 30 + name_length + extra_length)
+    return previous_file.read(info.compress_size)
+
+def compress_entry(entry, previous_members):
+    if entry.is_directory:
+        return BundleMember(entry, 0, 0, zipfile.ZIP_STORED, b'')
+
+    with open(entry.path, 'rb') as input_file:
+        data = input_file.read()
+    crc = zlib.crc32(data)
+
+    previous_info = previous_members.get(entry.name)
+    if previous_info is not None and previous_info.CRC == crc and previous_info.file_size == len(data) \
+    and previous_info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        # Unchanged: data None means copy the compressed bytes straight out of the previous zip.
+        return BundleMember(entry, crc, len(data), previous_info.compress_type, None)
+
+    compressor = zlib.compressobj(BUNDLE_COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) >= len(data):
+        return BundleMember(entry, crc, len(data), zipfile.ZIP_STORED, data)
+    return BundleMember(entry, crc, len(data), zipfile.ZIP_DEFLATED, compressed)
+
+def write_zip_member(output_file, member, data):
+    name = member.entry.name.encode('utf-8')
+    flags = 0x800 if not member.entry.name.isascii() else 0
+    offset = output_file.tell()
+
+    if offset > BUNDLE_MAX_SIZE or len(data) > BUNDLE_MAX_SIZE or member.file_size > BUNDLE_MAX_SIZE:
+        raise Exception('"' + member.entry.name + '" does not fit in a zip without zip64 extensions')
+
+    output_file.write(struct.pack('<IHHHHHIIIHH', 0x04034B50, BUNDLE_VERSION, flags, member.method,
+        BUNDLE_DOS_TIME, BUNDLE_DOS_DATE, member.crc, len(data), member.file_size, len(name), 0))
+    output_file.write(name)
+    output_file.write(data)
+
+    external_attributes = ((0o040000 if member.entry.is_directory else 0o100000) | member.entry.mode) << 16
+    if member.entry.is_directory:
+        external_attributes |= 0x10
+
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014B50, 3 << 8 | BUNDLE_VERSION, BUNDLE_VERSION, flags, member.method,
+        BUNDLE_DOS_TIME, BUNDLE_DOS_DATE, member.crc, len(data), member.file_size, len(name), 0, 0, 0, 0,
+        external_attributes, offset) + name
+
+def write_zip_end(output_file, central_directory, entry_count):
+    offset = output_file.tell()
+    if entry_count > BUNDLE_MAX_ENTRIES or offset > BUNDLE_MAX_SIZE:
+        raise Exception('Bundle does not fit in a zip without zip64 extensions')
+
+    output_file.write(central_directory)
+    output_file.write(struct.pack('<IHHHHIIH', 0x06054B50, 0, 0, entry_count, entry_count, len(central_directory), offset, 0))
+
+def make_zip(reuse=True, worker_count=None):
     zipname = common.FONT_NAME + '_font.zip'
+    start_time = time.perf_counter()
+
+    print('Scanning for files...')
+    patterns = load_ignore_patterns('.gitignore')
+    entries = find_bundle_entries(patterns, {zipname})
+    print('  - ' + str(len(entries)) + ' entries.')
 
-    files = files.difference(excluded)
-    files = files.union(['.gitignore'])
-    files = files.difference([zipname])
+    previous_members = read_previous_members(zipname) if reuse else {}
+    if previous_members:
+        print('Reusing unchanged members from "' + zipname + '"...')
 
     print('Creating zip...')
 
-    with zipfile.ZipFile(zipname, 'w') as zf:
-        for file in files:
-            print(file + '...')
-            zf.write(file)
-            print('...OK.')
-            
+    compressed_count = 0
+    reused_count = 0
+    central_directory = bytearray()
+
+    with concurrent.futures.ThreadPoolExecutor(worker_count or os.cpu_count()) as executor, \
+    common.AtomicFileWriter(zipname, 'wb') as output_file, \
+    open(zipname if previous_members else os.devnull, 'rb') as previous_file:
+        # map hands the results back in entry order, while zlib compresses on the pool without holding the GIL.
+        for member in executor.map(lambda entry: compress_entry(entry, previous_members), entries):
+            data = member.data
+            if data is None:
+                data = read_raw_member_data(previous_file, previous_members[member.entry.name])
+                reused_count += 1
+            elif not member.entry.is_directory:
+                print('  - ' + member.entry.name)
+                compressed_count += 1
+
+            central_directory += write_zip_member(output_file, member, data)
+
+        write_zip_end(output_file, central_directory, len(entries))
+
+    with zipfile.ZipFile(zipname) as output_zip:
+        bad_name = output_zip.testzip()
+        if bad_name is not None:
+            raise Exception('Bundle check failed for "' + bad_name + '"')
+
     print('')
+    print('Compressed ' + str(compressed_count) + ' files, reused ' + str(reused_count) + ' unchanged files, in {:.2f}s.'.format(time.perf_counter() - start_time))
     print('Saved to "' + zipname + '"!')
     print('')
     print('DONE.')
 
 
 if __name__ == '__main__':
-    import sys 
+    import sys
+
+    reuse = True
+    worker_count = None
+
+    for arg in sys.argv[1:]:
+        if arg == '--recompress':
+            reuse = False
+        elif arg.startswith('--workers='):
+            worker_count = int(arg[len('--workers='):])
+        else:
+            raise Exception('Unrecognized argument "' + arg + "'")
 
-    make_zip()
\ No newline at end of file
+    make_zip(reuse, worker_count)
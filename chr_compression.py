@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# Compression schemes for the CHR outputs, with reference decoders that are simple enough to port to a retro target.
+# Only uses the Python standard library, so games' build tools can import it without Pillow.
+
+# PackBits RLE (as used by MacPaint, TIFF, and many homebrew tile loaders).
+# Each packet starts with a header byte n:
+#   0 .. 127: copy the next n + 1 bytes literally.
+#   129 .. 255: repeat the next byte 257 - n times.
+#   128: no-op.
+
+def encode_rle(data):
+    result = bytearray()
+    literal_start = 0
+    i = 0
+
+    while i < len(data):
+        run_length = 1
+        while i + run_length < len(data) and run_length < 128 and data[i + run_length] == data[i]:
+            run_length += 1
+
+        # Runs of 2 only pay off when they do not interrupt a literal.
+        if run_length >= 3 or run_length == 2 and literal_start == i:
+            flush_rle_literals(result, data, literal_start, i)
+            result.append(257 - run_length)
+            result.append(data[i])
+            i += run_length
+            literal_start = i
+        else:
+            i += run_length
+
+    flush_rle_literals(result, data, literal_start, len(data))
+    return bytes(result)
+
+def flush_rle_literals(result, data, start, end):
+    while start < end:
+        count = min(end - start, 128)
+        result.append(count - 1)
+        result += data[start:start + count]
+        start += count
+
+def decode_rle(data):
+    result = bytearray()
+    i = 0
+
+    while i < len(data):
+        n = data[i]
+        i += 1
+
+        if n < 128:
+            result += data[i:i + n + 1]
+            i += n + 1
+        elif n > 128:
+            result += bytes([data[i]]) * (257 - n)
+            i += 1
+
+    return bytes(result)
+
+# LZSS in the layout of the GBA/DS BIOS "LZ77" (type 0x10) decompressor.
+# Header: 0x10, then the decompressed size as a 24-bit little-endian number.
+# Then groups of 8 blocks, each preceded by a flag byte (most significant bit first):
+#   0: one literal byte.
+#   1: two bytes, ((length - 3) << 12) | (distance - 1) in big-endian order,
+#      which copies length (3 .. 18) bytes starting distance (1 .. 4096) bytes back in the output.
+
+LZ_MIN_LENGTH = 3
+LZ_MAX_LENGTH = 18
+LZ_MAX_DISTANCE = 4096
+
+def encode_lz(data):
+    if len(data) >= 1 << 24:
+        raise Exception('Data is too large for the LZ header (' + str(len(data)) + ' bytes)')
+
+    result = bytearray([0x10, len(data) & 0xFF, (len(data) >> 8) & 0xFF, (len(data) >> 16) & 0xFF])
+    positions = {}
+    i = 0
+
+    while i < len(data):
+        flag_offset = len(result)
+        result.append(0)
+
+        for block in range(8):
+            if i >= len(data):
+                break
+
+            best_length = 0
+            best_distance = 0
+
+            for candidate in reversed(positions.get(bytes(data[i:i + LZ_MIN_LENGTH]), [])):
+                distance = i - candidate
+                if distance > LZ_MAX_DISTANCE:
+                    break
+
+                length = 0
+                while length < LZ_MAX_LENGTH and i + length < len(data) and data[candidate + length] == data[i + length]:
+                    length += 1
+
+                if length > best_length:
+                    best_length = length
+                    best_distance = distance
+                    if length == LZ_MAX_LENGTH:
+                        break
+
+            if best_length >= LZ_MIN_LENGTH:
+                result[flag_offset] |= 0x80 >> block
+                value = ((best_length - LZ_MIN_LENGTH) << 12) | (best_distance - 1)
+                result.append(value >> 8)
+                result.append(value & 0xFF)
+                step = best_length
+            else:
+                result.append(data[i])
+                step = 1
+
+            for j in range(i, i + step):
+                positions.setdefault(bytes(data[j:j + LZ_MIN_LENGTH]), []).append(j)
+            i += step
+
+    return bytes(result)
+
+def decode_lz(data):
+    if data[0] != 0x10:
+        raise Exception('Not LZ data (header byte ' + hex(data[0]) + ')')
+
+    size = data[1] | (data[2] << 8) | (data[3] << 16)
+    result = bytearray()
+    i = 4
+
+    while len(result) < size:
+        flags = data[i]
+        i += 1
+
+        for block in range(8):
+            if len(result) >= size:
+                break
+
+            if flags & (0x80 >> block):
+                value = (data[i] << 8) | data[i + 1]
+                i += 2
+                length = (value >> 12) + LZ_MIN_LENGTH
+                start = len(result) - (value & 0xFFF) - 1
+                # Copied byte by byte, because the source is allowed to overlap the bytes being written.
+                for j in range(length):
+                    result.append(result[start + j])
+            else:
+                result.append(data[i])
+                i += 1
+
+    return bytes(result)
+
+CHR_CODECS = {
+    'rle': (encode_rle, decode_rle),
+    'lz': (encode_lz, decode_lz),
+}
+
+def compress_verified(codec_name, data):
+    encode_func, decode_func = CHR_CODECS[codec_name]
+    compressed = encode_func(data)
+
+    if decode_func(compressed) != data:
+        raise Exception('Round trip through "' + codec_name + '" compression did not reproduce the original data')
+
+    return compressed
+
+if __name__ == '__main__':
+    import glob
+    import os.path
+    import sys
+    import common
+
+    # Checks every compressed CHR file against the raw CHR file it was made from.
+    # Usage: chr_compression.py [assets folder]
+    assets_folder = sys.argv[1] if len(sys.argv) > 1 else common.FONT_OUTPUT_FOLDER
+    checked_count = 0
+    failed_count = 0
+
+    for codec_name, (encode_func, decode_func) in CHR_CODECS.items():
+        for compressed_path in sorted(glob.glob(os.path.join(assets_folder, 'chr_*_' + codec_name, '*.' + codec_name))):
+            raw_folder = os.path.basename(os.path.dirname(compressed_path))[:-len('_' + codec_name)]
+            raw_path = os.path.join(assets_folder, raw_folder, os.path.splitext(os.path.basename(compressed_path))[0] + '.chr')
+
+            with open(compressed_path, 'rb') as compressed_file, open(raw_path, 'rb') as raw_file:
+                ok = decode_func(compressed_file.read()) == raw_file.read()
+
+            checked_count += 1
+            if not ok:
+                failed_count += 1
+                print('MISMATCH: "' + compressed_path + '" does not decode to "' + raw_path + '"')
+
+    print('Checked ' + str(checked_count) + ' compressed files, ' + str(failed_count) + ' failed.')
+    sys.exit(1 if failed_count else 0)
@@ -1,7 +1,18 @@
+import array
+import json
+import os
+import os.path
+import shutil
+import uuid
+
 FONT_NAME = 'omelette'
 FONT_PREFIX = 'om'
 FONT_OUTPUT_FOLDER = 'assets'
 FONT_SOURCE_FILENAME = 'omelette_source.png'
+FONT_SOURCE_MAIN_PAGE = 'main'
+FONT_SOURCE_PAGES = {
+    FONT_SOURCE_MAIN_PAGE: FONT_SOURCE_FILENAME,
+}
 FONT_COPYRIGHT = 'Copyright (C) 2022 by Andrew G. Crowell. Creative Commons Attribution 4.0 International License (CC BY 4.0).'
 FONT_AUTHOR = 'eggboycolor'
 
@@ -146,4 +157,204 @@ FONT_ICON_MAPPINGS = {
     'window': [ord(i) for i in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'],
     'buttons': [i for i in range(32, 128)],
     'icons': [ord(i) for i in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789!@'],
-}
\ No newline at end of file
+}
+
+def parse_name_filter(value, known_names, description):
+    names = set(name for name in value.split(',') if name)
+
+    for name in names:
+        if name not in known_names:
+            raise Exception('Unknown ' + description + ' "' + name + '" (expected one of: ' + ', '.join(known_names) + ')')
+
+    return names
+
+FONT_ASCII_MAPPING = [i for i in range(32, 128)]
+
+# Code points tried in order when text asks for a character that a subsheet does not have.
+# If none of them are present either, the first glyph of the subsheet is used.
+FONT_FALLBACK_CODE_POINTS = [0x20]
+
+class CodePointMap:
+    """Two-level code point to glyph index table, similar to a paged cmap.
+
+    The high bits of a code point select a leaf page through page_table, and the low bits index into that leaf.
+    Pages with no glyphs share leaf 0, so the table stays small no matter how sparse the mapped ranges are.
+    """
+
+    PAGE_BITS = 8
+    PAGE_SIZE = 1 << PAGE_BITS
+    PAGE_MASK = PAGE_SIZE - 1
+    PAGE_COUNT = 0x110000 >> PAGE_BITS
+    MISSING = 0xFFFF
+
+    def __init__(self, code_points, fallback_code_points=FONT_FALLBACK_CODE_POINTS):
+        # A code point of -1 marks a glyph that no character maps to.
+        self.code_points = array.array('l', code_points)
+        self.page_table = array.array('H', [0]) * CodePointMap.PAGE_COUNT
+        self.leaves = [array.array('H', [CodePointMap.MISSING]) * CodePointMap.PAGE_SIZE]
+
+        for glyph_index, code_point in enumerate(self.code_points):
+            if code_point < 0:
+                continue
+
+            page = code_point >> CodePointMap.PAGE_BITS
+            leaf_index = self.page_table[page]
+
+            if leaf_index == 0:
+                leaf_index = len(self.leaves)
+                self.leaves.append(array.array('H', [CodePointMap.MISSING]) * CodePointMap.PAGE_SIZE)
+                self.page_table[page] = leaf_index
+
+            leaf = self.leaves[leaf_index]
+            if leaf[code_point & CodePointMap.PAGE_MASK] == CodePointMap.MISSING:
+                leaf[code_point & CodePointMap.PAGE_MASK] = glyph_index
+
+        self.fallback_glyph_index = 0
+        for code_point in fallback_code_points:
+            glyph_index = self.get_glyph_index(code_point)
+            if glyph_index is not None:
+                self.fallback_glyph_index = glyph_index
+                break
+
+    def __len__(self):
+        return len(self.code_points)
+
+    def __contains__(self, code_point):
+        return self.get_glyph_index(code_point) is not None
+
+    def get_glyph_index(self, code_point):
+        if code_point < 0 or code_point >= 0x110000:
+            return None
+        glyph_index = self.leaves[self.page_table[code_point >> CodePointMap.PAGE_BITS]][code_point & CodePointMap.PAGE_MASK]
+        return None if glyph_index == CodePointMap.MISSING else glyph_index
+
+    def get_code_point(self, glyph_index):
+        return self.code_points[glyph_index]
+
+    def lookup(self, code_point):
+        glyph_index = self.get_glyph_index(code_point)
+        return self.fallback_glyph_index if glyph_index is None else glyph_index
+
+    @property
+    def fallback_code_point(self):
+        return self.code_points[self.fallback_glyph_index]
+
+CODE_POINT_MAPS = {}
+
+def get_code_point_map(subsheet_name):
+    code_point_map = CODE_POINT_MAPS.get(subsheet_name)
+    if code_point_map is None:
+        code_point_map = CodePointMap(FONT_ICON_MAPPINGS.get(subsheet_name, FONT_ASCII_MAPPING))
+        CODE_POINT_MAPS[subsheet_name] = code_point_map
+    return code_point_map
+
+# Sharded builds: each shard takes every n-th job of a deterministic job list, and writes into its own staging folder
+# with a manifest, so shards can run on different machines. A merge step then copies every shard's files into the final tree.
+FONT_STAGING_FOLDER = 'staging'
+FONT_SHARD_MANIFEST_FILENAME = 'manifest.json'
+
+def parse_shard(value):
+    # "i/n", where i counts from 1.
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise Exception('Invalid shard "' + value + '" (expected i/n, eg. 1/4)')
+
+    if count < 1 or not 1 <= index <= count:
+        raise Exception('Invalid shard "' + value + '" (expected 1 <= i <= n)')
+
+    return index, count
+
+def select_shard_jobs(jobs, shard):
+    index, count = shard
+    return [job for job_number, job in enumerate(jobs) if job_number % count == index - 1]
+
+def get_shard_folder(step_name, shard):
+    index, count = shard
+    return os.path.join(FONT_STAGING_FOLDER, step_name + '_' + str(index) + '_of_' + str(count))
+
+class AtomicFileWriter:
+    """Writes to a uniquely named temporary file next to path, and renames it over path only once it was written completely.
+
+    Readers and concurrent writers on a shared volume see either the old file or the new one, never a partial file.
+    Attributes other than name are forwarded to the temporary file.
+    """
+
+    def __init__(self, path, mode):
+        self.name = path
+        self.temp_path = path + '.' + uuid.uuid4().hex + '.tmp'
+        self.file = open(self.temp_path, mode)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.temp_path, self.name)
+        else:
+            os.remove(self.temp_path)
+
+def copy_file_atomic(source_path, destination_path):
+    with AtomicFileWriter(destination_path, 'wb') as destination_file, open(source_path, 'rb') as source_file:
+        shutil.copyfileobj(source_file, destination_file)
+
+def list_files(folder):
+    return sorted(os.path.relpath(os.path.join(path, filename), folder).replace(os.sep, '/')
+        for path, folder_names, filenames in os.walk(folder)
+        for filename in filenames)
+
+def write_shard_manifest(step_name, shard, jobs, output_folder):
+    index, count = shard
+    manifest_path = os.path.join(get_shard_folder(step_name, shard), FONT_SHARD_MANIFEST_FILENAME)
+    print('  - Writing "' + manifest_path + '"...')
+
+    with AtomicFileWriter(manifest_path, 'w') as manifest_file:
+        json.dump({
+            'step': step_name,
+            'shard': index,
+            'shard_count': count,
+            'jobs': [list(job) for job in jobs],
+            'files': list_files(output_folder),
+        }, manifest_file, indent=1)
+
+def merge_shards(step_name, shard_count, shard_output_folder, output_folder):
+    # shard_output_folder is where the shard's files live inside its staging folder, relative to it.
+    manifests = []
+
+    for index in range(1, shard_count + 1):
+        manifest_path = os.path.join(get_shard_folder(step_name, (index, shard_count)), FONT_SHARD_MANIFEST_FILENAME)
+        try:
+            with open(manifest_path) as manifest_file:
+                manifests.append(json.load(manifest_file))
+        except FileNotFoundError:
+            raise Exception('Missing manifest "' + manifest_path + '", shard ' + str(index) + '/' + str(shard_count) + ' has not finished')
+
+    sources = {}
+
+    for manifest in manifests:
+        shard_folder = os.path.join(get_shard_folder(step_name, (manifest['shard'], shard_count)), shard_output_folder)
+        for relative_path in manifest['files']:
+            source_path = os.path.join(shard_folder, relative_path)
+            previous_source_path = sources.get(relative_path)
+
+            # Folders that every shard creates can hold the same file twice. Anything else would be two shards disagreeing.
+            if previous_source_path is not None:
+                with open(previous_source_path, 'rb') as previous_file, open(source_path, 'rb') as source_file:
+                    if previous_file.read() != source_file.read():
+                        raise Exception('Shards disagree about "' + relative_path + '" ("' + previous_source_path + '" vs "' + source_path + '")')
+                continue
+
+            sources[relative_path] = source_path
+
+    print('Merging ' + str(len(sources)) + ' files from ' + str(shard_count) + ' shards into "' + output_folder + '"...')
+
+    for relative_path, source_path in sorted(sources.items()):
+        destination_path = os.path.join(output_folder, relative_path)
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        copy_file_atomic(source_path, destination_path)
+
+    return sorted(sources)
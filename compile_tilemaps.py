@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# Compiles a script of fixed strings into a CHR bank holding only the 8x8 tiles those strings use, plus a tilemap per string.
+# Each string is drawn with a subsheet/variant, cut into 8x8 tiles, and every distinct tile is stored once, so glyphs of any size
+# (including the multi-tile "tall" and "large" glyphs, and pairs of the 4 pixel wide ones) share tiles wherever their pixels match.
+#
+# Script format, one string per line ("#" starts a comment line, "\n" in a string starts a new row of text):
+#
+#   title = PRESS START
+#   game_over = GAME\nOVER
+import collections
+import json
+import os
+import os.path
+import re
+import shutil
+import common
+import generate_sheets
+
+TILEMAP_TILE_SIZE = 8
+TILEMAP_MAX_TILES = 256
+
+TilemapString = collections.namedtuple('TilemapString', ['name', 'text'])
+Tilemap = collections.namedtuple('Tilemap', ['name', 'text', 'width', 'height', 'data'])
+
+def parse_tilemap_script(path):
+    strings = []
+
+    with open(path, encoding='utf-8') as script_file:
+        for line_number, line in enumerate(script_file, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+
+            match = re.match(r'\s*([A-Za-z_][A-Za-z0-9_]*)\s*=\s?(.*)$', line)
+            if match is None:
+                raise Exception(path + ':' + str(line_number) + ': expected "name = text"')
+
+            name, text = match.group(1), match.group(2).replace('\\n', '\n')
+            if any(string.name == name for string in strings):
+                raise Exception(path + ':' + str(line_number) + ': string "' + name + '" is defined twice')
+            if not text:
+                raise Exception(path + ':' + str(line_number) + ': string "' + name + '" is empty')
+
+            strings.append(TilemapString(name, text))
+
+    return strings
+
+def load_glyph_bank(subsheet, variant, target_name):
+    source_image = generate_sheets.load_subsheet_source(generate_sheets.FontSourcePages([subsheet]), subsheet)
+    rgba_image = variant.generate_func(source_image, subsheet, variant)
+    if rgba_image is None:
+        raise Exception('Variant "' + variant.name + '" is not implemented')
+
+    indexed_image = generate_sheets.generate_indexed_image(rgba_image)
+    derived = generate_sheets.DerivedCache(subsheet, variant, rgba_image, indexed_image)
+
+    validator_name = generate_sheets.CHR_TARGETS[target_name].validator
+    if not generate_sheets.FONT_VALIDATORS[validator_name].validate_func(variant, rgba_image, indexed_image, derived):
+        raise Exception('Subsheet "' + subsheet.name + '" variant "' + variant.name + '" does not fit the "' + target_name + '" target (fails the "' + validator_name + '" validator)')
+
+    return derived.get('glyph_bank')
+
+def render_index_plane(bank, code_point_map, text):
+    # Same layout as the glyph sheets: one cell per character, padded up to whole tiles with index 0.
+    glyph_width, glyph_height = bank.glyph_size
+    lines = text.split('\n')
+    width = -(-max(len(line) for line in lines) * glyph_width // TILEMAP_TILE_SIZE) * TILEMAP_TILE_SIZE
+    height = -(-len(lines) * glyph_height // TILEMAP_TILE_SIZE) * TILEMAP_TILE_SIZE
+    index_plane = bytearray(width * height)
+
+    for line_index, line in enumerate(lines):
+        for column, character in enumerate(line):
+            glyph_index = code_point_map.get_glyph_index(ord(character))
+            if glyph_index is None and code_point_map.fallback_code_point in common.FONT_FALLBACK_CODE_POINTS:
+                glyph_index = code_point_map.fallback_glyph_index
+            if glyph_index is None:
+                raise Exception('No glyph for ' + repr(character) + ' in ' + repr(text) + ', and no fallback glyph to use instead')
+            offset = line_index * glyph_height * width + column * glyph_width
+            for j in range(glyph_height):
+                index_plane[offset + j * width:offset + j * width + glyph_width] = bank.get_glyph_row(glyph_index, j)
+
+    return width, height, index_plane
+
+def get_tile_rows(index_plane, width, tile_x, tile_y):
+    return [index_plane[(tile_y * TILEMAP_TILE_SIZE + j) * width + tile_x * TILEMAP_TILE_SIZE:(tile_y * TILEMAP_TILE_SIZE + j) * width + (tile_x + 1) * TILEMAP_TILE_SIZE]
+        for j in range(TILEMAP_TILE_SIZE)]
+
+def create_blank_tile(encode_tile):
+    return encode_tile([bytes(TILEMAP_TILE_SIZE)] * TILEMAP_TILE_SIZE)
+
+def compile_tilemaps(strings, bank, code_point_map, target_name, first_tile):
+    encode_tile = generate_sheets.CHR_TARGETS[target_name].encode_tile_func
+
+    # Tile 0 is always blank, so padding and spaces need no tile of their own.
+    blank_tile = create_blank_tile(encode_tile)
+    tile_indexes = {blank_tile: 0}
+    tiles = [blank_tile]
+    tilemaps = []
+
+    for string in strings:
+        width, height, index_plane = render_index_plane(bank, code_point_map, string.text)
+        tile_columns, tile_rows = width // TILEMAP_TILE_SIZE, height // TILEMAP_TILE_SIZE
+        data = bytearray()
+
+        for tile_y in range(tile_rows):
+            for tile_x in range(tile_columns):
+                tile = encode_tile(get_tile_rows(index_plane, width, tile_x, tile_y))
+                tile_index = tile_indexes.get(tile)
+                if tile_index is None:
+                    tile_index = len(tiles)
+                    tile_indexes[tile] = tile_index
+                    tiles.append(tile)
+                data.append((first_tile + tile_index) & 0xFF)
+
+        tilemaps.append(Tilemap(string.name, string.text, tile_columns, tile_rows, bytes(data)))
+
+    if first_tile + len(tiles) > TILEMAP_MAX_TILES:
+        raise Exception(str(len(tiles)) + ' distinct tiles starting at tile ' + str(first_tile) + ' do not fit in a ' + str(TILEMAP_MAX_TILES) + ' tile bank')
+
+    return b''.join(tiles), tilemaps
+
+def verify_tilemaps(strings, bank, code_point_map, target_name, first_tile, chr_data, tilemaps):
+    # Rebuilding every string from the bank and its tilemap has to give the same tiles as encoding the string directly.
+    encode_tile = generate_sheets.CHR_TARGETS[target_name].encode_tile_func
+    tile_size = len(create_blank_tile(encode_tile))
+
+    for string, tilemap in zip(strings, tilemaps):
+        width, height, index_plane = render_index_plane(bank, code_point_map, string.text)
+        for tile_number, tile_index in enumerate(tilemap.data):
+            tile_x, tile_y = tile_number % tilemap.width, tile_number // tilemap.width
+            offset = (tile_index - first_tile) * tile_size
+            if chr_data[offset:offset + tile_size] != encode_tile(get_tile_rows(index_plane, width, tile_x, tile_y)):
+                raise Exception('Tilemap "' + tilemap.name + '" does not rebuild its string at tile ' + repr((tile_x, tile_y)))
+
+def get_tilemap_output_folder(script_path):
+    return os.path.join(common.FONT_OUTPUT_FOLDER, 'tilemaps', os.path.splitext(os.path.basename(script_path))[0])
+
+def compile_tilemap_script(force_replace, script_path, subsheet_name, variant_name, target_name, first_tile):
+    subsheet = generate_sheets.FONT_SUBSHEETS[subsheet_name]
+    variant = generate_sheets.FONT_VARIANTS[variant_name]
+    if variant_name not in subsheet.variants:
+        raise Exception('Subsheet "' + subsheet_name + '" has no variant "' + variant_name + '"')
+
+    output_folder = get_tilemap_output_folder(script_path)
+    script_name = os.path.basename(output_folder)
+
+    if force_replace:
+        try:
+            shutil.rmtree(output_folder)
+        except FileNotFoundError:
+            pass
+
+    if os.path.exists(output_folder):
+        print('Path "' + output_folder + '" already exists.')
+        return
+
+    print('Reading script "' + script_path + '"...')
+    strings = parse_tilemap_script(script_path)
+
+    print('Generating "' + subsheet_name + '" variant "' + variant_name + '"...')
+    bank = load_glyph_bank(subsheet, variant, target_name)
+    code_point_map = bank.get_code_point_map()
+
+    print('Compiling ' + str(len(strings)) + ' strings for target "' + target_name + '"...')
+    chr_data, tilemaps = compile_tilemaps(strings, bank, code_point_map, target_name, first_tile)
+    verify_tilemaps(strings, bank, code_point_map, target_name, first_tile, chr_data, tilemaps)
+
+    tile_count = len(chr_data) // len(create_blank_tile(generate_sheets.CHR_TARGETS[target_name].encode_tile_func))
+    print('  - ' + str(tile_count) + ' distinct tiles.')
+
+    generate_sheets.create_directory_verbose(output_folder)
+
+    with generate_sheets.open_file_verbose(os.path.join(output_folder, script_name + '_' + target_name + '.chr'), 'wb') as output_file:
+        output_file.write(chr_data)
+
+    for tilemap in tilemaps:
+        with generate_sheets.open_file_verbose(os.path.join(output_folder, tilemap.name + '.map'), 'wb') as output_file:
+            output_file.write(tilemap.data)
+
+    with generate_sheets.open_file_verbose(os.path.join(output_folder, script_name + '.json'), 'w') as output_file:
+        json.dump({
+            'subsheet': subsheet_name,
+            'variant': variant_name,
+            'target': target_name,
+            'chr': script_name + '_' + target_name + '.chr',
+            'first_tile': first_tile,
+            'tile_count': tile_count,
+            'tilemaps': [{
+                'name': tilemap.name,
+                'text': tilemap.text,
+                'file': tilemap.name + '.map',
+                'width': tilemap.width,
+                'height': tilemap.height,
+            } for tilemap in tilemaps],
+        }, output_file, indent=1)
+
+    print('')
+    print('COMPILATION COMPLETE.')
+
+if __name__ == '__main__':
+    import sys
+
+    force_replace = False
+    script_path = None
+    subsheet_name = 'thin'
+    variant_name = 'plain'
+    target_name = 'nes'
+    first_tile = 0
+
+    for arg in sys.argv[1:]:
+        if arg == '--force-replace':
+            force_replace = True
+        elif arg.startswith('--subsheet='):
+            subsheet_name = arg[len('--subsheet='):]
+            common.parse_name_filter(subsheet_name, generate_sheets.FONT_SUBSHEETS, 'subsheet')
+        elif arg.startswith('--variant='):
+            variant_name = arg[len('--variant='):]
+            common.parse_name_filter(variant_name, generate_sheets.FONT_VARIANTS, 'variant')
+        elif arg.startswith('--target='):
+            target_name = arg[len('--target='):]
+            common.parse_name_filter(target_name, generate_sheets.CHR_TARGETS, 'target')
+        elif arg.startswith('--first-tile='):
+            first_tile = int(arg[len('--first-tile='):])
+        elif not arg.startswith('--') and script_path is None:
+            script_path = arg
+        else:
+            raise Exception('Unrecognized argument "' + arg + "'")
+
+    if script_path is None:
+        raise Exception('Missing script path (eg. compile_tilemaps.py strings.txt --target=nes)')
+
+    compile_tilemap_script(force_replace, script_path, subsheet_name, variant_name, target_name, first_tile)
@@ -8,6 +8,7 @@ import common
 import collections
 import shutil
 import re
+import uuid
 
 FONT_OUTPUT_TTF_FOLDER = 'assets/ttf'
 FONT_INPUT_SVG_FOLDER = 'assets/svg_individual'
@@ -16,6 +17,7 @@ FONT_FAMILY_HUMAN_NAME = 'Omelette'
 FONT_PREFIX = 'om'
 FONT_VERSION = 'v1'
 FONT_PIXEL_SCALE = 4
+FONT_SHARD_STEP_NAME = 'ttf'
 
 EXCLUDED_SUBSHEETS = {'buttons'}
 INCLUDED_VARIANTS = {'plain', 'silhouette', 'shadow_outline', 'hshadow_outline', 'vshadow_outline'}
@@ -43,7 +45,7 @@ GLYPH_INDEX_DIGITS = 52
 GLYPH_COUNT_DIGITS = 10
 GLYPH_INDEX_SPECIALS = 52
 
-def convert_svg_to_ttf(force_replace):
+def convert_svg_to_ttf(force_replace, subsheet_filter=None, variant_filter=None, shard=None):
     if force_replace:
         try:
             shutil.rmtree(FONT_OUTPUT_TTF_FOLDER)
@@ -59,7 +61,9 @@ def convert_svg_to_ttf(force_replace):
             return
         pass
 
-    input_folders = glob.glob(os.path.join(FONT_INPUT_SVG_FOLDER, '*'))
+    input_folders = sorted(glob.glob(os.path.join(FONT_INPUT_SVG_FOLDER, '*')))
+    if shard is not None:
+        input_folders = common.select_shard_jobs(input_folders, shard)
     print(input_folders)
 
     for input_folder in input_folders:
@@ -78,6 +82,12 @@ def convert_svg_to_ttf(force_replace):
         subsheet_name = subsheet_match.group(1)
         variant_name = subsheet_match.group(2)
         icon_mapping = common.FONT_ICON_MAPPINGS.get(subsheet_name)
+        code_point_map = common.get_code_point_map(subsheet_name)
+
+        if subsheet_filter is not None and subsheet_name not in subsheet_filter \
+        or variant_filter is not None and variant_name not in variant_filter:
+            print('not selected, skipping...')
+            continue
 
         if subsheet_name in EXCLUDED_SUBSHEETS:
             print('excluded subsheet, skipping...')
@@ -137,7 +147,7 @@ def convert_svg_to_ttf(force_replace):
                 continue
 
             glyph_index = int(glyph_match.group(1))
-            character_code = icon_mapping[glyph_index] if icon_mapping is not None else glyph_index
+            character_code = code_point_map.get_code_point(glyph_index) if icon_mapping is not None else glyph_index
             print('glyph_index ' + str(glyph_index))
             print('character_code ' + str(character_code))
 
@@ -152,17 +162,60 @@ def convert_svg_to_ttf(force_replace):
             glyph.vwidth = metric_info.height * FONT_PIXEL_SCALE
 
         print('Exporting to "' + output_ttf_filename + '"...')
-        font.generate(output_ttf_filename)
+        # FontForge picks the output type from the extension, so the temporary file keeps it.
+        temp_ttf_filename = output_ttf_filename[:-len('.ttf')] + '.' + uuid.uuid4().hex + '.tmp.ttf'
+        try:
+            font.generate(temp_ttf_filename)
+            os.replace(temp_ttf_filename, output_ttf_filename)
+        finally:
+            if os.path.exists(temp_ttf_filename):
+                os.remove(temp_ttf_filename)
+
+    if shard is not None:
+        common.write_shard_manifest(FONT_SHARD_STEP_NAME, shard, [os.path.basename(input_folder) for input_folder in input_folders], FONT_OUTPUT_TTF_FOLDER)
+
+def merge_ttf_shards(force_replace, shard_count):
+    if force_replace:
+        try:
+            shutil.rmtree(FONT_OUTPUT_TTF_FOLDER)
+        except FileNotFoundError:
+            pass
+
+    if os.path.exists(FONT_OUTPUT_TTF_FOLDER):
+        print('Path "' + FONT_OUTPUT_TTF_FOLDER + '" already exists.')
+        return
+
+    common.merge_shards(FONT_SHARD_STEP_NAME, shard_count, FONT_OUTPUT_TTF_FOLDER, FONT_OUTPUT_TTF_FOLDER)
 
 if __name__ == '__main__':
     import sys    
 
     force_replace = False
+    subsheet_filter = None
+    variant_filter = None
+    shard = None
+    merge_shard_count = None
 
     for arg in sys.argv[1:]:
         if arg == '--force-replace':
             force_replace = True
+        elif arg.startswith('--subsheets='):
+            subsheet_filter = common.parse_name_filter(arg[len('--subsheets='):], SUBSHEET_METRIC_INFO, 'subsheet')
+        elif arg.startswith('--variants='):
+            # build.py passes the same filter to generate_sheets.py, so any variant it knows is accepted here.
+            # The ones that aren't converted are skipped below.
+            import generate_sheets
+            variant_filter = common.parse_name_filter(arg[len('--variants='):], generate_sheets.FONT_VARIANTS, 'variant')
+        elif arg.startswith('--shard='):
+            shard = common.parse_shard(arg[len('--shard='):])
+        elif arg.startswith('--merge-shards='):
+            merge_shard_count = int(arg[len('--merge-shards='):])
         else:
             raise Exception('Unrecognized argument "' + arg + "'")
 
-    convert_svg_to_ttf(force_replace)
\ No newline at end of file
+    if merge_shard_count is not None:
+        merge_ttf_shards(force_replace, merge_shard_count)
+    else:
+        if shard is not None:
+            FONT_OUTPUT_TTF_FOLDER = os.path.join(common.get_shard_folder(FONT_SHARD_STEP_NAME, shard), FONT_OUTPUT_TTF_FOLDER)
+        convert_svg_to_ttf(force_replace, subsheet_filter, variant_filter, shard)
@@ -1,11 +1,22 @@
 #!/usr/bin/env python
+import array
 import collections
+import contextlib
+import io
+import json
+import math
+import memory_trace
 import os
 import os.path
 import PIL.Image # requires Pillow / PIL -- pip install pillow
+import PIL.ImageChops
 import shutil
-import svgwrite # requires svgwrite -- pip install svgwrite
+import struct
+import chr_compression
 import common
+import page_font
+import pcf
+import texture_containers
 
 TRANSPARENT = (0, 0, 0, 0)
 MAGENTA = (255, 0, 255, 255)
@@ -19,117 +30,72 @@ PALETTE_DEFAULTS = [
     WHITE,
 ]
 
-FontVariant = collections.namedtuple('FontVariant', ['name', 'generate_func', 'suffix'])
+FontVariant = collections.namedtuple('FontVariant', ['name', 'generate_func', 'suffix', 'shadow'], defaults=(None,))
+
+# kernel: (x, y) offsets that the glyph's ink is dilated by. Shadow pixels never leave the glyph cell they came from.
+# isolate: if set, only the shadow is kept (in white), otherwise the glyph is drawn on top of a black shadow.
+FontShadow = collections.namedtuple('FontShadow', ['kernel', 'isolate'])
+
+SHADOW_KERNEL_H = [(1, 0)]
+SHADOW_KERNEL_V = [(0, 1)]
+SHADOW_KERNEL_HV = [(1, 0), (0, 1), (1, 1)]
 
 def create_silhouette(source_image, fill_color, remove_shadows=False):
-    result_image = source_image.copy()
-    result_data = result_image.load()
-    w, h = result_image.size
+    mask = create_ink_mask(source_image)
+    if remove_shadows:
+        mask = PIL.ImageChops.subtract(mask, create_color_mask(source_image, BLACK))
 
-    for x in range(w): 
-        for y in range(h):
-            color = result_data[(x, y)]
-            result_data[(x, y)] = fill_color if color[3] != 0 and (not remove_shadows or color != BLACK) else TRANSPARENT
+    result_image = PIL.Image.new('RGBA', source_image.size, TRANSPARENT)
+    result_image.paste(fill_color, None, mask)
 
     return result_image
 
 def get_average_brightness(color):
     return (int(color[0]) + int(color[1]) + int(color[2])) // 3
 
-def create_monochrome_sheet(source_image, glyph_size, remove_shadows=False):
-    # TODO: figure out why the whole image is white pixels.
-
-    result_image = source_image.copy()
-    result_data = result_image.load()
-    w, h = result_image.size
-    glyph_width, glyph_height = glyph_size
-
-    for x in range(0, w, glyph_width): 
-        for y in range(0, h, glyph_height):
-            min_brightness = None
-            max_brightness = None
-            for i in range(glyph_width): 
-                for j in range(glyph_height):
-                    color = result_data[(x + i, y + j)]
-
-                    if color[3] == 0 or color == BLACK:
-                        continue
-
-                    brightness = get_average_brightness(color)
-
-                    if min_brightness is None:
-                        min_brightness = brightness
-                    else:
-                        min_brightness = min(min_brightness, brightness)
-
-                    if max_brightness is None:
-                        max_brightness = brightness
-                    else:
-                        max_brightness = max(max_brightness, brightness)                        
-
-            weight = 0.25
-            cutoff_brightness = int(min_brightness * (1 - weight) + max_brightness * weight)
-            if max_brightness == 255 and min_brightness < 128:
-                cutoff_brightness = 100
-
-            for i in range(glyph_width): 
-                for j in range(glyph_height):
-                    color = result_data[(x + i, y + j)]
-
-                    if color[3] == 0:
-                        continue
-                    elif remove_shadows and color == BLACK:
-                        result_data[(x + i, y + j)] = TRANSPARENT
-                    else:
-                        brightness = get_average_brightness(color)
-                        result_data[(x + i, y + j)] = WHITE if brightness >= cutoff_brightness else (TRANSPARENT if remove_shadows else BLACK)
+def replace_color(image, search_color, replacement_color):
+    image.paste(replacement_color, None, create_color_mask(image, search_color))
+    return image
 
-    return result_image
+def create_channel_mask(image, band, test):
+    return image.getchannel(band).point([255 if test(value) else 0 for value in range(256)])
 
-def erase_grid_bleed(image, grid_size, erase_h, erase_v):
-    data = image.load()
-    w, h = image.size
+def create_ink_mask(image):
+    return create_channel_mask(image, 'A', lambda value: value != 0)
 
-    for x in range(w): 
-        for y in range(h):
-            if erase_h and x % grid_size[0] == 0 \
-            or erase_v and y % grid_size[1] == 0:
-                data[(x, y)] = TRANSPARENT
+def create_color_mask(image, color):
+    mask = None
 
-    return image
+    for band, component in zip('RGBA', color):
+        band_mask = create_channel_mask(image, band, lambda value: value == component)
+        mask = band_mask if mask is None else PIL.ImageChops.multiply(mask, band_mask)
 
-def replace_color(image, search_color, replacement_color):
-    data = image.load()
-    w, h = image.size
+    return mask
 
-    for x in range(w): 
-        for y in range(h):
-            if data[(x, y)] == search_color:
-                data[(x, y)] = replacement_color
+def dilate_mask(mask, glyph_size, kernel):
+    w, h = mask.size
+    glyph_width, glyph_height = glyph_size
+    result_mask = PIL.Image.new('L', mask.size, 0)
 
-    return image
+    for dx, dy in kernel:
+        shifted_mask = PIL.Image.new('L', mask.size, 0)
+        shifted_mask.paste(mask, (dx, dy))
 
-def isolate_shadow(image, fill_color):
-    data = image.load()
-    w, h = image.size
+        # Clear the strips that were shifted in from a neighboring glyph cell.
+        if dx != 0:
+            for x in range(0, w, glyph_width):
+                shifted_mask.paste(0, (x, 0, x + dx, h) if dx > 0 else (x + glyph_width + dx, 0, x + glyph_width, h))
+        if dy != 0:
+            for y in range(0, h, glyph_height):
+                shifted_mask.paste(0, (0, y, w, y + dy) if dy > 0 else (0, y + glyph_height + dy, w, y + glyph_height))
 
-    for x in range(w): 
-        for y in range(h):
-            data[(x, y)] = fill_color if data[(x, y)] == BLACK else TRANSPARENT
+        result_mask = PIL.ImageChops.lighter(result_mask, shifted_mask)
 
-    return image
+    return result_mask
 
 def find_used_indexes(indexed_image):
-    data = indexed_image.load()
-    w, h = indexed_image.size
-    unordered_used_indexes = set()
+    unordered_used_indexes = set(indexed_image.tobytes())
     ordered_used_indexes = []
-    
-    for x in range(w):
-        for y in range(h):
-            index = data[(x, y)]
-            if index not in unordered_used_indexes:
-                unordered_used_indexes.add(index)
 
     for i in unordered_used_indexes:
         if i not in PALETTE_DEFAULTS:
@@ -143,86 +109,315 @@ def find_used_indexes(indexed_image):
 
     return ordered_used_indexes
 
-def generate_plain_variant(source_image, subsheet):
-    return source_image.copy()
+GlyphStats = collections.namedtuple('GlyphStats', ['min_brightness', 'max_brightness', 'ink_bounds', 'empty', 'left_bearing', 'right_bearing'])
 
-def generate_plain_black_variant(source_image, subsheet):
-    return replace_color(source_image.copy(), WHITE, BLACK)
+def get_palette(indexed_image):
+    palette_data = indexed_image.getpalette()
+    return [tuple(palette_data[i:i + 3]) for i in range(0, len(palette_data), 3)]
 
-def generate_hshadow_variant(source_image, subsheet):
-    result_image = PIL.Image.new('RGBA', source_image.size, TRANSPARENT)
-    silhouette_image = create_silhouette(source_image, BLACK)
+def is_tone_color(color):
+    return color[3] != 0 and color != BLACK
 
-    result_image.paste(silhouette_image, (1, 0), silhouette_image)
-    erase_grid_bleed(result_image, subsheet.glyph_size, True, False)
-    result_image.paste(source_image, (0, 0), source_image)
+def get_index_plane(indexed_image):
+    return PIL.Image.frombytes('L', indexed_image.size, indexed_image.tobytes())
 
-    return result_image
+def create_glyph_strip(image, glyph_size):
+    # Stacks the glyph cells on top of each other, so the raw pixel data is laid out as [glyph, row, column].
+    glyph_width, glyph_height = glyph_size
+    column_count, row_count = image.width // glyph_width, image.height // glyph_height
+    strip_image = PIL.Image.new(image.mode, (glyph_width, glyph_height * column_count * row_count))
 
-def generate_vshadow_variant(source_image, subsheet):
-    result_image = PIL.Image.new('RGBA', source_image.size, TRANSPARENT)
-    silhouette_image = create_silhouette(source_image, BLACK)
+    for row in range(row_count):
+        for column in range(column_count):
+            glyph_x, glyph_y = column * glyph_width, row * glyph_height
+            strip_image.paste(image.crop((glyph_x, glyph_y, glyph_x + glyph_width, glyph_y + glyph_height)), (0, (row * column_count + column) * glyph_height))
 
-    result_image.paste(silhouette_image, (0, 1), silhouette_image)
-    erase_grid_bleed(result_image, subsheet.glyph_size, False, True)
-    result_image.paste(source_image, (0, 0), source_image)
+    return strip_image
 
-    return result_image
+def create_byte_lookup(values):
+    return bytes(values) + bytes(256 - len(values))
 
-def generate_hvshadow_variant(source_image, subsheet):
-    result_image = PIL.Image.new('RGBA', source_image.size, TRANSPARENT)
-    silhouette_image = create_silhouette(source_image, BLACK)
+def reduce_glyph_blocks(bank):
+    glyph_width, glyph_height = bank.glyph_size
+    block_size = bank.block_size
+    colors = bank.colors
+    data = bank.data.tobytes()
 
-    result_image.paste(silhouette_image, (1, 0), silhouette_image)
-    result_image.paste(silhouette_image, (0, 1), silhouette_image)
-    result_image.paste(silhouette_image, (1, 1), silhouette_image)
-    erase_grid_bleed(result_image, subsheet.glyph_size, True, True)
-    result_image.paste(source_image, (0, 0), source_image)
+    low_data = data.translate(create_byte_lookup([get_average_brightness(color) if is_tone_color(color) else 255 for color in colors]))
+    high_data = data.translate(create_byte_lookup([get_average_brightness(color) if is_tone_color(color) else 0 for color in colors]))
+    tone_data = data.translate(create_byte_lookup([1 if is_tone_color(color) else 0 for color in colors]))
+    ink_data = data.translate(create_byte_lookup([1 if color[3] != 0 else 0 for color in colors]))
 
-    return result_image
+    glyph_stats = []
 
-def generate_silhouette_variant(source_image, subsheet):
-    return create_silhouette(source_image, WHITE, remove_shadows=True)
+    for offset in range(0, len(ink_data), block_size):
+        end = offset + block_size
+        has_tone = any(tone_data[offset:end])
 
-def generate_isolate_shadow_variant(source_image, subsheet):
-    return isolate_shadow(source_image.copy(), WHITE)
+        ink_rows = [ink_data[row_offset:row_offset + glyph_width] for row_offset in range(offset, end, glyph_width)]
+        inked_rows = [j for j, row in enumerate(ink_rows) if any(row)]
+
+        if inked_rows:
+            left = min(glyph_width - len(row.lstrip(b'\0')) for row in ink_rows)
+            right = max(len(row.rstrip(b'\0')) for row in ink_rows)
+            ink_bounds = (left, inked_rows[0], right, inked_rows[-1] + 1)
+        else:
+            ink_bounds = None
+
+        glyph_stats.append(GlyphStats(
+            min(low_data[offset:end]) if has_tone else None,
+            max(high_data[offset:end]) if has_tone else None,
+            ink_bounds,
+            ink_bounds is None,
+            ink_bounds[0] if ink_bounds else glyph_width,
+            glyph_width - ink_bounds[2] if ink_bounds else glyph_width))
+
+    return glyph_stats
+
+def get_monochrome_cutoff(min_brightness, max_brightness):
+    weight = 0.25
+    cutoff_brightness = int(min_brightness * (1 - weight) + max_brightness * weight)
+    if max_brightness == 255 and min_brightness < 128:
+        cutoff_brightness = 100
+    return cutoff_brightness
+
+def create_monochrome_sheet(source_image, subsheet, remove_shadows=False):
+    bank = GlyphBank.from_indexed_image(subsheet, generate_indexed_image(source_image))
+    glyph_stats = reduce_glyph_blocks(bank)
+
+    # Glyphs with a single tone have nothing to threshold against, so they use the range of the whole sheet instead.
+    # Otherwise the same tone would turn white in one tile of a multi-tile button and black in the next.
+    toned_stats = [stats for stats in glyph_stats if stats.min_brightness is not None]
+    sheet_cutoff = get_monochrome_cutoff(
+        min(stats.min_brightness for stats in toned_stats),
+        max(stats.max_brightness for stats in toned_stats)) if toned_stats else 0
+
+    # 0 = transparent, 1 = black, 2 = white
+    result_data = bytearray()
+
+    for glyph, stats in zip(bank, glyph_stats):
+        if stats.min_brightness is None or stats.min_brightness == stats.max_brightness:
+            cutoff_brightness = sheet_cutoff
+        else:
+            cutoff_brightness = get_monochrome_cutoff(stats.min_brightness, stats.max_brightness)
+
+        lookup = []
+        for color in bank.colors:
+            if color[3] == 0 or remove_shadows and color == BLACK:
+                lookup.append(0)
+            else:
+                lookup.append(2 if get_average_brightness(color) >= cutoff_brightness else (0 if remove_shadows else 1))
+
+        result_data += glyph.data.tobytes().translate(create_byte_lookup(lookup))
+
+    result_bank = GlyphBank(bank.glyph_size, bank.column_count, result_data, [MAGENTA[:3], BLACK[:3], WHITE[:3]], bank.code_points, bank.names)
+    return result_bank.to_rgba_image()
+
+def create_rgba_from_index_plane(size, data, palette):
+    # Index 0 is the background, which becomes fully transparent black like the rest of the pipeline expects.
+    image = PIL.Image.frombuffer('P', size, data, 'raw', 'P', 0, 1)
+    image.putpalette([0, 0, 0] + [component for color in palette[1:] for component in color])
+    image.info['transparency'] = 0
+    return image.convert('RGBA')
+
+class GlyphBank:
+    """The palette indexes of a subsheet's glyphs, stored contiguously as [glyph, row, column] bytes.
+
+    code_points and names run parallel to the glyphs. Indexing a bank returns a GlyphView,
+    and slicing it returns a smaller bank; both share the original pixel memory.
+    """
+
+    __slots__ = ('glyph_size', 'column_count', 'data', 'palette', 'code_points', 'names')
+
+    def __init__(self, glyph_size, column_count, data, palette, code_points, names):
+        self.glyph_size = glyph_size
+        self.column_count = column_count
+        self.data = memoryview(data)
+        self.palette = palette
+        self.code_points = code_points
+        self.names = names
+
+    @staticmethod
+    def from_indexed_image(subsheet, indexed_image):
+        column_count, row_count = get_glyph_grid(subsheet, indexed_image.size)
+        glyph_count = column_count * row_count
+        code_point_map = common.get_code_point_map(subsheet.name)
+
+        return GlyphBank(subsheet.glyph_size, column_count,
+            create_glyph_strip(get_index_plane(indexed_image), subsheet.glyph_size).tobytes(),
+            get_palette(indexed_image),
+            array.array('l', [code_point_map.get_code_point(i) if i < len(code_point_map) else -1 for i in range(glyph_count)]),
+            [get_subsheet_glyph_info(subsheet, i)[0] for i in range(glyph_count)])
+
+    def get_code_point_map(self):
+        # Only maps to glyphs that are in the bank. The subsheet's map in common can list more code points
+        # than the sheet has glyphs (the window subsheet maps A-Z onto 24 glyphs).
+        return common.CodePointMap(self.code_points)
+
+    @property
+    def block_size(self):
+        return self.glyph_size[0] * self.glyph_size[1]
+
+    @property
+    def row_count(self):
+        return (len(self) + self.column_count - 1) // self.column_count
+
+    @property
+    def sheet_size(self):
+        return (self.column_count * self.glyph_size[0], self.row_count * self.glyph_size[1])
+
+    @property
+    def colors(self):
+        colors = [TRANSPARENT] + [color + (255,) for color in self.palette[1:]]
+        return colors + [TRANSPARENT] * (256 - len(colors))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for glyph_index in range(len(self)):
+            yield GlyphView(self, glyph_index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise Exception('Glyph bank slices must be contiguous')
+            return GlyphBank(self.glyph_size, self.column_count,
+                self.data[start * self.block_size:stop * self.block_size],
+                self.palette, self.code_points[start:stop], self.names[start:stop])
+
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError('glyph index out of range')
+        return GlyphView(self, key)
+
+    def get_glyph_row(self, glyph_index, j):
+        offset = glyph_index * self.block_size + j * self.glyph_size[0]
+        return self.data[offset:offset + self.glyph_size[0]]
+
+    def get_sheet_row(self, x, y, width):
+        # Reads a row of pixels as if the glyphs were still laid out in their original sheet.
+        glyph_width, glyph_height = self.glyph_size
+        glyph_row, j = y // glyph_height, y % glyph_height
+        parts = []
+
+        while width > 0:
+            glyph_column, i = x // glyph_width, x % glyph_width
+            length = min(glyph_width - i, width)
+            parts.append(self.get_glyph_row(glyph_row * self.column_count + glyph_column, j)[i:i + length])
+            x += length
+            width -= length
+
+        return b''.join(parts)
+
+    def to_index_plane(self):
+        glyph_width, glyph_height = self.glyph_size
+        index_plane = PIL.Image.new('L', self.sheet_size, 0)
+
+        for glyph in self:
+            glyph_x = (glyph.index % self.column_count) * glyph_width
+            glyph_y = (glyph.index // self.column_count) * glyph_height
+            index_plane.paste(PIL.Image.frombuffer('L', self.glyph_size, glyph.data, 'raw', 'L', 0, 1), (glyph_x, glyph_y))
+
+        return index_plane
+
+    def to_rgba_image(self):
+        return create_rgba_from_index_plane(self.sheet_size, self.to_index_plane().tobytes(), self.palette)
+
+class GlyphView:
+    __slots__ = ('bank', 'index')
+
+    def __init__(self, bank, index):
+        self.bank = bank
+        self.index = index
+
+    @property
+    def data(self):
+        block_size = self.bank.block_size
+        return self.bank.data[self.index * block_size:(self.index + 1) * block_size]
+
+    @property
+    def code_point(self):
+        return self.bank.code_points[self.index]
+
+    @property
+    def name(self):
+        return self.bank.names[self.index]
+
+    def get_row(self, j):
+        return self.bank.get_glyph_row(self.index, j)
+
+    def to_indexed_image(self):
+        image = PIL.Image.frombuffer('P', self.bank.glyph_size, self.data, 'raw', 'P', 0, 1)
+        image.putpalette([component for color in self.bank.palette for component in color])
+        return image
+
+    def to_rgba_image(self):
+        return create_rgba_from_index_plane(self.bank.glyph_size, self.data, self.bank.palette)
+
+def generate_plain_variant(source_image, subsheet, variant):
+    return source_image.copy()
+
+def generate_plain_black_variant(source_image, subsheet, variant):
+    return replace_color(source_image.copy(), WHITE, BLACK)
+
+def generate_shadow_variant(source_image, subsheet, variant):
+    ink_mask = create_ink_mask(source_image)
+    shadow_mask = PIL.ImageChops.subtract(dilate_mask(ink_mask, subsheet.glyph_size, variant.shadow.kernel), ink_mask)
+    result_image = PIL.Image.new('RGBA', source_image.size, TRANSPARENT)
 
-def generate_hshadow_outline_variant(source_image, subsheet):
-    return isolate_shadow(generate_hshadow_variant(source_image, subsheet), WHITE)
+    if variant.shadow.isolate:
+        shadow_mask = PIL.ImageChops.lighter(shadow_mask, create_color_mask(source_image, BLACK))
+        result_image.paste(WHITE, None, shadow_mask)
+    else:
+        result_image.paste(BLACK, None, shadow_mask)
+        result_image.paste(source_image, (0, 0), source_image)
 
-def generate_vshadow_outline_variant(source_image, subsheet):
-    return isolate_shadow(generate_vshadow_variant(source_image, subsheet), WHITE)
+    return result_image
 
-def generate_hvshadow_outline_variant(source_image, subsheet):
-    return isolate_shadow(generate_hvshadow_variant(source_image, subsheet), WHITE)
+def generate_silhouette_variant(source_image, subsheet, variant):
+    return create_silhouette(source_image, WHITE, remove_shadows=True)
 
-def generate_monochrome_shadow_variant(source_image, subsheet):
-    return create_monochrome_sheet(source_image, subsheet.glyph_size, remove_shadows=False)
+def generate_monochrome_shadow_variant(source_image, subsheet, variant):
+    return create_monochrome_sheet(source_image, subsheet, remove_shadows=False)
 
-def generate_monochrome_no_shadow_variant(source_image, subsheet):
-    return create_monochrome_sheet(source_image, subsheet.glyph_size, remove_shadows=True)
+def generate_monochrome_no_shadow_variant(source_image, subsheet, variant):
+    return create_monochrome_sheet(source_image, subsheet, remove_shadows=True)
 
 FONT_VARIANTS = {
     'plain': FontVariant('plain', generate_plain_variant, 'plain'),
     'plain_black': FontVariant('plain_black', generate_plain_black_variant, 'plain_black'),
-    'hshadow': FontVariant('hshadow', generate_hshadow_variant, 'hshadow'),
-    'vshadow': FontVariant('vshadow', generate_vshadow_variant, 'vshadow'),
-    'hvshadow': FontVariant('hvshadow', generate_hvshadow_variant, 'hvshadow'),
+    'hshadow': FontVariant('hshadow', generate_shadow_variant, 'hshadow', FontShadow(SHADOW_KERNEL_H, False)),
+    'vshadow': FontVariant('vshadow', generate_shadow_variant, 'vshadow', FontShadow(SHADOW_KERNEL_V, False)),
+    'hvshadow': FontVariant('hvshadow', generate_shadow_variant, 'hvshadow', FontShadow(SHADOW_KERNEL_HV, False)),
     'monochrome_shadow': FontVariant('monochrome_shadow', generate_monochrome_shadow_variant, 'monochrome_shadow'),
     'monochrome_plain': FontVariant('monochrome_plain', generate_monochrome_no_shadow_variant, 'monochrome_plain'),
     'silhouette': FontVariant('silhouette', generate_silhouette_variant, 'silhouette'),
-    'shadow_outline': FontVariant('shadow_outline', generate_isolate_shadow_variant, 'shadow_outline'),
-    'hshadow_outline': FontVariant('hshadow_outline', generate_hshadow_outline_variant, 'hshadow_outline'),
-    'vshadow_outline': FontVariant('vshadow_outline', generate_vshadow_outline_variant, 'vshadow_outline'),
-    'hvshadow_outline': FontVariant('hvshadow_outline', generate_hvshadow_outline_variant, 'hvshadow_outline'),
+    'shadow_outline': FontVariant('shadow_outline', generate_shadow_variant, 'shadow_outline', FontShadow([], True)),
+    'hshadow_outline': FontVariant('hshadow_outline', generate_shadow_variant, 'hshadow_outline', FontShadow(SHADOW_KERNEL_H, True)),
+    'vshadow_outline': FontVariant('vshadow_outline', generate_shadow_variant, 'vshadow_outline', FontShadow(SHADOW_KERNEL_V, True)),
+    'hvshadow_outline': FontVariant('hvshadow_outline', generate_shadow_variant, 'hvshadow_outline', FontShadow(SHADOW_KERNEL_HV, True)),
 }
 
 
 
-FontSubsheet = collections.namedtuple('FontSubsheet', ['name', 'kind', 'category', 'region', 'glyph_size', 'ascent_descent', 'variants'])
+# A subsheet's region is its placement on its source page (and in that page's combined atlas).
+# Subsheets that are assembled from several pages list their source tiles explicitly,
+# where each tile copies a region of a page to a position within the subsheet.
+FontSourceTile = collections.namedtuple('FontSourceTile', ['page', 'region', 'position'])
+FontSubsheet = collections.namedtuple('FontSubsheet', ['name', 'kind', 'category', 'region', 'glyph_size', 'ascent_descent', 'variants', 'page', 'tiles'],
+    defaults=(common.FONT_SOURCE_MAIN_PAGE, None))
+
+def get_subsheet_source_tiles(subsheet):
+    if subsheet.tiles is not None:
+        return subsheet.tiles
+    return [FontSourceTile(subsheet.page, subsheet.region, (0, 0))]
 
 def get_font_subsheet_glyph_info(subsheet, glyph_index):
-    return (common.CHARACTERS_TO_FONT_PATHNAMES.get(glyph_index + 32), glyph_index + 32)
+    code_point = common.get_code_point_map(subsheet.name).get_code_point(glyph_index)
+    return (common.CHARACTERS_TO_FONT_PATHNAMES.get(code_point), code_point)
 
 def get_icon_subsheet_glyph_info(subsheet, glyph_index):
     if subsheet.category == 'icons':
@@ -265,24 +460,131 @@ FONT_SUBSHEETS = {
 
 
 
+# Derived representations of a (subsheet, variant) pair, built on first request and shared by every format writer.
+FontDerivation = collections.namedtuple('FontDerivation', ['derive_func'])
+
+def get_glyph_grid(subsheet, image_size):
+    image_width, image_height = image_size
+    glyph_width, glyph_height = subsheet.glyph_size
+    return image_width // glyph_width, image_height // glyph_height
+
+def derive_used_indexes(derived):
+    return find_used_indexes(derived.indexed_image)
+
+def derive_rgb_magenta(derived):
+    temp_image = PIL.Image.new('RGB', derived.rgba_image.size, MAGENTA)
+    temp_image.paste(derived.rgba_image, (0, 0), derived.rgba_image)
+    return temp_image
+
+def derive_glyph_bank(derived):
+    return GlyphBank.from_indexed_image(derived.subsheet, derived.indexed_image)
+
+def derive_glyph_crops(derived):
+    return [DerivedCache(derived.subsheet, derived.variant, glyph.to_rgba_image(), glyph.to_indexed_image())
+        for glyph in derived.get('glyph_bank')]
+
+def derive_love2d_strip(derived):
+    SEPARATOR_COLOR = (0, 255, 255)
+
+    bank = derived.get('glyph_bank')
+    glyph_width, glyph_height = bank.glyph_size
+    glyph_count = len(bank)
+
+    separator_index = max(bank.data.tobytes()) + 1
+    if separator_index > 255:
+        raise Exception('No palette entry left for the Love2D separator color')
+    separator = bytes([separator_index])
+
+    strip_data = b''.join(separator + separator.join(glyph.get_row(j) for glyph in bank) + separator
+        for j in range(glyph_height))
+
+    return create_rgba_from_index_plane((glyph_count * glyph_width + 1 + glyph_count, glyph_height), strip_data, bank.palette[:separator_index] + [SEPARATOR_COLOR])
+
+def derive_glyph_stats(derived):
+    return reduce_glyph_blocks(derived.get('glyph_bank'))
+
+def derive_index_plane(derived):
+    return derived.indexed_image.tobytes()
+
+def derive_palette(derived):
+    return get_palette(derived.indexed_image)
+
+def derive_sdf_sheet(derived):
+    return create_sdf_sheet(derived.subsheet, derived.get('glyph_bank'))
+
+def derive_chr_1bpp(derived):
+    return encode_chr_1bpp(derived.get('glyph_bank'))
+
+def derive_chr_nes(derived):
+    return encode_chr_nes(derived.get('glyph_bank'))
+
+def derive_chr_gb(derived):
+    return encode_chr_gb(derived.get('glyph_bank'))
+
+FONT_DERIVATIONS = {
+    'used_indexes': FontDerivation(derive_used_indexes),
+    'index_plane': FontDerivation(derive_index_plane),
+    'palette': FontDerivation(derive_palette),
+    'glyph_stats': FontDerivation(derive_glyph_stats),
+    'rgb_magenta': FontDerivation(derive_rgb_magenta),
+    'glyph_bank': FontDerivation(derive_glyph_bank),
+    'glyph_crops': FontDerivation(derive_glyph_crops),
+    'love2d_strip': FontDerivation(derive_love2d_strip),
+    'chr_1bpp': FontDerivation(derive_chr_1bpp),
+    'chr_nes': FontDerivation(derive_chr_nes),
+    'chr_gb': FontDerivation(derive_chr_gb),
+    'sdf_sheet': FontDerivation(derive_sdf_sheet),
+}
+
+class DerivedCache:
+    def __init__(self, subsheet, variant, rgba_image, indexed_image):
+        self.subsheet = subsheet
+        self.variant = variant
+        self.rgba_image = rgba_image
+        self.indexed_image = indexed_image
+        self.entries = {}
+
+    def get(self, name):
+        try:
+            return self.entries[name]
+        except KeyError:
+            pass
+
+        derivation = FONT_DERIVATIONS.get(name)
+        if derivation is None:
+            raise Exception('Unknown derivation "' + name + '"')
+
+        result = derivation.derive_func(self)
+        self.entries[name] = result
+        return result
+
+
+
 FontValidator = collections.namedtuple('FontValidator', ['validate_func'])    
 
-def validate_1bpp(variant, rgba_image, indexed_image):
-    return variant.suffix != 'plain_black' and len(find_used_indexes(indexed_image)) <= 2
+def validate_1bpp(variant, rgba_image, indexed_image, derived):
+    return variant.suffix != 'plain_black' and len(derived.get('used_indexes')) <= 2
+
+def validate_2bpp(variant, rgba_image, indexed_image, derived):
+    return len(derived.get('used_indexes')) <= 4
 
-def validate_2bpp(variant, rgba_image, indexed_image):
-    return len(find_used_indexes(indexed_image)) <= 4
+def validate_3c(variant, rgba_image, indexed_image, derived):
+    return len(derived.get('used_indexes')) <= 3
 
-def validate_3c(variant, rgba_image, indexed_image):
-    return len(find_used_indexes(indexed_image)) <= 3
+def validate_4bpp(variant, rgba_image, indexed_image, derived):
+    return len(derived.get('used_indexes')) <= 16
 
-def validate_4bpp(variant, rgba_image, indexed_image):
-    return len(find_used_indexes(indexed_image)) <= 16
+def validate_8bpp(variant, rgba_image, indexed_image, derived):
+    return len(derived.get('used_indexes')) <= 256
 
-def validate_8bpp(variant, rgba_image, indexed_image):
-    return len(find_used_indexes(indexed_image)) <= 256
+def validate_plain(variant, rgba_image, indexed_image, derived):
+    return variant.name == 'plain'
 
-def validate_unsupported(variant, rgba_image, indexed_image):
+def validate_white(variant, rgba_image, indexed_image, derived):
+    palette = derived.get('palette')
+    return all(palette[i] == WHITE[:3] for i in derived.get('used_indexes') if i != 0)
+
+def validate_unsupported(variant, rgba_image, indexed_image, derived):
     return False
 
 FONT_VALIDATORS = {
@@ -291,6 +593,8 @@ FONT_VALIDATORS = {
     '3c': FontValidator(validate_3c),
     '4bpp': FontValidator(validate_4bpp),
     '8bpp': FontValidator(validate_8bpp),
+    'plain': FontValidator(validate_plain),
+    'white': FontValidator(validate_white),
     'unsupported': FontValidator(validate_unsupported),
 }
 
@@ -300,7 +604,93 @@ FontFormatKind = collections.namedtuple('FontFormatKind', ['save_func'])
 
 def open_file_verbose(path, mode):
     print('  - Writing "' + path + '"...')    
-    return open(path, mode)
+    return common.AtomicFileWriter(path, mode)
+
+# A build profile trades encode time against output size for every image Pillow writes.
+# save_options are extra arguments to Image.save for each Pillow format. trim_palettes cuts indexed palettes down to the highest index used.
+# skipped_formats are left out unless they are named with --formats=. report measures each image against a default encode, to print the bytes saved.
+BuildProfile = collections.namedtuple('BuildProfile', ['name', 'save_options', 'trim_palettes', 'strip_metadata', 'skipped_formats', 'report'])
+
+FONT_BUILD_PROFILES = {
+    'default': BuildProfile('default', {}, False, False, [], False),
+    'dev': BuildProfile('dev', {'PNG': {'compress_level': 1}}, False, False,
+        ['svg_packed', 'svg_individual', 'png_rgba_individual', 'gif_individual', 'chr_1bpp_lz', 'chr_nes_lz', 'chr_gb_lz'], False),
+    'release': BuildProfile('release', {'PNG': {'optimize': True}}, True, True, [], True),
+}
+
+FONT_BUILD_PROFILE = FONT_BUILD_PROFILES['default']
+
+# (report name) -> [file count, default bytes, profile bytes]
+FONT_PROFILE_REPORT = collections.OrderedDict()
+
+def trim_palette(indexed_image):
+    used_count = indexed_image.getextrema()[1] + 1
+    palette_data = indexed_image.getpalette()
+    if len(palette_data) <= used_count * 3:
+        return indexed_image
+
+    # Indexes stay as they are, so index 0 is still transparent and themes still line up. Fewer entries also lets PNG pick a lower bit depth.
+    trimmed_image = indexed_image.copy()
+    trimmed_image.putpalette(palette_data[:used_count * 3])
+    return trimmed_image
+
+def get_profile_report_name(path):
+    parts = os.path.relpath(path, common.FONT_OUTPUT_FOLDER).split(os.sep)
+    if parts[0] in ('themes', 'upscaled') and len(parts) > 3:
+        return parts[0] + '/' + parts[2]
+    return parts[0]
+
+def write_image(output_file, image, image_format, **options):
+    profile = FONT_BUILD_PROFILE
+    profile_image = image
+
+    if profile.trim_palettes and image.mode == 'P':
+        profile_image = trim_palette(profile_image)
+    if profile.strip_metadata and profile_image.info:
+        if profile_image is image:
+            profile_image = image.copy()
+        profile_image.info = {}
+
+    start = output_file.tell()
+    profile_image.save(output_file, image_format, **dict(options, **profile.save_options.get(image_format, {})))
+
+    path = getattr(output_file, 'name', None)
+    if profile.report and isinstance(path, str):
+        default_file = io.BytesIO()
+        image.save(default_file, image_format, **options)
+        totals = FONT_PROFILE_REPORT.setdefault(get_profile_report_name(path), [0, 0, 0])
+        totals[0] += 1
+        totals[1] += len(default_file.getvalue())
+        totals[2] += output_file.tell() - start
+
+def print_profile_report():
+    if not FONT_PROFILE_REPORT:
+        return
+
+    print('')
+    print('Bytes saved by the "' + FONT_BUILD_PROFILE.name + '" profile, against default encoding:')
+
+    total_default_size = 0
+    total_profile_size = 0
+    for report_name, (file_count, default_size, profile_size) in FONT_PROFILE_REPORT.items():
+        print('  - {}: {} files, {} -> {} bytes, {} saved ({:.1f}%)'.format(report_name, file_count, default_size, profile_size, default_size - profile_size, 100.0 * (default_size - profile_size) / max(default_size, 1)))
+        total_default_size += default_size
+        total_profile_size += profile_size
+
+    print('  - TOTAL: {} -> {} bytes, {} saved ({:.1f}%)'.format(total_default_size, total_profile_size, total_default_size - total_profile_size, 100.0 * (total_default_size - total_profile_size) / max(total_default_size, 1)))
+
+# Set to a memory_trace.MemoryTracer by --trace-memory= to record memory use around every stage.
+FONT_MEMORY_TRACER = None
+
+def trace_memory(stage_name, subsheet_name=None, variant_name=None, format_name=None):
+    if FONT_MEMORY_TRACER is None:
+        return contextlib.nullcontext()
+    return FONT_MEMORY_TRACER.stage(stage_name, subsheet_name, variant_name, format_name)
+
+def save_image(image, path):
+    # The format comes from the path's extension, the same as saving to the path directly.
+    with common.AtomicFileWriter(path, 'wb') as output_file:
+        write_image(output_file, image, PIL.Image.registered_extensions()[os.path.splitext(path)[1].lower()])
 
 def create_directory_verbose(path):
     print('Creating directory "' + path + '"...')
@@ -309,47 +699,37 @@ def create_directory_verbose(path):
     except FileExistsError:
         pass
 
-def save_binary(subsheet, variant, format, output_path, rgba_image, indexed_image):
+def save_binary(subsheet, variant, format, output_path, rgba_image, indexed_image, derived):
     with open_file_verbose(output_path, 'wb') as output_file:
-        format.write_func(output_file, subsheet, variant, rgba_image, indexed_image)
+        format.write_func(output_file, subsheet, variant, rgba_image, indexed_image, derived)
 
-def save_text(subsheet, variant, format, output_path, rgba_image, indexed_image):
+def save_text(subsheet, variant, format, output_path, rgba_image, indexed_image, derived):
     with open_file_verbose(output_path, 'w') as output_file:
-        format.write_func(output_file, subsheet, variant, rgba_image, indexed_image)
+        format.write_func(output_file, subsheet, variant, rgba_image, indexed_image, derived)
 
-def save_folder(file_mode, subsheet, variant, format, output_path, rgba_image, indexed_image):
+def save_folder(file_mode, subsheet, variant, format, output_path, rgba_image, indexed_image, derived):
     stripped_path, extension = os.path.splitext(output_path)
 
     create_directory_verbose(stripped_path)
 
-    image_width, image_height = rgba_image.size
-    glyph_width, glyph_height = subsheet.glyph_size
-    column_count, row_count = image_width // glyph_width, image_height // glyph_height
+    column_count, row_count = get_glyph_grid(subsheet, rgba_image.size)
     print('image size ' + repr(rgba_image.size))
     print('glyph size ' + repr(subsheet.glyph_size))
     print('column count ' + repr(column_count) + ', row count ' + repr(row_count))
 
-    for glyph_index in range(row_count * column_count):
+    for glyph_index, glyph in enumerate(derived.get('glyph_crops')):
         glyph_name, remapped_index = get_subsheet_glyph_info(subsheet, glyph_index)
         remapped_index_padded_str = '{:03d}'.format(remapped_index)
         glyph_path = os.path.join(stripped_path, os.path.basename(stripped_path) + '_' + remapped_index_padded_str + '_' + glyph_name + '.' + format.extension)
 
-        glyph_x = (glyph_index % column_count) * glyph_width
-        glyph_y = (glyph_index // column_count) * glyph_height
-        crop_area = (glyph_x, glyph_y, glyph_x + glyph_width, glyph_y + glyph_height)
-        print('crop area ' + repr(crop_area))
-
-        glyph_rgba_image = rgba_image.crop(crop_area)
-        glyph_indexed_image = indexed_image.crop(crop_area)
-
         with open_file_verbose(glyph_path, file_mode) as glyph_file:
-            format.write_func(glyph_file, subsheet, variant, glyph_rgba_image, glyph_indexed_image)
+            format.write_func(glyph_file, subsheet, variant, glyph.rgba_image, glyph.indexed_image, glyph)
 
-def save_text_folder(subsheet, variant, format, output_path, rgba_image, indexed_image):
-    save_folder('w', subsheet, variant, format, output_path, rgba_image, indexed_image)
+def save_text_folder(subsheet, variant, format, output_path, rgba_image, indexed_image, derived):
+    save_folder('w', subsheet, variant, format, output_path, rgba_image, indexed_image, derived)
 
-def save_binary_folder(subsheet, variant, format, output_path, rgba_image, indexed_image):
-    save_folder('wb', subsheet, variant, format, output_path, rgba_image, indexed_image)
+def save_binary_folder(subsheet, variant, format, output_path, rgba_image, indexed_image, derived):
+    save_folder('wb', subsheet, variant, format, output_path, rgba_image, indexed_image, derived)
 
 FONT_FORMAT_KINDS = {
     'binary': FontFormatKind(save_binary),
@@ -365,160 +745,239 @@ FontFormat = collections.namedtuple('FontFormat', ['extension', 'suffix', 'kind'
 COLOR_MAPPING_1BPP = [0, 0, 1]
 COLOR_MAPPING_3C = [0, 1, 3]
 
-# https://en.wikipedia.org/wiki/Glyph_Bitmap_Distribution_Format
-# https://en.wikipedia.org/wiki/X_logical_font_description
-# https://www.x.org/docs/BDF/bdf.pdf
-# https://adobe-type-tools.github.io/font-tech-notes/pdfs/5005.BDF_Spec.pdf
-# This probably has errors... Wish it were easier to know if this is up to spec, looked at other fonts + read the format spec.
-def write_bdf(output_file, subsheet, variant, rgba_image, indexed_image):
-    RESOLUTION = 72
-    POINT_SIZE = 100
-    AVERAGE_WIDTH = 90
-    CHARSET_REGISTRY = 'ISO8859'
-    CHARSET_ENCODING = '1'
-
-    region_x, region_y, region_width, region_height = subsheet.region
+X_FONT_RESOLUTION = 72
+X_FONT_POINT_SIZE = 100
+X_FONT_AVERAGE_WIDTH = 90
+X_FONT_CHARSET_REGISTRY = 'ISO8859'
+X_FONT_CHARSET_ENCODING = '1'
 
+# https://en.wikipedia.org/wiki/X_logical_font_description
+def get_x_font_description(subsheet, variant):
     glyph_width, glyph_height = subsheet.glyph_size
-    glyph_columns = region_width // glyph_width
-    glyph_rows = region_height // glyph_height
-    glyph_count = glyph_columns * glyph_rows
-
-    ascent, descent = subsheet.ascent_descent
-    basename = os.path.basename(output_file.name)
-    description = '-' + common.FONT_AUTHOR \
+    return '-' + common.FONT_AUTHOR \
         + '-' + common.FONT_NAME \
         + '_' + subsheet.name \
         + '_' + variant.name \
         + '-medium-r-normal' \
         + '--' + str(glyph_width) \
-        + '-' + str(POINT_SIZE) \
-        + '-' + str(RESOLUTION) \
-        + '-' + str(RESOLUTION) \
+        + '-' + str(X_FONT_POINT_SIZE) \
+        + '-' + str(X_FONT_RESOLUTION) \
+        + '-' + str(X_FONT_RESOLUTION) \
         + '-m' \
-        + '-' + str(AVERAGE_WIDTH) \
-        + '-' + str(CHARSET_REGISTRY) \
-        + '-' + str(CHARSET_ENCODING)
+        + '-' + str(X_FONT_AVERAGE_WIDTH) \
+        + '-' + str(X_FONT_CHARSET_REGISTRY) \
+        + '-' + str(X_FONT_CHARSET_ENCODING)
+
+# Font properties shared by BDF and PCF. str values are string properties, int values are integer properties.
+def get_x_font_properties(subsheet):
+    glyph_width, glyph_height = subsheet.glyph_size
+    ascent, descent = subsheet.ascent_descent
+    code_point_map = common.get_code_point_map(subsheet.name)
+
+    return [
+        ('FONT_ASCENT', ascent),
+        ('FONT_DESCENT', descent),
+        ('PIXEL_SIZE', glyph_height),
+        ('POINT_SIZE', X_FONT_POINT_SIZE),
+        ('RESOLUTION_X', X_FONT_RESOLUTION),
+        ('RESOLUTION_Y', X_FONT_RESOLUTION),
+        ('SPACING', 'C'),
+        ('DEFAULT_CHAR', code_point_map.fallback_code_point),
+        ('AVERAGE_WIDTH', X_FONT_AVERAGE_WIDTH),
+        ('CHARSET_REGISTRY', X_FONT_CHARSET_REGISTRY),
+        ('CHARSET_ENCODING', X_FONT_CHARSET_ENCODING),
+        ('FOUNDRY', common.FONT_AUTHOR),
+        ('COPYRIGHT', common.FONT_COPYRIGHT),
+    ]
+
+def get_glyph_bitmap_rows(bank, glyph_index):
+    # Rows of 1bpp glyph bits, most significant bit first, padded on the right to whole bytes.
+    glyph_width, glyph_height = bank.glyph_size
+    bit_lookup = create_bit_lookup(COLOR_MAPPING_1BPP, 0)
+    shift = -glyph_width % 8
+    byte_count = (glyph_width + 7) // 8
+    return [(get_row_bits(bank.get_glyph_row(glyph_index, j), bit_lookup) << shift).to_bytes(byte_count, 'big') for j in range(glyph_height)]
+
+# https://en.wikipedia.org/wiki/Glyph_Bitmap_Distribution_Format
+# https://www.x.org/docs/BDF/bdf.pdf
+# https://adobe-type-tools.github.io/font-tech-notes/pdfs/5005.BDF_Spec.pdf
+# This probably has errors... Wish it were easier to know if this is up to spec, looked at other fonts + read the format spec.
+def write_bdf(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    glyph_width, glyph_height = subsheet.glyph_size
+    ascent, descent = subsheet.ascent_descent
+    bank = derived.get('glyph_bank')
+    properties = get_x_font_properties(subsheet)
+    basename = os.path.basename(output_file.name)
 
     output_file.write('STARTFONT 2.1\n')
     output_file.write('COMMENT ' + common.FONT_COPYRIGHT + '\n')
     output_file.write('COMMENT ' + basename + '\n')
-    output_file.write('FONT ' + description + '\n')
-    output_file.write('SIZE {} {} {}\n'.format(glyph_width, RESOLUTION, RESOLUTION))
+    output_file.write('FONT ' + get_x_font_description(subsheet, variant) + '\n')
+    output_file.write('SIZE {} {} {}\n'.format(glyph_width, X_FONT_RESOLUTION, X_FONT_RESOLUTION))
     output_file.write('FONTBOUNDINGBOX {} {} {} {}\n'.format(glyph_width, glyph_height, 0, -descent))
 
-    output_file.write('STARTPROPERTIES 13\n')
-    output_file.write('FONT_ASCENT ' + str(ascent) + ' \n')
-    output_file.write('FONT_DESCENT ' + str(descent) + '\n')
-    output_file.write('PIXEL_SIZE ' + str(glyph_height) + '\n')
-    output_file.write('POINT_SIZE ' + str(POINT_SIZE) + '\n')
-    output_file.write('RESOLUTION_X ' + str(RESOLUTION) + '\n')
-    output_file.write('RESOLUTION_Y ' + str(RESOLUTION) + '\n')
-    output_file.write('SPACING "C"\n')
-    output_file.write('DEFAULT_CHAR 32\n')
-    output_file.write('AVERAGE_WIDTH ' + str(AVERAGE_WIDTH) + '\n')
-    output_file.write('CHARSET_REGISTRY "' + CHARSET_REGISTRY + '"\n')
-    output_file.write('CHARSET_ENCODING "' + CHARSET_ENCODING + '"\n')
-    output_file.write('FOUNDRY "' + common.FONT_AUTHOR + '"\n')
-    output_file.write('COPYRIGHT "' + common.FONT_COPYRIGHT + '"\n')
+    output_file.write('STARTPROPERTIES ' + str(len(properties)) + '\n')
+    for name, value in properties:
+        output_file.write(name + ' ' + ('"' + value + '"' if isinstance(value, str) else str(value)) + '\n')
     output_file.write('ENDPROPERTIES\n')
 
-    output_file.write('CHARS ' + str(glyph_count) + '\n')
-
-    data = indexed_image.load()
-    icon_mapping = common.FONT_ICON_MAPPINGS.get(subsheet.name)
+    output_file.write('CHARS ' + str(len(bank)) + '\n')
 
-    for glyph_index in range(glyph_count):
-        char_code = icon_mapping[glyph_index] if icon_mapping is not None else glyph_index + 32
+    for glyph in bank:
+        char_code = glyph.code_point
         output_file.write('STARTCHAR char' + str(char_code) + '\n')
         output_file.write('ENCODING ' + str(char_code) + '\n')
-        output_file.write('SWIDTH ' + str(glyph_width * POINT_SIZE) + ' 0\n')
+        output_file.write('SWIDTH ' + str(glyph_width * X_FONT_POINT_SIZE) + ' 0\n')
         output_file.write('DWIDTH ' + str(glyph_width) + ' 0\n')
         output_file.write('BBX {} {} {} {}\n'.format(glyph_width, glyph_height, 0, -descent))
         output_file.write('BITMAP\n')
 
-        glyph_x = glyph_index % glyph_columns * glyph_width
-        glyph_y = glyph_index // glyph_columns * glyph_height
-        #print('glyph_index ' + str(glyph_index) + ' ' + str(glyph_x) + ' ' + str(glyph_y))
-
-        for j in range(glyph_height):
-            c = 0
-            for i in range(glyph_width):
-                c = (c << 1) | (COLOR_MAPPING_1BPP[data[glyph_x + i, glyph_y + j]] & 1)
-
-            shift = glyph_width % 8
-            c <<= shift
-            padding = (glyph_width + 7) // 8 * 2 # pad to nearest hex-encoded byte length
-
-            output_file.write('{:0{padding}X}\n'.format(c, padding=padding))
+        for row in get_glyph_bitmap_rows(bank, glyph.index):
+            output_file.write(row.hex().upper() + '\n')
         output_file.write('ENDCHAR\n')
 
     output_file.write('ENDFONT\n')
     pass
 
+# https://fontforge.org/docs/techref/pcf-format.html
+# Same glyphs, metrics and properties as the BDF output, read back after writing to make sure the tables decode to what was intended.
+def write_pcf(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    glyph_width, glyph_height = subsheet.glyph_size
+    ascent, descent = subsheet.ascent_descent
+    bank = derived.get('glyph_bank')
+    code_point_map = common.get_code_point_map(subsheet.name)
+    metrics = pcf.PcfMetrics(0, glyph_width, glyph_width, ascent, descent, 0)
+
+    glyphs = [pcf.PcfGlyph('char' + str(glyph.code_point), glyph.code_point, metrics, glyph_width * X_FONT_POINT_SIZE, get_glyph_bitmap_rows(bank, glyph.index)) for glyph in bank]
+    font = pcf.PcfFont([('FONT', get_x_font_description(subsheet, variant))] + get_x_font_properties(subsheet),
+        ascent, descent, code_point_map.fallback_code_point, glyphs)
+
+    data = io.BytesIO()
+    pcf.write_pcf(data, font)
+    if pcf.read_pcf(data.getvalue()) != font:
+        raise Exception('Round trip through PCF did not reproduce the font "' + subsheet.name + '" variant "' + variant.name + '"')
+
+    output_file.write(data.getvalue())
+
 # TODO: for CHR, pack better for tiny fonts that do not take up a full row. pad.
 # TODO: for CHR, better arrangement of glyphs, so all 8x8 tile chunks for a glyph are adjacent to each other in memory order.
 #       (right now it splits it up by image rows/columns, rather than grouped together by glyph)
 
-def write_chr_1bpp(output_file, subsheet, variant, rgba_image, indexed_image):
-    w, h = indexed_image.size
-    data = indexed_image.load()
-    buffer = bytearray()
-    for y in range(0, h, 8):
-        for x in range(0, w, 8):
-            for j in range(8):
-                # Write bits of this row.
-                c = 0
-                for i in range(8):
-                    c = (c << 1) | (COLOR_MAPPING_1BPP[data[x + i, y + j]] & 1)
-                buffer.append(c)
-    output_file.write(buffer)
-
-def write_chr_nes(output_file, subsheet, variant, rgba_image, indexed_image):
-    w, h = indexed_image.size
-    data = indexed_image.load()    
-    buffer = bytearray()
+def create_bit_lookup(color_mapping, bit):
+    # Maps palette indexes to the ASCII digit of one bit of their mapped color, so a row of indexes translates into a binary number string.
+    # Indexes without a mapping become '?', which makes int() fail loudly.
+    return bytes((ord('0') + ((color_mapping[i] >> bit) & 1)) if i < len(color_mapping) else ord('?') for i in range(256))
+
+def get_row_bits(row, bit_lookup):
+    return int(bytes(row).translate(bit_lookup), 2)
+
+def iter_chr_tile_rows(bank):
+    w, h = bank.sheet_size
     for y in range(0, h, 8):
         for x in range(0, w, 8):
-            # Copy low bits of each 8x8 chunk into the first 8x8 plane.
-            for j in range(8):
-                c = 0
-                for i in range(8):
-                    c = (c << 1) | (COLOR_MAPPING_3C[data[x + i, y + j]] & 1)
-                buffer.append(c)
-            # Copy high bits of each chunk into the second 8x8 plane.
-            for j in range(8):
-                c = 0
-                for i in range(8):
-                    c = (c << 1) | ((COLOR_MAPPING_3C[data[x + i, y + j]] >> 1) & 1)
-                buffer.append(c)
-    output_file.write(buffer)
-
-def write_chr_gb(output_file, subsheet, variant, rgba_image, indexed_image):
-    w, h = indexed_image.size
-    data = indexed_image.load()
+            yield [bank.get_sheet_row(x, y + j, 8) for j in range(8)]
+
+def encode_chr_1bpp_tile(tile_rows):
+    # Write bits of each row.
+    return bytes(get_row_bits(row, CHR_1BPP_BIT_LOOKUP) for row in tile_rows)
+
+def encode_chr_nes_tile(tile_rows):
+    # Low bits of the 8x8 chunk go in the first 8x8 plane, high bits in the second.
+    return bytes(get_row_bits(row, CHR_3C_LOW_BIT_LOOKUP) for row in tile_rows) \
+        + bytes(get_row_bits(row, CHR_3C_HIGH_BIT_LOOKUP) for row in tile_rows)
+
+def encode_chr_gb_tile(tile_rows):
     buffer = bytearray()
-    for y in range(0, h, 8):
-        for x in range(0, w, 8):
-            for j in range(8):
-                # Write low bits of this row.
-                c = 0
-                for i in range(8):
-                    c = (c << 1) | (COLOR_MAPPING_3C[data[x + i, y + j]] & 1)
-                buffer.append(c)
-                
-                # Write high bits of this row.
-                c = 0
-                for i in range(8):
-                    c = (c << 1) | ((COLOR_MAPPING_3C[data[x + i, y + j]] >> 1) & 1)
-                buffer.append(c)
-    output_file.write(buffer)
-
-def write_svg(output_file, subsheet, variant, rgba_image, indexed_image):
+    for row in tile_rows:
+        # Write low bits of this row, then high bits of this row.
+        buffer.append(get_row_bits(row, CHR_3C_LOW_BIT_LOOKUP))
+        buffer.append(get_row_bits(row, CHR_3C_HIGH_BIT_LOOKUP))
+    return bytes(buffer)
+
+CHR_1BPP_BIT_LOOKUP = create_bit_lookup(COLOR_MAPPING_1BPP, 0)
+CHR_3C_LOW_BIT_LOOKUP = create_bit_lookup(COLOR_MAPPING_3C, 0)
+CHR_3C_HIGH_BIT_LOOKUP = create_bit_lookup(COLOR_MAPPING_3C, 1)
+
+# Each target's tile encoder, and the validator its glyphs have to pass.
+ChrTarget = collections.namedtuple('ChrTarget', ['encode_tile_func', 'validator'])
+
+CHR_TARGETS = {
+    '1bpp': ChrTarget(encode_chr_1bpp_tile, '1bpp'),
+    'nes': ChrTarget(encode_chr_nes_tile, '3c'),
+    'gb': ChrTarget(encode_chr_gb_tile, '3c'),
+}
+
+def encode_chr_1bpp(bank):
+    return b''.join(encode_chr_1bpp_tile(tile_rows) for tile_rows in iter_chr_tile_rows(bank))
+
+def encode_chr_nes(bank):
+    return b''.join(encode_chr_nes_tile(tile_rows) for tile_rows in iter_chr_tile_rows(bank))
+
+def encode_chr_gb(bank):
+    return b''.join(encode_chr_gb_tile(tile_rows) for tile_rows in iter_chr_tile_rows(bank))
+
+def write_chr_1bpp(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(derived.get('chr_1bpp'))
+
+def write_chr_nes(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(derived.get('chr_nes'))
+
+def write_chr_gb(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(derived.get('chr_gb'))
+
+def write_chr_1bpp_rle(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(chr_compression.compress_verified('rle', derived.get('chr_1bpp')))
+
+def write_chr_nes_rle(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(chr_compression.compress_verified('rle', derived.get('chr_nes')))
+
+def write_chr_gb_rle(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(chr_compression.compress_verified('rle', derived.get('chr_gb')))
+
+def write_chr_1bpp_lz(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(chr_compression.compress_verified('lz', derived.get('chr_1bpp')))
+
+def write_chr_nes_lz(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(chr_compression.compress_verified('lz', derived.get('chr_nes')))
+
+def write_chr_gb_lz(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    output_file.write(chr_compression.compress_verified('lz', derived.get('chr_gb')))
+
+# Page font for SSD1306/ST7565-style panels, read by page_font.py. Each glyph is stored one 8 pixel tall page at a time,
+# one byte per column, with the top row of the page in the lowest bit. Glyphs that aren't a whole number of pages tall are padded with 0 bits.
+PAGE_FONT_BIT_LOOKUP = bytes(COLOR_MAPPING_1BPP[i] if i < len(COLOR_MAPPING_1BPP) else 0xFF for i in range(256))
+
+def encode_page_font_glyph(bank, glyph_index):
+    glyph_width, glyph_height = bank.glyph_size
+    columns = bytearray(glyph_width * page_font.get_page_count(glyph_height))
+
+    for j in range(glyph_height):
+        bits = bytes(bank.get_glyph_row(glyph_index, j)).translate(PAGE_FONT_BIT_LOOKUP)
+        if max(bits) > 1:
+            raise Exception('Palette index without a 1bpp color mapping in glyph ' + str(glyph_index))
+        page_offset = (j // 8) * glyph_width
+        shift = j % 8
+        for i, bit in enumerate(bits):
+            columns[page_offset + i] |= bit << shift
+
+    return bytes(columns)
+
+def write_page_font(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    bank = derived.get('glyph_bank')
+    glyph_width, glyph_height = bank.glyph_size
+    code_point_map = common.get_code_point_map(subsheet.name)
+
+    page_font.write_page_font(output_file, glyph_width, glyph_height, code_point_map.fallback_code_point, list(bank.code_points),
+        b''.join(encode_page_font_glyph(bank, glyph_index) for glyph_index in range(len(bank))))
+
+def write_svg(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    import svgwrite # requires svgwrite -- pip install svgwrite
+
     SCALE = 4
     w, h = rgba_image.size
     data = rgba_image.load()
-    drawing = svgwrite.Drawing(size=(str(w * SCALE) + 'px', str(h * SCALE) + 'px'))
+    # debug=False skips svgwrite's validation of every element, which is most of the time spent here. The output is the same.
+    drawing = svgwrite.Drawing(size=(str(w * SCALE) + 'px', str(h * SCALE) + 'px'), debug=False)
 
     for x in range(w):
         for y in range(h):
@@ -529,60 +988,354 @@ def write_svg(output_file, subsheet, variant, rgba_image, indexed_image):
 
     drawing.write(output_file)
 
-def write_png_indexed(output_file, subsheet, variant, rgba_image, indexed_image):
-    indexed_image.save(output_file, 'PNG', transparency=0)
-
-def write_png_rgb_magenta(output_file, subsheet, variant, rgba_image, indexed_image):
-    temp_image = PIL.Image.new('RGB', rgba_image.size, MAGENTA)
-    temp_image.paste(rgba_image, (0, 0), rgba_image)
-    temp_image.save(output_file, 'PNG')
+def write_png_indexed(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_image(output_file, indexed_image, 'PNG', transparency=0)
 
-def write_png_rgba(output_file, subsheet, variant, rgba_image, indexed_image):
-    rgba_image.save(output_file, 'PNG')
-
-def write_png_rgba_love2d(output_file, subsheet, variant, rgba_image, indexed_image):
-    glyph_width, glyph_height = subsheet.glyph_size
-    glyph_columns = rgba_image.width // glyph_width
-    glyph_rows = rgba_image.height // glyph_height
-    glyph_count = glyph_columns * glyph_rows
+def write_png_rgb_magenta(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_image(output_file, derived.get('rgb_magenta'), 'PNG')
 
-    temp_image = PIL.Image.new('RGBA', (glyph_count * glyph_width + 1 + glyph_count, glyph_height), TRANSPARENT)
-    temp_data = temp_image.load()
+def write_png_rgba(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_image(output_file, rgba_image, 'PNG')
 
-    for y in range(glyph_height):
-        temp_data[(0, y)] = (0, 255, 255, 255)
+def write_png_rgba_love2d(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_image(output_file, derived.get('love2d_strip'), 'PNG')
 
-    for glyph_index in range(glyph_count):
-        glyph_x = (glyph_index % glyph_columns) * glyph_width
-        glyph_y = (glyph_index // glyph_columns) * glyph_height
-        crop_area = (glyph_x, glyph_y, glyph_x + glyph_width, glyph_y + glyph_height)
+def write_gif(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_image(output_file, indexed_image, 'GIF', transparency=0)
 
-        glyph_rgba_image = rgba_image.crop(crop_area)
+def write_bmp_indexed(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_image(output_file, indexed_image, 'BMP')
 
-        dest_x = glyph_index * glyph_width + 1 + glyph_index
-        temp_image.paste(glyph_rgba_image, (dest_x, 0), glyph_rgba_image)
+def write_bmp_rgb_magenta(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_image(output_file, derived.get('rgb_magenta'), 'BMP')
 
-        for dest_y in range(glyph_height):
-            temp_data[(dest_x + glyph_width, dest_y)] = (0, 255, 255, 255)
+FONT_METRICS_LETTER_SPACING = 1
 
-    temp_image.save(output_file, 'PNG')
-
-def write_gif(output_file, subsheet, variant, rgba_image, indexed_image):
-    indexed_image.save(output_file, 'GIF', transparency=0)
+def write_metrics(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    glyph_width, glyph_height = subsheet.glyph_size
+    ascent, descent = subsheet.ascent_descent
+    code_point_map = common.get_code_point_map(subsheet.name)
+    glyphs = []
 
-def write_bmp_indexed(output_file, subsheet, variant, rgba_image, indexed_image):
-    indexed_image.save(output_file, 'BMP')
+    for glyph_index, stats in enumerate(derived.get('glyph_stats')):
+        glyph_name, remapped_index = get_subsheet_glyph_info(subsheet, glyph_index)
 
-def write_bmp_rgb_magenta(output_file, subsheet, variant, rgba_image, indexed_image):
-    temp_image = PIL.Image.new('RGB', rgba_image.size, MAGENTA)
-    temp_image.paste(rgba_image, (0, 0), rgba_image)
-    temp_image.save(output_file, 'BMP')
+        if stats.empty:
+            advance = max(glyph_width // 2, 1)
+        else:
+            advance = stats.ink_bounds[2] - stats.ink_bounds[0] + FONT_METRICS_LETTER_SPACING
+
+        glyphs.append({
+            'index': glyph_index,
+            'code_point': code_point_map.get_code_point(glyph_index),
+            'name': glyph_name,
+            'advance': advance,
+            'left_bearing': stats.left_bearing,
+            'right_bearing': stats.right_bearing,
+            'ink_bounds': list(stats.ink_bounds) if stats.ink_bounds else None,
+        })
+
+    json.dump({
+        'name': common.FONT_PREFIX + '_' + subsheet.name + '_' + variant.suffix,
+        'glyph_width': glyph_width,
+        'glyph_height': glyph_height,
+        'ascent': ascent,
+        'descent': descent,
+        'letter_spacing': FONT_METRICS_LETTER_SPACING,
+        'fallback_code_point': code_point_map.fallback_code_point,
+        'glyphs': glyphs,
+    }, output_file, indent=1)
+
+# http://www.angelcode.com/products/bmfont/doc/file_format.html
+# Glyphs are referenced in place on the packed RGBA textures, either the combined om_complete texture
+# for variants that have one, or the subsheet's own RGBA sheet otherwise.
+BMFontChar = collections.namedtuple('BMFontChar', ['id', 'x', 'y', 'width', 'height', 'xoffset', 'yoffset', 'xadvance', 'page', 'chnl'])
+BMFontDescriptor = collections.namedtuple('BMFontDescriptor', ['face', 'size', 'line_height', 'base', 'scale_w', 'scale_h', 'pages', 'chars'])
+
+BMFONT_FORMATS = ['bmfont_text', 'bmfont_binary']
+BMFONT_PAGE_FORMAT = 'png_rgba'
+BMFONT_ALL_CHANNELS = 15
+
+# The variants whose combined png_rgba texture is written by this build (or by --merge-shards, for a shard).
+# The BMFont descriptors of the other variants use their own subsheet's sheet as the page.
+FONT_BMFONT_COMBINED_VARIANTS = set()
+
+def get_bmfont_format_filter(format_filter):
+    # The descriptors only point at the pages, so png_rgba is always written along with a BMFont format.
+    if format_filter is not None and BMFONT_PAGE_FORMAT not in format_filter and any(format_name in format_filter for format_name in BMFONT_FORMATS):
+        print('Adding "' + BMFONT_PAGE_FORMAT + '" to the formats, for the BMFont pages.')
+        return format_filter | {BMFONT_PAGE_FORMAT}
+    return format_filter
+
+def get_bmfont_descriptor(subsheet, variant, bank):
+    glyph_width, glyph_height = subsheet.glyph_size
+    ascent, descent = subsheet.ascent_descent
+    page_format = FONT_FORMATS[BMFONT_PAGE_FORMAT]
+
+    if variant.name in FONT_BMFONT_COMBINED_VARIANTS:
+        page_filename = get_sheet_filename(get_combined_sheet_name(subsheet.page), variant.suffix, page_format.suffix, page_format.extension)
+        page_x, page_y = subsheet.region[0], subsheet.region[1]
+        scale_w, scale_h = get_source_page_size(subsheet.page)
+    else:
+        page_filename = get_sheet_filename(subsheet.name, variant.suffix, page_format.suffix, page_format.extension)
+        page_x, page_y = 0, 0
+        scale_w, scale_h = rect_get_size(subsheet.region)
+
+    chars = []
+
+    # The same glyphs as the BDF file, less the ones without a code point, which BMFont has no way to list.
+    for glyph in bank:
+        if glyph.code_point < 0:
+            continue
+        chars.append(BMFontChar(glyph.code_point,
+            page_x + (glyph.index % bank.column_count) * glyph_width,
+            page_y + (glyph.index // bank.column_count) * glyph_height,
+            glyph_width, glyph_height, 0, 0, glyph_width, 0, BMFONT_ALL_CHANNELS))
+
+    return BMFontDescriptor(common.FONT_PREFIX + '_' + subsheet.name + '_' + variant.suffix,
+        glyph_height, glyph_height, ascent, scale_w, scale_h,
+        ['../' + BMFONT_PAGE_FORMAT + '/' + page_filename], chars)
+
+def write_bmfont_text(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    descriptor = get_bmfont_descriptor(subsheet, variant, derived.get('glyph_bank'))
+
+    output_file.write('info face="{}" size={} bold=0 italic=0 charset="" unicode=1 stretchH=100 smooth=0 aa=1 padding=0,0,0,0 spacing=0,0 outline=0\n'.format(descriptor.face, descriptor.size))
+    output_file.write('common lineHeight={} base={} scaleW={} scaleH={} pages={} packed=0 alphaChnl=0 redChnl=0 greenChnl=0 blueChnl=0\n'.format(
+        descriptor.line_height, descriptor.base, descriptor.scale_w, descriptor.scale_h, len(descriptor.pages)))
+
+    for page_id, page_filename in enumerate(descriptor.pages):
+        output_file.write('page id={} file="{}"\n'.format(page_id, page_filename))
+
+    output_file.write('chars count={}\n'.format(len(descriptor.chars)))
+
+    for char in descriptor.chars:
+        output_file.write('char id={} x={} y={} width={} height={} xoffset={} yoffset={} xadvance={} page={} chnl={}\n'.format(*char))
+
+def write_bmfont_binary(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    BLOCK_INFO = 1
+    BLOCK_COMMON = 2
+    BLOCK_PAGES = 3
+    BLOCK_CHARS = 4
+    INFO_FLAG_UNICODE = 1 << 1
+
+    descriptor = get_bmfont_descriptor(subsheet, variant, derived.get('glyph_bank'))
+
+    def write_block(block_type, block_data):
+        output_file.write(struct.pack('<BI', block_type, len(block_data)))
+        output_file.write(block_data)
+
+    output_file.write(b'BMF\x03')
+
+    # fontSize, bitField, charSet, stretchH, aa, padding (up, right, down, left), spacing (horizontal, vertical), outline, fontName
+    write_block(BLOCK_INFO, struct.pack('<hBBHBBBBBBBB', descriptor.size, INFO_FLAG_UNICODE, 0, 100, 1, 0, 0, 0, 0, 0, 0, 0)
+        + descriptor.face.encode('ascii') + b'\0')
+    # lineHeight, base, scaleW, scaleH, pages, bitField, alphaChnl, redChnl, greenChnl, blueChnl
+    write_block(BLOCK_COMMON, struct.pack('<HHHHHBBBBB', descriptor.line_height, descriptor.base, descriptor.scale_w, descriptor.scale_h, len(descriptor.pages), 0, 0, 0, 0, 0))
+    write_block(BLOCK_PAGES, b''.join(page_filename.encode('ascii') + b'\0' for page_filename in descriptor.pages))
+    write_block(BLOCK_CHARS, b''.join(struct.pack('<IHHHHhhhBB', *char) for char in descriptor.chars))
+
+# Signed distance fields, so one small texture can be drawn at any size, with shadows and outlines done in a shader.
+# Distances are measured on the glyph mask scaled up SDF_UPSCALE times, with SDF_SPREAD upscaled pixels of padding around each glyph cell.
+# Stored as 128 on the glyph edge, rising to 255 at SDF_SPREAD pixels inside the glyph and falling to 0 at SDF_SPREAD pixels outside.
+# https://cs.brown.edu/people/pfelzens/papers/dt-final.pdf
+SDF_UPSCALE = 2
+SDF_SPREAD = 4
+SDF_FAR = 1 << 30
+
+def get_sdf_cell_size(subsheet):
+    glyph_width, glyph_height = subsheet.glyph_size
+    return glyph_width * SDF_UPSCALE + 2 * SDF_SPREAD, glyph_height * SDF_UPSCALE + 2 * SDF_SPREAD
+
+def get_row_squared_distances(row):
+    # Squared distance along the row to the nearest non-zero entry, by a forward and a backward sweep.
+    n = len(row)
+    distances = [SDF_FAR] * n
+    last = None
+    for x in range(n):
+        if row[x]:
+            last = x
+        if last is not None:
+            distances[x] = x - last
+    last = None
+    for x in range(n - 1, -1, -1):
+        if row[x]:
+            last = x
+        if last is not None and (distances[x] == SDF_FAR or last - x < distances[x]):
+            distances[x] = last - x
+    return [d * d if d != SDF_FAR else SDF_FAR for d in distances]
+
+def get_lower_envelope_distances(f):
+    # Exact 1D squared distance transform of the sampled function f, as the lower envelope of parabolas rooted at each sample.
+    n = len(f)
+    v = [0] * n
+    z = [0.0] * (n + 1)
+    z[0] = float('-inf')
+    z[1] = float('inf')
+    k = 0
+
+    for q in range(1, n):
+        fq = f[q] + q * q
+        while True:
+            p = v[k]
+            s = (fq - f[p] - p * p) / (2 * (q - p))
+            if s > z[k]:
+                break
+            k -= 1
+        k += 1
+        v[k] = q
+        z[k] = s
+        z[k + 1] = float('inf')
+
+    distances = [0] * n
+    k = 0
+    for q in range(n):
+        while z[k + 1] < q:
+            k += 1
+        p = v[k]
+        distances[q] = (q - p) * (q - p) + f[p]
+    return distances
+
+def get_squared_distance_field(rows):
+    # Exact squared Euclidean distance from every pixel to the nearest non-zero pixel, separated into a row pass and a column pass.
+    # Identical rows and columns (upscaled pixels and padding) are only transformed once.
+    row_cache = {}
+    row_distances = []
+    for row in rows:
+        distances = row_cache.get(row)
+        if distances is None:
+            distances = get_row_squared_distances(row)
+            row_cache[row] = distances
+        row_distances.append(distances)
+
+    column_cache = {}
+    column_distances = []
+    for column in zip(*row_distances):
+        distances = column_cache.get(column)
+        if distances is None:
+            distances = get_lower_envelope_distances(column)
+            column_cache[column] = distances
+        column_distances.append(distances)
+
+    return [distances for distances in zip(*column_distances)]
+
+def create_sdf_lookup(sign):
+    # Maps squared distances to stored values. Pixel centers next to the edge are half a pixel away from it.
+    lookup = []
+    for squared_distance in range((SDF_SPREAD + 1) * (SDF_SPREAD + 1) + 1):
+        distance = sign * (squared_distance ** 0.5 - 0.5)
+        lookup.append(min(max(int(round(127.5 + 127.5 * distance / SDF_SPREAD)), 0), 255))
+    return lookup
+
+def create_sdf_cell(bank, glyph_index, inside_lookup, outside_lookup):
+    glyph_width, glyph_height = bank.glyph_size
+    cell_width = glyph_width * SDF_UPSCALE + 2 * SDF_SPREAD
+    empty_row = bytes(cell_width)
+    padding = bytes(SDF_SPREAD)
+
+    ink_rows = [empty_row] * SDF_SPREAD
+    for j in range(glyph_height):
+        row = padding + bytes(1 if index else 0 for index in bank.get_glyph_row(glyph_index, j) for i in range(SDF_UPSCALE)) + padding
+        ink_rows += [row] * SDF_UPSCALE
+    ink_rows += [empty_row] * SDF_SPREAD
+
+    if all(row == empty_row for row in ink_rows):
+        return bytes([outside_lookup[-1]]) * (cell_width * len(ink_rows))
+
+    outside_distances = get_squared_distance_field(ink_rows)
+    inside_distances = get_squared_distance_field([row.translate(SDF_INVERT_LOOKUP) for row in ink_rows])
+    last = len(inside_lookup) - 1
+    cell = bytearray()
+
+    for ink_row, inside_row, outside_row in zip(ink_rows, inside_distances, outside_distances):
+        cell += bytes(inside_lookup[min(inside, last)] if ink else outside_lookup[min(outside, last)]
+            for ink, inside, outside in zip(ink_row, inside_row, outside_row))
+
+    return bytes(cell)
+
+SDF_INVERT_LOOKUP = bytes([1] + [0] * 255)
+
+def create_sdf_sheet(subsheet, bank):
+    cell_width, cell_height = get_sdf_cell_size(subsheet)
+    inside_lookup = create_sdf_lookup(1)
+    outside_lookup = create_sdf_lookup(-1)
+    sheet = PIL.Image.new('L', (bank.column_count * cell_width, bank.row_count * cell_height), 0)
+    cells = {}
+
+    for glyph in bank:
+        glyph_data = glyph.data.tobytes()
+        cell = cells.get(glyph_data)
+        if cell is None:
+            cell = create_sdf_cell(bank, glyph.index, inside_lookup, outside_lookup)
+            cells[glyph_data] = cell
+
+        glyph_x, glyph_y = glyph.index % bank.column_count, glyph.index // bank.column_count
+        sheet.paste(PIL.Image.frombuffer('L', (cell_width, cell_height), cell, 'raw', 'L', 0, 1), (glyph_x * cell_width, glyph_y * cell_height))
+
+    return sheet
+
+def write_sdf(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_image(output_file, derived.get('sdf_sheet'), 'PNG')
+
+# GPU texture containers with premultiplied alpha and a precomputed mip chain.
+# Each mip level is a box filter of the full-size sheet, and the chain stops before a texel would straddle two glyph cells,
+# so sampling a glyph at any level never picks up its neighbors.
+TEXTURE_MAX_MIP_LEVELS = 16
+
+def get_texture_mip_level_count(image_size, cell_edges):
+    alignment = 0
+    for edge in list(image_size) + list(cell_edges):
+        alignment = math.gcd(alignment, edge)
+
+    level_count = 1
+    while level_count < TEXTURE_MAX_MIP_LEVELS and alignment % (1 << level_count) == 0:
+        level_count += 1
+    return level_count
+
+def create_texture_image(rgba_image, cell_edges, alpha_only):
+    level_count = get_texture_mip_level_count(rgba_image.size, cell_edges)
+    if alpha_only:
+        level_image = rgba_image.getchannel('A')
+        pixel_format = 'r8'
+    else:
+        level_image = rgba_image.convert('RGBa')
+        pixel_format = 'rgba'
+
+    # Every level is reduced from the full-size image, rather than from the previous level, to round only once.
+    levels = [level_image.tobytes()] + [level_image.reduce(1 << level).tobytes() for level in range(1, level_count)]
+    return texture_containers.TextureImage(rgba_image.size[0], rgba_image.size[1], pixel_format, levels)
+
+def is_white_image(rgba_image):
+    # True if every visible pixel is white, so the alpha channel alone describes the image.
+    return all(color[:3] == WHITE[:3] for count, color in rgba_image.getcolors(rgba_image.size[0] * rgba_image.size[1]) if color[3] != 0)
+
+def write_texture(output_file, container_name, subsheet, rgba_image, alpha_only):
+    texture_containers.write_verified(container_name, output_file, create_texture_image(rgba_image, subsheet.glyph_size, alpha_only))
+
+def write_dds_rgba(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_texture(output_file, 'dds', subsheet, rgba_image, False)
+
+def write_dds_alpha(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_texture(output_file, 'dds', subsheet, rgba_image, True)
+
+def write_ktx2_rgba(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_texture(output_file, 'ktx2', subsheet, rgba_image, False)
+
+def write_ktx2_alpha(output_file, subsheet, variant, rgba_image, indexed_image, derived):
+    write_texture(output_file, 'ktx2', subsheet, rgba_image, True)
 
 FONT_FORMATS = {
     'bdf': FontFormat('bdf', '', 'text', write_bdf, ['1bpp']),
+    'pcf': FontFormat('pcf', '', 'binary', write_pcf, ['1bpp']),
     'chr_1bpp': FontFormat('chr', '1bpp', 'binary', write_chr_1bpp, ['1bpp']),
+    'ssd1306': FontFormat('bin', 'ssd1306', 'binary', write_page_font, ['1bpp']),
     'chr_nes': FontFormat('chr', 'nes', 'binary', write_chr_nes, ['3c']),
     'chr_gb': FontFormat('chr', 'gb', 'binary', write_chr_gb, ['3c']),
+    'chr_1bpp_rle': FontFormat('rle', '1bpp', 'binary', write_chr_1bpp_rle, ['1bpp']),
+    'chr_nes_rle': FontFormat('rle', 'nes', 'binary', write_chr_nes_rle, ['3c']),
+    'chr_gb_rle': FontFormat('rle', 'gb', 'binary', write_chr_gb_rle, ['3c']),
+    'chr_1bpp_lz': FontFormat('lz', '1bpp', 'binary', write_chr_1bpp_lz, ['1bpp']),
+    'chr_nes_lz': FontFormat('lz', 'nes', 'binary', write_chr_nes_lz, ['3c']),
+    'chr_gb_lz': FontFormat('lz', 'gb', 'binary', write_chr_gb_lz, ['3c']),
     'svg_packed': FontFormat('svg', '', 'text', write_svg, []),
     'svg_individual': FontFormat('svg', '', 'text_folder', write_svg, []),
     'png_indexed': FontFormat('png', 'idx', 'binary',write_png_indexed, []),
@@ -594,12 +1347,95 @@ FONT_FORMATS = {
     'gif_individual': FontFormat('gif', '', 'binary_folder', write_gif, []),
     'bmp_indexed': FontFormat('bmp', 'idx', 'binary', write_bmp_indexed, []),
     'bmp_rgb_magenta': FontFormat('bmp', 'rgb_magenta', 'binary', write_bmp_rgb_magenta, []),
+    'metrics': FontFormat('json', 'metrics', 'text', write_metrics, []),
+    'bmfont_text': FontFormat('fnt', '', 'text', write_bmfont_text, []),
+    'bmfont_binary': FontFormat('fnt', '', 'binary', write_bmfont_binary, []),
+    'sdf': FontFormat('png', 'sdf', 'binary', write_sdf, ['plain']),
+    'dds_rgba': FontFormat('dds', 'rgba', 'binary', write_dds_rgba, []),
+    'dds_alpha': FontFormat('dds', 'alpha', 'binary', write_dds_alpha, ['white']),
+    'ktx2_rgba': FontFormat('ktx2', 'rgba', 'binary', write_ktx2_rgba, []),
+    'ktx2_alpha': FontFormat('ktx2', 'alpha', 'binary', write_ktx2_alpha, ['white']),
 }
 
 
 
 FONT_COMBINED_VARIANTS = ['plain', 'hshadow', 'vshadow', 'hvshadow', 'hshadow_outline', 'vshadow_outline', 'hvshadow_outline']
-FONT_COMBINED_FORMATS = ['png_indexed', 'png_rgb_magenta', 'png_rgba', 'gif']
+FONT_COMBINED_FORMATS = ['png_indexed', 'png_rgb_magenta', 'png_rgba', 'gif', 'dds_rgba', 'dds_alpha', 'ktx2_rgba', 'ktx2_alpha']
+
+# Combined texture containers are assembled from the RGBA PNG subsheets, since their own subsheet files can't be opened by Pillow.
+# (container, alpha_only)
+FONT_COMBINED_TEXTURE_FORMATS = {
+    'dds_rgba': ('dds', False),
+    'dds_alpha': ('dds', True),
+    'ktx2_rgba': ('ktx2', False),
+    'ktx2_alpha': ('ktx2', True),
+}
+
+# A theme recolors indexed output by swapping palette entries, without regenerating or touching any pixels.
+# colors maps a palette color (as produced by generate_indexed_image) to the RGB color it is replaced with.
+FontTheme = collections.namedtuple('FontTheme', ['name', 'colors'])
+
+FONT_THEMES = {
+    'amber': FontTheme('amber', {WHITE: (255, 184, 0), BLACK: (74, 38, 0)}),
+    'phosphor': FontTheme('phosphor', {WHITE: (51, 255, 102), BLACK: (0, 64, 24)}),
+    'ice': FontTheme('ice', {WHITE: (200, 240, 255), BLACK: (24, 48, 96)}),
+    'rose': FontTheme('rose', {WHITE: (255, 170, 200), BLACK: (96, 16, 48)}),
+    'gold': FontTheme('gold', {WHITE: (255, 224, 96), BLACK: (112, 64, 0)}),
+    'slate': FontTheme('slate', {WHITE: (216, 222, 233), BLACK: (46, 52, 64)}),
+}
+
+FONT_THEME_FORMATS = ['png_indexed', 'gif', 'bmp_indexed']
+
+def get_theme_folder(theme_name, format_name):
+    return os.path.join(common.FONT_OUTPUT_FOLDER, 'themes', theme_name, format_name)
+
+def create_themed_image(index_plane_data, size, palette, theme):
+    themed_palette = [theme.colors.get(color + (255,), color) for color in palette]
+    themed_image = PIL.Image.frombuffer('P', size, index_plane_data, 'raw', 'P', 0, 1)
+    themed_image.putpalette([component for color in themed_palette for component in color])
+    return themed_image
+
+def generate_themed_sheets(subsheet, variant, rgba_image, indexed_image, derived, themes, formats):
+    for theme in themes:
+        for format_name, format in formats:
+            if format_name not in FONT_THEME_FORMATS:
+                continue
+
+            themed_image = create_themed_image(derived.get('index_plane'), indexed_image.size, derived.get('palette'), theme)
+            output_path = os.path.join(get_theme_folder(theme.name, format_name), get_sheet_filename(subsheet.name, variant.suffix, format.suffix, format.extension))
+
+            with open_file_verbose(output_path, 'wb') as output_file:
+                format.write_func(output_file, subsheet, variant, rgba_image, themed_image, derived)
+
+# Nearest-neighbor upscales of the raster sheets, so clients can draw crisp 2x/3x/4x textures without scaling at runtime.
+FONT_UPSCALE_FACTORS = [2, 3, 4]
+FONT_UPSCALE_FORMATS = ['png_indexed', 'png_rgb_magenta', 'png_rgba', 'gif', 'bmp_indexed', 'bmp_rgb_magenta']
+
+def get_upscale_folder(factor, format_name):
+    return os.path.join(common.FONT_OUTPUT_FOLDER, 'upscaled', str(factor) + 'x', format_name)
+
+def get_upscale_suffix(format_suffix, factor):
+    return (format_suffix + '_' if format_suffix else '') + str(factor) + 'x'
+
+def upscale_image(image, factor):
+    # Nearest-neighbor at a whole factor repeats every pixel factor x factor times. Indexed images keep their palette.
+    return image.resize((image.size[0] * factor, image.size[1] * factor), PIL.Image.NEAREST)
+
+def generate_upscaled_sheets(subsheet, variant, rgba_image, indexed_image, formats):
+    upscale_formats = [(format_name, format) for format_name, format in formats if format_name in FONT_UPSCALE_FORMATS]
+    if not upscale_formats:
+        return
+
+    for factor in FONT_UPSCALE_FACTORS:
+        upscaled_rgba_image = upscale_image(rgba_image, factor)
+        upscaled_indexed_image = upscale_image(indexed_image, factor)
+        upscaled_derived = DerivedCache(subsheet, variant, upscaled_rgba_image, upscaled_indexed_image)
+
+        for format_name, format in upscale_formats:
+            output_path = os.path.join(get_upscale_folder(factor, format_name), get_sheet_filename(subsheet.name, variant.suffix, get_upscale_suffix(format.suffix, factor), format.extension))
+
+            with open_file_verbose(output_path, 'wb') as output_file:
+                format.write_func(output_file, subsheet, variant, upscaled_rgba_image, upscaled_indexed_image, upscaled_derived)
 
 def rect_to_flat_coord_pair(region):
     return (region[0], region[1], region[0] + region[2], region[1] + region[3])
@@ -610,22 +1446,24 @@ def rect_get_size(region):
 def generate_indexed_image(source_image):
     palette = PALETTE_DEFAULTS[:]
     source_image = replace_color(source_image.copy(), TRANSPARENT, MAGENTA)
-    source_data = source_image.load()
     w, h = source_image.size
 
-    result_image = PIL.Image.new('P', source_image.size, 0)
-    result_data = result_image.load()
+    # New colors are numbered in the order they are first encountered, scanning each column top-to-bottom, left-to-right.
+    scan_data = array.array('I', source_image.transpose(PIL.Image.TRANSPOSE).tobytes())
+    first_positions = {}
 
-    for x in range(w):
-        for y in range(h):
-            color = source_data[(x, y)]
-            try:
-                index = palette.index(color)
-            except ValueError:
-                index = len(palette)
-                palette.append(color)
+    for count, color in source_image.getcolors(w * h):
+        if color not in palette:
+            first_positions[color] = scan_data.index(array.array('I', bytes(color))[0])
+
+    palette += sorted(first_positions, key=first_positions.get)
+
+    index_plane = PIL.Image.new('L', source_image.size, 0)
 
-            result_data[(x, y)] = index
+    for index, color in enumerate(palette[1:], 1):
+        index_plane.paste(index, None, create_color_mask(source_image, color))
+
+    result_image = PIL.Image.frombytes('P', source_image.size, index_plane.tobytes())
 
     palette = [color[:-1] for color in palette]
     palette_data = list(sum(palette, ()))
@@ -640,7 +1478,317 @@ def get_sheet_filename(sheet_name, variant_suffix, format_suffix, format_extensi
         + ('_' + format_suffix if format_suffix else '') \
         + '.' + format_extension
 
-def generate_sheets(force_replace):
+SOURCE_PAGE_SIZES = {}
+
+def get_source_page_size(page_name):
+    size = SOURCE_PAGE_SIZES.get(page_name)
+    if size is None:
+        # Only the header is read here, the pixels are decoded on the first crop.
+        with PIL.Image.open(common.FONT_SOURCE_PAGES[page_name]) as page_image:
+            size = page_image.size
+        SOURCE_PAGE_SIZES[page_name] = size
+    return size
+
+class FontSourcePages:
+    """Opens source pages on first use, and releases each page once the last tile that needs it has been read."""
+
+    def __init__(self, subsheets):
+        self.images = {}
+        self.pending_tile_counts = collections.Counter(tile.page
+            for subsheet in subsheets
+            for tile in get_subsheet_source_tiles(subsheet))
+
+    def get_page_size(self, page_name):
+        return get_source_page_size(page_name)
+
+    def read_tile(self, tile):
+        page_image = self.images.get(tile.page)
+        if page_image is None:
+            page_filename = common.FONT_SOURCE_PAGES[tile.page]
+            print('Opening font source page "' + tile.page + '" ("' + page_filename + '")...')
+            page_image = PIL.Image.open(page_filename)
+            self.images[tile.page] = page_image
+            SOURCE_PAGE_SIZES[tile.page] = page_image.size
+
+        tile_image = page_image.crop(rect_to_flat_coord_pair(tile.region)).convert('RGBA')
+
+        self.pending_tile_counts[tile.page] -= 1
+        if self.pending_tile_counts[tile.page] <= 0:
+            print('Releasing font source page "' + tile.page + '"...')
+            page_image.close()
+            del self.images[tile.page]
+
+        return replace_color(tile_image, MAGENTA, TRANSPARENT)
+
+def load_subsheet_source(source_pages, subsheet):
+    subsheet_source_image = PIL.Image.new('RGBA', rect_get_size(subsheet.region), TRANSPARENT)
+
+    for tile in get_subsheet_source_tiles(subsheet):
+        subsheet_source_image.paste(source_pages.read_tile(tile), tile.position)
+
+    return subsheet_source_image
+
+def get_combined_sheet_name(page_name):
+    return 'complete' if page_name == common.FONT_SOURCE_MAIN_PAGE else 'complete_' + page_name
+
+def save_upscaled_images(image, sheet_name, variant, format_name, format):
+    if format_name not in FONT_UPSCALE_FORMATS:
+        return
+
+    for factor in FONT_UPSCALE_FACTORS:
+        upscaled_path = os.path.join(get_upscale_folder(factor, format_name), get_sheet_filename(sheet_name, variant.suffix, get_upscale_suffix(format.suffix, factor), format.extension))
+        print('  - Writing "' + upscaled_path + '"...')
+        save_image(upscale_image(image, factor), upscaled_path)
+
+def generate_combined_sheets(source_pages, variant_names, format_names, themes):
+    print('')
+    print('Generating combined images...')
+    print('')
+
+    plain_variant = FONT_VARIANTS['plain']
+    page_names = []
+
+    for subsheet in FONT_SUBSHEETS.values():
+        if subsheet.page not in page_names:
+            page_names.append(subsheet.page)
+
+    for variant_name in variant_names:
+        variant = FONT_VARIANTS[variant_name]
+
+        for format_name in format_names:
+            format = FONT_FORMATS[format_name]
+            texture_format = FONT_COMBINED_TEXTURE_FORMATS.get(format_name)
+            source_format_name = 'png_rgba' if texture_format is not None else format_name
+            source_format = FONT_FORMATS[source_format_name]
+
+            for page_name in page_names:
+                with trace_memory('combined', get_combined_sheet_name(page_name), variant_name, format_name):
+                    page_size = source_pages.get_page_size(page_name)
+                    output_image = None
+                    needs_palette_reduce = False
+                    cell_edges = []
+
+                    print('Generating combined texture for ("' + variant_name + '", "' + format_name + '", "' + page_name + '")...')
+
+                    for subsheet_name, subsheet in FONT_SUBSHEETS.items():
+                        if subsheet.page != page_name:
+                            continue
+
+                        subsheet_image = None
+
+                        if subsheet_image is None:
+                            try:
+                                subsheet_path = os.path.join(common.FONT_OUTPUT_FOLDER, source_format_name, get_sheet_filename(subsheet_name, variant.suffix, source_format.suffix, source_format.extension))
+                                print('  - Trying ' + subsheet_path)
+                                subsheet_image = PIL.Image.open(subsheet_path)
+                            except FileNotFoundError:
+                                pass
+
+                        if subsheet_image is None:
+                            try:
+                                subsheet_path = os.path.join(common.FONT_OUTPUT_FOLDER, source_format_name, get_sheet_filename(subsheet_name, plain_variant.suffix, source_format.suffix, source_format.extension))
+                                print('  - Trying ' + subsheet_path)
+                                subsheet_image = PIL.Image.open(subsheet_path)
+                            except FileNotFoundError:
+                                pass
+
+                        if subsheet_image is None:
+                            print('  - Failed to open subsheet image for (variant = "' + variant_name + '", format = "' + format_name + '", subsheet_name = "' + subsheet_name + '")')
+                            continue
+
+                        if subsheet_image is not None and output_image is None:
+                            if subsheet_image.mode == 'P':
+                                needs_palette_reduce = True
+                                output_image = PIL.Image.new('RGBA', page_size, TRANSPARENT)
+                            else:
+                                output_image = PIL.Image.new(subsheet_image.mode, page_size,
+                                    {
+                                        'RGB': MAGENTA,
+                                        'RGBA': TRANSPARENT,
+                                    }.get('RGBA', 0))
+
+                        position = (subsheet.region[0], subsheet.region[1])
+
+                        print('    FOUND. Pasting at position = ' + repr(position) + '.')
+
+                        output_image.paste(subsheet_image, position)
+                        cell_edges += list(subsheet.glyph_size) + list(position)
+
+                    if output_image is None:
+                        continue
+
+                    if texture_format is not None and texture_format[1] and not is_white_image(output_image):
+                        print('  - Skipping, not every glyph is white.')
+                        continue
+
+                    output_path = os.path.join(common.FONT_OUTPUT_FOLDER, format_name, get_sheet_filename(get_combined_sheet_name(page_name), variant.suffix, format.suffix, format.extension))
+
+                    print('  - Writing "' + output_path + '"...')
+
+                    if texture_format is not None:
+                        container_name, alpha_only = texture_format
+                        with common.AtomicFileWriter(output_path, 'wb') as output_file:
+                            texture_containers.write_verified(container_name, output_file, create_texture_image(output_image, cell_edges, alpha_only))
+                    elif needs_palette_reduce:
+                        indexed_image = generate_indexed_image(output_image)
+                        save_image(indexed_image, output_path)
+                        save_upscaled_images(indexed_image, get_combined_sheet_name(page_name), variant, format_name, format)
+
+                        if format_name in FONT_THEME_FORMATS:
+                            index_plane_data = indexed_image.tobytes()
+                            palette = get_palette(indexed_image)
+
+                            for theme in themes:
+                                themed_path = os.path.join(get_theme_folder(theme.name, format_name), os.path.basename(output_path))
+                                print('  - Writing "' + themed_path + '"...')
+                                save_image(create_themed_image(index_plane_data, indexed_image.size, palette, theme), themed_path)
+                    else:
+                        save_image(output_image, output_path)
+                        save_upscaled_images(output_image, get_combined_sheet_name(page_name), variant, format_name, format)
+
+                    print('    OK.')
+
+        print('VARIANT ' + variant_name + ' COMPLETE.')
+
+def pack_sdf_atlas(sheet_sizes):
+    # Shelf packing, tallest sheets first, into the narrowest power-of-two width that is at least as wide as the packed height.
+    order = sorted(range(len(sheet_sizes)), key=lambda i: -sheet_sizes[i][1])
+    atlas_width = 1
+    while atlas_width < max(width for width, height in sheet_sizes):
+        atlas_width *= 2
+
+    while True:
+        positions = [None] * len(sheet_sizes)
+        x, y, shelf_height = 0, 0, 0
+        for i in order:
+            width, height = sheet_sizes[i]
+            if x + width > atlas_width:
+                x, y, shelf_height = 0, y + shelf_height, 0
+            positions[i] = (x, y)
+            x += width
+            shelf_height = max(shelf_height, height)
+        atlas_height = y + shelf_height
+
+        if atlas_height <= atlas_width:
+            return (atlas_width, atlas_height), positions
+        atlas_width *= 2
+
+def generate_sdf_atlas(subsheets):
+    print('')
+    print('Generating signed distance field atlas...')
+    print('')
+
+    format = FONT_FORMATS['sdf']
+    variant = FONT_VARIANTS['plain']
+    sheet_images = []
+
+    for subsheet in subsheets:
+        subsheet_path = os.path.join(common.FONT_OUTPUT_FOLDER, 'sdf', get_sheet_filename(subsheet.name, variant.suffix, format.suffix, format.extension))
+        print('  - Trying ' + subsheet_path)
+        try:
+            sheet_images.append((subsheet, PIL.Image.open(subsheet_path)))
+        except FileNotFoundError:
+            print('  - Failed to open SDF sheet for subsheet_name = "' + subsheet.name + '"')
+
+    if not sheet_images:
+        return
+
+    atlas_size, positions = pack_sdf_atlas([sheet_image.size for subsheet, sheet_image in sheet_images])
+    atlas_image = PIL.Image.new('L', atlas_size, 0)
+    subsheet_metrics = {}
+
+    for (subsheet, sheet_image), (sheet_x, sheet_y) in zip(sheet_images, positions):
+        print('    FOUND "' + subsheet.name + '". Pasting at position = ' + repr((sheet_x, sheet_y)) + '.')
+        atlas_image.paste(sheet_image, (sheet_x, sheet_y))
+
+        glyph_width, glyph_height = subsheet.glyph_size
+        ascent, descent = subsheet.ascent_descent
+        cell_width, cell_height = get_sdf_cell_size(subsheet)
+        column_count = sheet_image.size[0] // cell_width
+        code_point_map = common.get_code_point_map(subsheet.name)
+        glyphs = []
+
+        for glyph_index in range(column_count * (sheet_image.size[1] // cell_height)):
+            glyph_name, remapped_index = get_subsheet_glyph_info(subsheet, glyph_index)
+            glyphs.append({
+                'index': glyph_index,
+                'code_point': code_point_map.get_code_point(glyph_index),
+                'name': glyph_name,
+                'x': sheet_x + glyph_index % column_count * cell_width,
+                'y': sheet_y + glyph_index // column_count * cell_height,
+            })
+
+        subsheet_metrics[subsheet.name] = {
+            'glyph_width': glyph_width,
+            'glyph_height': glyph_height,
+            'ascent': ascent,
+            'descent': descent,
+            'cell_width': cell_width,
+            'cell_height': cell_height,
+            'fallback_code_point': code_point_map.fallback_code_point,
+            'glyphs': glyphs,
+        }
+
+    output_path = os.path.join(common.FONT_OUTPUT_FOLDER, 'sdf', get_sheet_filename(get_combined_sheet_name(common.FONT_SOURCE_MAIN_PAGE), None, format.suffix, format.extension))
+    print('  - Writing "' + output_path + '"...')
+    save_image(atlas_image, output_path)
+
+    with open_file_verbose(os.path.splitext(output_path)[0] + '.json', 'w') as output_file:
+        json.dump({
+            'name': common.FONT_PREFIX + '_' + get_combined_sheet_name(common.FONT_SOURCE_MAIN_PAGE) + '_' + format.suffix,
+            'width': atlas_size[0],
+            'height': atlas_size[1],
+            'upscale': SDF_UPSCALE,
+            'spread': SDF_SPREAD,
+            'subsheets': subsheet_metrics,
+        }, output_file, indent=1)
+
+    print('    OK.')
+
+def get_sheet_jobs(subsheets, variant_filter, formats):
+    # Every (subsheet, variant, format) output, in a fixed order so that every shard agrees on how the list is split.
+    return [(subsheet.name, variant_name, format_name)
+        for subsheet in subsheets
+        for variant_name in subsheet.variants
+        if variant_filter is None or variant_name in variant_filter
+        for format_name, format in formats]
+
+def generate_combined_step(source_pages, variant_filter, format_filter, themes):
+    generate_combined_sheets(source_pages,
+        [variant_name for variant_name in FONT_COMBINED_VARIANTS if variant_filter is None or variant_name in variant_filter],
+        [format_name for format_name in FONT_COMBINED_FORMATS if format_filter is None or format_name in format_filter],
+        themes)
+
+    if (format_filter is None or 'sdf' in format_filter) and (variant_filter is None or 'plain' in variant_filter):
+        with trace_memory('sdf_atlas', None, 'plain', 'sdf'):
+            generate_sdf_atlas(list(FONT_SUBSHEETS.values()))
+
+def generate_sheets(force_replace, subsheet_filter=None, variant_filter=None, format_filter=None, theme_filter=None, shard=None):
+    global FONT_BMFONT_COMBINED_VARIANTS
+
+    format_filter = get_bmfont_format_filter(format_filter)
+    subsheets = [subsheet for subsheet_name, subsheet in FONT_SUBSHEETS.items()
+        if subsheet_filter is None or subsheet_name in subsheet_filter]
+    formats = [(format_name, format) for format_name, format in FONT_FORMATS.items()
+        if (format_name in format_filter if format_filter is not None else format_name not in FONT_BUILD_PROFILE.skipped_formats)]
+    themes = [theme for theme_name, theme in FONT_THEMES.items()
+        if theme_filter is None or theme_name in theme_filter]
+
+    # The combined step runs below, or in --merge-shards for a shard, but only when every subsheet is selected.
+    FONT_BMFONT_COMBINED_VARIANTS = set()
+    if subsheet_filter is None and any(format_name == BMFONT_PAGE_FORMAT for format_name, format in formats):
+        FONT_BMFONT_COMBINED_VARIANTS = set(variant_name for variant_name in FONT_COMBINED_VARIANTS if variant_filter is None or variant_name in variant_filter)
+
+    jobs = get_sheet_jobs(subsheets, variant_filter, formats)
+    if shard is not None:
+        jobs = common.select_shard_jobs(jobs, shard)
+        print('Shard ' + str(shard[0]) + '/' + str(shard[1]) + ': ' + str(len(jobs)) + ' jobs, writing to "' + common.FONT_OUTPUT_FOLDER + '".')
+
+    sheet_format_names = collections.OrderedDict()
+    for subsheet_name, variant_name, format_name in jobs:
+        sheet_format_names.setdefault((subsheet_name, variant_name), []).append(format_name)
+    job_format_names = set(format_name for subsheet_name, variant_name, format_name in jobs)
+
     if force_replace:
         try:
             shutil.rmtree(common.FONT_OUTPUT_FOLDER)
@@ -649,8 +1797,16 @@ def generate_sheets(force_replace):
 
     folders_to_create = [common.FONT_OUTPUT_FOLDER] \
         + [os.path.join(common.FONT_OUTPUT_FOLDER, format_name)
-            for format_name, format in FONT_FORMATS.items()
-            if 'unsupported' not in format.validators]
+            for format_name, format in formats
+            if 'unsupported' not in format.validators and format_name in job_format_names] \
+        + [get_theme_folder(theme.name, format_name)
+            for theme in themes
+            for format_name, format in formats
+            if format_name in FONT_THEME_FORMATS and format_name in job_format_names] \
+        + [get_upscale_folder(factor, format_name)
+            for factor in FONT_UPSCALE_FACTORS
+            for format_name, format in formats
+            if format_name in FONT_UPSCALE_FORMATS and format_name in job_format_names]
 
     if os.path.exists(common.FONT_OUTPUT_FOLDER):
         print('Path "' + common.FONT_OUTPUT_FOLDER + '" already exists.')
@@ -659,48 +1815,61 @@ def generate_sheets(force_replace):
     for folder in folders_to_create:
         create_directory_verbose(folder)
 
-    print('Opening font source "' + common.FONT_SOURCE_FILENAME + '" ...')
-    full_source_image = replace_color(PIL.Image.open(common.FONT_SOURCE_FILENAME).convert('RGBA'), MAGENTA, TRANSPARENT)
+    subsheets = [subsheet for subsheet in subsheets
+        if any(subsheet.name == subsheet_name for subsheet_name, variant_name in sheet_format_names)]
+    source_pages = FontSourcePages(subsheets)
 
     print('Generating subsheets...')
 
-    for subsheet_name, subsheet in FONT_SUBSHEETS.items():
+    for subsheet in subsheets:
+        subsheet_name = subsheet.name
         print('Processing "' + subsheet_name + '" subsheet...')
 
-        subsheet_source_crop = full_source_image.crop(rect_to_flat_coord_pair(subsheet.region))
-
-        subsheet_source_image = PIL.Image.new('RGBA', rect_get_size(subsheet.region), TRANSPARENT)
-        subsheet_source_image.paste(subsheet_source_crop)
+        with trace_memory('source', subsheet_name):
+            subsheet_source_image = load_subsheet_source(source_pages, subsheet)
 
         for variant_name in subsheet.variants:
+            if (subsheet_name, variant_name) not in sheet_format_names:
+                continue
+
             variant = FONT_VARIANTS[variant_name]
+            variant_formats = [(format_name, FONT_FORMATS[format_name]) for format_name in sheet_format_names[(subsheet_name, variant_name)]]
 
             print('Generating "' + subsheet_name + '" variant "' + variant_name + '"...')
 
-            rgba_image = variant.generate_func(subsheet_source_image, subsheet)
+            with trace_memory('variant', subsheet_name, variant_name):
+                rgba_image = variant.generate_func(subsheet_source_image, subsheet, variant)
+
+                if rgba_image is not None:
+                    indexed_image = generate_indexed_image(rgba_image)
+                    derived = DerivedCache(subsheet, variant, rgba_image, indexed_image)
 
             if rgba_image is not None:
-                indexed_image = generate_indexed_image(rgba_image)
+                for format_name, format in variant_formats:
+                    with trace_memory('format', subsheet_name, variant_name, format_name):
+                        reject = False
 
-                for format_name, format in FONT_FORMATS.items():
-                    reject = False
+                        for validator_name in format.validators:
+                            validator = FONT_VALIDATORS[validator_name]
+                            if not validator.validate_func(variant, rgba_image, indexed_image, derived):
+                                reject = True
 
-                    for validator_name in format.validators:
-                        validator = FONT_VALIDATORS[validator_name]
-                        if not validator.validate_func(variant, rgba_image, indexed_image):
-                            reject = True
+                        if reject:
+                            continue
 
-                    if reject:
-                        continue
+                        output_path = os.path.join(common.FONT_OUTPUT_FOLDER, format_name, get_sheet_filename(subsheet_name, variant.suffix, format.suffix, format.extension))
+                        format_kind = FONT_FORMAT_KINDS.get(format.kind)
+                        if format_kind is None:
+                            raise Exception('Unhandled format kind "' + format.kind + '" used by format "' + format_name + '"')
 
-                    output_path = os.path.join(common.FONT_OUTPUT_FOLDER, format_name, get_sheet_filename(subsheet_name, variant.suffix, format.suffix, format.extension))
-                    format_kind = FONT_FORMAT_KINDS.get(format.kind)
-                    if format_kind is None:
-                        raise Exception('Unhandled format kind "' + format.kind + '" used by format "' + format_name + '"')
+                        format_kind.save_func(subsheet, variant, format, output_path, rgba_image, indexed_image, derived)
 
-                    format_kind.save_func(subsheet, variant, format, output_path, rgba_image, indexed_image)
+                        print('    OK.')
 
-                    print('    OK.')
+                with trace_memory('themes', subsheet_name, variant_name):
+                    generate_themed_sheets(subsheet, variant, rgba_image, indexed_image, derived, themes, variant_formats)
+                with trace_memory('upscales', subsheet_name, variant_name):
+                    generate_upscaled_sheets(subsheet, variant, rgba_image, indexed_image, variant_formats)
 
                 print('VARIANT "' + variant_name + '" COMPLETE.')
             else:
@@ -708,89 +1877,130 @@ def generate_sheets(force_replace):
 
         print('SUBSHEET "' + subsheet_name + '" COMPLETE.')
 
-    print('')
-    print('Generating combined images...')
-    print('')
-
-    plain_variant = FONT_VARIANTS['plain']
+    if shard is not None:
+        print('')
+        common.write_shard_manifest(FONT_SHARD_STEP_NAME, shard, jobs, common.FONT_OUTPUT_FOLDER)
+        print('Skipping combined images for this shard, they are made by --merge-shards.')
+    elif subsheet_filter is None:
+        generate_combined_step(source_pages, variant_filter, format_filter, themes)
+    else:
+        print('')
+        print('Skipping combined images, because only some subsheets were selected.')
 
-    for variant_name in FONT_COMBINED_VARIANTS:
-        variant = FONT_VARIANTS[variant_name]
+    print_profile_report()
 
-        for format_name in FONT_COMBINED_FORMATS:
-            format = FONT_FORMATS[format_name]
+    print('')
+    print('GENERATION COMPLETE.')
 
-            output_image = None
-            needs_palette_reduce = False
-
-            print('Generating combined texture for ("' + variant_name + '", "' + format_name + '")...')
-
-            for subsheet_name, subsheet in FONT_SUBSHEETS.items():
-                subsheet_image = None
-
-                if subsheet_image is None:
-                    try:
-                        subsheet_path = os.path.join(common.FONT_OUTPUT_FOLDER, format_name, get_sheet_filename(subsheet_name, variant.suffix, format.suffix, format.extension))
-                        print('  - Trying ' + subsheet_path)
-                        subsheet_image = PIL.Image.open(subsheet_path)
-                    except FileNotFoundError:
-                        pass
-
-                if subsheet_image is None:
-                    try:
-                        subsheet_path = os.path.join(common.FONT_OUTPUT_FOLDER, format_name, get_sheet_filename(subsheet_name, plain_variant.suffix, format.suffix, format.extension))
-                        print('  - Trying ' + subsheet_path)
-                        subsheet_image = PIL.Image.open(subsheet_path)
-                    except FileNotFoundError:
-                        pass
-
-                if subsheet_image is None:
-                    print('  - Failed to open subsheet image for (variant = "' + variant_name + '", format = "' + format_name + '", subsheet_name = "' + subsheet_name + '")')
-                    continue
-
-                if subsheet_image is not None and output_image is None:
-                    if subsheet_image.mode == 'P':
-                        needs_palette_reduce = True
-                        output_image = PIL.Image.new('RGBA', full_source_image.size, TRANSPARENT)
-                    else:
-                        output_image = PIL.Image.new(subsheet_image.mode, full_source_image.size,
-                            {
-                                'RGB': MAGENTA,
-                                'RGBA': TRANSPARENT,
-                            }.get('RGBA', 0))
+FONT_SHARD_STEP_NAME = 'sheets'
 
-                position = (subsheet.region[0], subsheet.region[1])
+def get_shard_output_folder(shard):
+    return os.path.join(common.get_shard_folder(FONT_SHARD_STEP_NAME, shard), common.FONT_OUTPUT_FOLDER)
 
-                print('    FOUND. Pasting at position = ' + repr(position) + '.')
+def merge_sheet_shards(force_replace, shard_count, variant_filter=None, format_filter=None, theme_filter=None):
+    format_filter = get_bmfont_format_filter(format_filter)
+    themes = [theme for theme_name, theme in FONT_THEMES.items()
+        if theme_filter is None or theme_name in theme_filter]
 
-                output_image.paste(subsheet_image, position)
+    if force_replace:
+        try:
+            shutil.rmtree(common.FONT_OUTPUT_FOLDER)
+        except FileNotFoundError:
+            pass
 
-            output_path = os.path.join(common.FONT_OUTPUT_FOLDER, format_name, get_sheet_filename('complete', variant.suffix, format.suffix, format.extension))
+    if os.path.exists(common.FONT_OUTPUT_FOLDER):
+        print('Path "' + common.FONT_OUTPUT_FOLDER + '" already exists.')
+        return
 
-            print('  - Writing "' + output_path + '"...')
+    with trace_memory('merge'):
+        common.merge_shards(FONT_SHARD_STEP_NAME, shard_count, common.FONT_OUTPUT_FOLDER, common.FONT_OUTPUT_FOLDER)
 
-            if needs_palette_reduce:
-                indexed_image = generate_indexed_image(output_image)
-                indexed_image.save(output_path)
-            else:
-                output_image.save(output_path)
+    for format_name in FONT_COMBINED_FORMATS:
+        if format_filter is None or format_name in format_filter:
+            create_directory_verbose(os.path.join(common.FONT_OUTPUT_FOLDER, format_name))
+            if format_name in FONT_THEME_FORMATS:
+                for theme in themes:
+                    create_directory_verbose(get_theme_folder(theme.name, format_name))
+            if format_name in FONT_UPSCALE_FORMATS:
+                for factor in FONT_UPSCALE_FACTORS:
+                    create_directory_verbose(get_upscale_folder(factor, format_name))
 
-            print('    OK.')
+    generate_combined_step(FontSourcePages([]), variant_filter, format_filter, themes)
 
-        print('VARIANT ' + variant_name + ' COMPLETE.')
+    print_profile_report()
 
     print('')
-    print('GENERATION COMPLETE.')
+    print('MERGE COMPLETE.')
 
 if __name__ == '__main__':
     import sys    
 
     force_replace = False
+    subsheet_filter = None
+    variant_filter = None
+    format_filter = None
+    theme_filter = None
+    shard = None
+    merge_shard_count = None
+    memory_report_path = None
+    memory_top_count = memory_trace.MEMORY_TRACE_TOP_COUNT
 
     for arg in sys.argv[1:]:
         if arg == '--force-replace':
             force_replace = True
+        elif arg.startswith('--subsheets='):
+            subsheet_filter = common.parse_name_filter(arg[len('--subsheets='):], FONT_SUBSHEETS, 'subsheet')
+        elif arg.startswith('--variants='):
+            variant_filter = common.parse_name_filter(arg[len('--variants='):], FONT_VARIANTS, 'variant')
+        elif arg.startswith('--formats='):
+            format_filter = common.parse_name_filter(arg[len('--formats='):], FONT_FORMATS, 'format')
+        elif arg.startswith('--themes='):
+            theme_filter = common.parse_name_filter(arg[len('--themes='):], FONT_THEMES, 'theme')
+        elif arg.startswith('--shard='):
+            shard = common.parse_shard(arg[len('--shard='):])
+        elif arg.startswith('--merge-shards='):
+            merge_shard_count = int(arg[len('--merge-shards='):])
+        elif arg.startswith('--profile='):
+            profile_name = arg[len('--profile='):]
+            if profile_name not in FONT_BUILD_PROFILES:
+                raise Exception('Unknown profile "' + profile_name + '" (expected one of: ' + ', '.join(FONT_BUILD_PROFILES) + ')')
+            FONT_BUILD_PROFILE = FONT_BUILD_PROFILES[profile_name]
+        elif arg.startswith('--upscales='):
+            FONT_UPSCALE_FACTORS = [int(factor) for factor in arg[len('--upscales='):].split(',') if factor]
+            if any(factor < 2 for factor in FONT_UPSCALE_FACTORS):
+                raise Exception('Upscale factors must be 2 or more')
+        elif arg.startswith('--sdf-upscale='):
+            SDF_UPSCALE = int(arg[len('--sdf-upscale='):])
+        elif arg.startswith('--sdf-spread='):
+            SDF_SPREAD = int(arg[len('--sdf-spread='):])
+        elif arg.startswith('--trace-memory='):
+            memory_report_path = arg[len('--trace-memory='):]
+        elif arg.startswith('--trace-memory-top='):
+            memory_top_count = int(arg[len('--trace-memory-top='):])
         else:
             raise Exception('Unrecognized argument "' + arg + "'")
 
-    generate_sheets(force_replace)
\ No newline at end of file
+    if memory_report_path is not None:
+        if shard is not None:
+            # Shards given the same arguments would otherwise all write the same report.
+            memory_report_root, memory_report_extension = os.path.splitext(memory_report_path)
+            memory_report_path = memory_report_root + '_' + str(shard[0]) + '_of_' + str(shard[1]) + memory_report_extension
+        FONT_MEMORY_TRACER = memory_trace.MemoryTracer(memory_top_count)
+
+    with FONT_MEMORY_TRACER if FONT_MEMORY_TRACER is not None else contextlib.nullcontext():
+        build_complete = False
+        try:
+            if merge_shard_count is not None:
+                merge_sheet_shards(force_replace, merge_shard_count, variant_filter, format_filter, theme_filter)
+            else:
+                if shard is not None:
+                    # Everything below writes under common.FONT_OUTPUT_FOLDER, so pointing it at the staging folder keeps shards apart.
+                    common.FONT_OUTPUT_FOLDER = get_shard_output_folder(shard)
+                generate_sheets(force_replace, subsheet_filter, variant_filter, format_filter, theme_filter, shard)
+            build_complete = True
+        finally:
+            # Written even when a stage fails, since that is when the report is needed most.
+            if FONT_MEMORY_TRACER is not None:
+                print('Writing ' + ('' if build_complete else 'incomplete ') + 'memory report "' + memory_report_path + '"...')
+                with common.AtomicFileWriter(memory_report_path, 'w') as report_file:
+                    FONT_MEMORY_TRACER.write_report(report_file, build_complete)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# Opt-in memory tracking for build stages, for sizing worker pools and catching extra image copies.
+# Each stage records how far Python heap use rose above where it started (tracemalloc), and how many Pillow images it
+# created and left alive. Pillow allocates pixel data outside the Python heap, so tracemalloc does not see it, and image
+# counts and pixel bytes are measured separately. Optionally, it also lists the lines that allocated the memory a stage kept.
+import contextlib
+import json
+import time
+import tracemalloc
+import weakref
+import PIL.Image # requires Pillow / PIL -- pip install pillow
+
+# How many allocation sites to list per stage. Off by default, since grouping a snapshot costs more than most stages.
+MEMORY_TRACE_TOP_COUNT = 0
+
+# Bytes per pixel of Pillow's in-memory storage, which pads 3 channel modes to 4 bytes.
+MEMORY_TRACE_PIXEL_SIZES = {'1': 1, 'L': 1, 'P': 1, 'LA': 4, 'La': 4, 'PA': 4, 'RGB': 4, 'RGBA': 4, 'RGBa': 4, 'RGBX': 4, 'CMYK': 4, 'YCbCr': 4, 'I': 4, 'F': 4, 'I;16': 2}
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def get_image_bytes(image):
+    return image.size[0] * image.size[1] * MEMORY_TRACE_PIXEL_SIZES.get(image.mode, 4)
+
+def get_allocation_sites():
+    # Bytes still allocated from each line.
+    return {(stat.traceback[0].filename, stat.traceback[0].lineno): stat.size for stat in tracemalloc.take_snapshot().statistics('lineno')}
+
+def get_max_rss_kb():
+    # Process high-water mark, only where the resource module exists (not on Windows). Linux reports kB.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None
+
+class MemoryTracer:
+    """Records one entry per stage. Stages must not be nested, since each one resets the tracemalloc peak.
+
+    Tracing only runs inside a with block, which starts tracemalloc and installs a wrapper around PIL.Image.Image.__init__,
+    and undoes both on the way out, even if the build fails. Pillow images are counted as they are constructed by the
+    wrapper, and tracked with weak references until they are freed. An image only held by a reference cycle still counts
+    as live until the garbage collector gets to it.
+
+        with MemoryTracer() as tracer:
+            with tracer.stage('load'):
+                ...
+    """
+
+    def __init__(self, top_count=MEMORY_TRACE_TOP_COUNT):
+        if not hasattr(tracemalloc, 'reset_peak'):
+            raise Exception('Memory tracing needs Python 3.9 or newer')
+
+        self.top_count = top_count
+        self.stages = []
+        self.sites = None
+        self.start_time = None
+        self.images_created = 0
+        # Images compare by content, so they can't go in a WeakSet. Keyed by id instead, which stays unique while the image is alive.
+        self.live_images = {}
+        self.original_image_init = None
+        self.started_tracemalloc = False
+
+    def __enter__(self):
+        if self.original_image_init is not None:
+            raise Exception('Memory tracer is already running')
+
+        self.start_time = time.perf_counter()
+        self.original_image_init = PIL.Image.Image.__init__
+
+        def image_init(image, *args, **kwargs):
+            self.original_image_init(image, *args, **kwargs)
+            self.images_created += 1
+            self.live_images[id(image)] = weakref.ref(image, lambda ref, key=id(image): self.live_images.pop(key, None))
+
+        PIL.Image.Image.__init__ = image_init
+
+        # Leave tracemalloc alone if something else (eg. PYTHONTRACEMALLOC) already started it.
+        self.started_tracemalloc = not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        PIL.Image.Image.__init__ = self.original_image_init
+        self.original_image_init = None
+
+    def get_live_image_bytes(self):
+        total = 0
+        for ref in list(self.live_images.values()):
+            image = ref()
+            if image is not None:
+                total += get_image_bytes(image)
+        return total
+
+    def get_top_allocations(self, start_sites):
+        # The lines whose allocations grew the most over the stage, leaving out the tracer's own bookkeeping.
+        # The sites are kept for the next stage to start from, since grouping is the slowest part of tracing.
+        # Anything allocated between two stages is counted towards the second one.
+        growth = []
+        self.sites = get_allocation_sites()
+
+        for site, size in self.sites.items():
+            start_size = start_sites.get(site, 0)
+            if size > start_size and site[0] not in (tracemalloc.__file__, __file__):
+                growth.append((size - start_size, site))
+
+        growth.sort(key=lambda item: (-item[0], item[1]))
+
+        return [{'site': filename + ':' + str(lineno), 'size_bytes': size} for size, (filename, lineno) in growth[:self.top_count]]
+
+    @contextlib.contextmanager
+    def stage(self, stage_name, subsheet_name=None, variant_name=None, format_name=None):
+        if self.top_count > 0 and self.sites is None:
+            self.sites = get_allocation_sites()
+        start_sites = self.sites
+        start_images_created = self.images_created
+        start_image_count = len(self.live_images)
+        start_time = time.perf_counter()
+        tracemalloc.reset_peak()
+        start_current, start_peak = tracemalloc.get_traced_memory()
+
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            elapsed = time.perf_counter() - start_time
+            live_image_count = len(self.live_images)
+
+            self.stages.append({
+                'stage': stage_name,
+                'subsheet': subsheet_name,
+                'variant': variant_name,
+                'format': format_name,
+                'failed': failed,
+                'seconds': round(elapsed, 6),
+                'python_peak_bytes': peak - start_current,
+                'python_retained_bytes': current - start_current,
+                'python_heap_bytes': current,
+                'images_created': self.images_created - start_images_created,
+                'live_images': live_image_count,
+                'live_images_added': live_image_count - start_image_count,
+                'live_image_bytes': self.get_live_image_bytes(),
+                'max_rss_kb': get_max_rss_kb(),
+                'top_allocations': self.get_top_allocations(start_sites) if self.top_count > 0 else [],
+            })
+
+    def get_report(self, complete=True):
+        # complete is False when the build stopped early, in which case the last stage is usually the one that failed.
+        summary = {}
+
+        for stage in self.stages:
+            stage_summary = summary.setdefault(stage['stage'], {'count': 0, 'seconds': 0.0, 'max_python_peak_bytes': 0, 'max_images_created': 0, 'max_live_image_bytes': 0})
+            stage_summary['count'] += 1
+            stage_summary['seconds'] = round(stage_summary['seconds'] + stage['seconds'], 6)
+            stage_summary['max_python_peak_bytes'] = max(stage_summary['max_python_peak_bytes'], stage['python_peak_bytes'])
+            stage_summary['max_images_created'] = max(stage_summary['max_images_created'], stage['images_created'])
+            stage_summary['max_live_image_bytes'] = max(stage_summary['max_live_image_bytes'], stage['live_image_bytes'])
+
+        return {
+            'complete': complete,
+            'seconds': round(time.perf_counter() - self.start_time, 6),
+            'max_python_peak_bytes': max([stage['python_peak_bytes'] for stage in self.stages] or [0]),
+            'max_live_image_bytes': max([stage['live_image_bytes'] for stage in self.stages] or [0]),
+            'max_rss_kb': get_max_rss_kb(),
+            'summary': summary,
+            'stages': self.stages,
+        }
+
+    def write_report(self, output_file, complete=True):
+        json.dump(self.get_report(complete), output_file, indent=1)
+
+if __name__ == '__main__':
+    import sys
+
+    # Prints the heaviest stages of a report.
+    # Usage: memory_trace.py report.json [count]
+    if len(sys.argv) < 2:
+        raise Exception('Missing report path (eg. memory_trace.py memory.json)')
+
+    with open(sys.argv[1]) as report_file:
+        report = json.load(report_file)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    def describe(stage):
+        return stage['stage'] + ' ' + '/'.join(str(stage[key]) for key in ('subsheet', 'variant', 'format') if stage[key] is not None)
+
+    if not report['complete']:
+        print('INCOMPLETE: the build stopped early.')
+        for stage in report['stages']:
+            if stage['failed']:
+                print('  - Failed in ' + describe(stage) + '.')
+    print('Max Python heap peak above a stage\'s start: ' + str(report['max_python_peak_bytes']) + ' bytes.')
+    print('Max pixel bytes held by live Pillow images: ' + str(report['max_live_image_bytes']) + ' bytes.')
+    print('Process max RSS: ' + str(report['max_rss_kb']) + ' kB.')
+
+    for title, key in [('Python heap peak', 'python_peak_bytes'), ('Pillow images created', 'images_created'), ('Pillow images left alive', 'live_images_added')]:
+        print('')
+        print('Top ' + str(count) + ' stages by ' + title + ':')
+        for stage in sorted(report['stages'], key=lambda stage: -stage[key])[:count]:
+            print('  - ' + describe(stage) + ': ' + str(stage[key]))
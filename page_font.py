@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# Draws text into the framebuffer of a monochrome SSD1306/ST7565-style panel.
+# These panels store the screen as "pages" of 8 pixel rows, one byte per column, with the top row in the lowest bit
+# (the same as MicroPython's framebuf.MONO_VLSB). The page font files from generate_sheets.py ("ssd1306" format) already
+# hold every glyph as those column bytes, so drawing a string is a few slice assignments per page, with no per-pixel work.
+# Only needs struct, so it can be copied onto a board by itself.
+#
+#   font = page_font.load('om_thin_plain_ssd1306.bin')
+#   framebuffer = bytearray(128 * 64 // 8)
+#   font.draw_text(framebuffer, 128, 0, 2, 'Hello')
+#
+# File layout (little-endian):
+#   header: magic, glyph width, glyph height, page count, glyph count, fallback code point
+#   code points: one int32 per glyph, -1 for glyphs without one
+#   glyphs: for each glyph, for each page, glyph width column bytes
+import struct
+
+PAGE_FONT_MAGIC = b'OMPF'
+PAGE_FONT_HEADER = '<4sBBBHi'
+
+def get_page_count(glyph_height):
+    return (glyph_height + 7) // 8
+
+def write_page_font(output_file, glyph_width, glyph_height, fallback_code_point, code_points, glyph_data):
+    glyph_size = glyph_width * get_page_count(glyph_height)
+    if len(glyph_data) != glyph_size * len(code_points):
+        raise Exception('Expected ' + str(glyph_size * len(code_points)) + ' bytes of glyph data, got ' + str(len(glyph_data)))
+
+    output_file.write(struct.pack(PAGE_FONT_HEADER, PAGE_FONT_MAGIC, glyph_width, glyph_height, get_page_count(glyph_height), len(code_points), fallback_code_point))
+    output_file.write(struct.pack('<' + str(len(code_points)) + 'i', *code_points))
+    output_file.write(glyph_data)
+
+class PageFont:
+    def __init__(self, data):
+        magic, self.glyph_width, self.glyph_height, self.page_count, glyph_count, fallback_code_point = struct.unpack_from(PAGE_FONT_HEADER, data, 0)
+        if magic != PAGE_FONT_MAGIC:
+            raise ValueError('Not a page font file')
+
+        offset = struct.calcsize(PAGE_FONT_HEADER)
+        code_points = struct.unpack_from('<' + str(glyph_count) + 'i', data, offset)
+        offset += 4 * glyph_count
+
+        self.glyph_size = self.glyph_width * self.page_count
+        self.data = memoryview(data)[offset:offset + self.glyph_size * glyph_count]
+        self.glyph_indexes = {}
+        for glyph_index, code_point in enumerate(code_points):
+            if code_point >= 0:
+                self.glyph_indexes[code_point] = glyph_index
+        self.fallback_glyph_index = self.glyph_indexes.get(fallback_code_point, 0)
+
+    def get_glyph_index(self, code_point):
+        return self.glyph_indexes.get(code_point, self.fallback_glyph_index)
+
+    def get_glyph_page(self, glyph_index, page):
+        # The column bytes of one page of a glyph.
+        offset = glyph_index * self.glyph_size + page * self.glyph_width
+        return self.data[offset:offset + self.glyph_width]
+
+    def measure(self, text):
+        # (width in pixels, height in pages)
+        lines = text.split('\n')
+        return max(len(line) for line in lines) * self.glyph_width, len(lines) * self.page_count
+
+    def draw_text(self, framebuffer, width, x, page, text):
+        # Overwrites the glyph cells of text, starting at column x of the given page. Lines after a '\n' start page_count pages lower.
+        # Anything past the edges of the framebuffer is clipped. Returns the x after the last line.
+        glyph_width = self.glyph_width
+        framebuffer_page_count = len(framebuffer) // width
+        start_x = x
+
+        for line in text.split('\n'):
+            # Only the glyphs that are at least partly on screen, and how many columns of the first and last one to cut off.
+            first = max(0, -x // glyph_width)
+            last = min(len(line), (width - x + glyph_width - 1) // glyph_width)
+            if first < last:
+                glyph_indexes = [self.get_glyph_index(ord(character)) for character in line[first:last]]
+                left = x + first * glyph_width
+                skip = max(0, -left)
+                length = min(width, x + last * glyph_width) - left - skip
+
+                for glyph_page in range(self.page_count):
+                    target_page = page + glyph_page
+                    if 0 <= target_page < framebuffer_page_count:
+                        row = b''.join([self.get_glyph_page(glyph_index, glyph_page) for glyph_index in glyph_indexes])
+                        target = target_page * width + left + skip
+                        framebuffer[target:target + length] = row[skip:skip + length]
+
+            x_end = x + len(line) * glyph_width
+            x = start_x
+            page += self.page_count
+
+        return x_end
+
+def load(path):
+    with open(path, 'rb') as font_file:
+        return PageFont(font_file.read())
+
+if __name__ == '__main__':
+    import glob
+    import os.path
+    import sys
+    import PIL.Image # requires Pillow / PIL -- pip install pillow
+    import common
+    import generate_sheets
+
+    # Draws every glyph of every page font file, one row of the sheet at a time, and checks it against the png_indexed sheet with the same name.
+    # Usage: page_font.py [assets folder]
+    assets_folder = sys.argv[1] if len(sys.argv) > 1 else common.FONT_OUTPUT_FOLDER
+    page_format = generate_sheets.FONT_FORMATS['ssd1306']
+    indexed_format = generate_sheets.FONT_FORMATS['png_indexed']
+    checked_count = 0
+    failed_count = 0
+
+    for font_path in sorted(glob.glob(os.path.join(assets_folder, 'ssd1306', '*.' + page_format.extension))):
+        indexed_filename = os.path.basename(font_path)[:-len('_' + page_format.suffix + '.' + page_format.extension)] + '_' + indexed_format.suffix + '.' + indexed_format.extension
+        font = load(font_path)
+
+        with PIL.Image.open(os.path.join(assets_folder, 'png_indexed', indexed_filename)) as indexed_image:
+            sheet_width, sheet_height = indexed_image.size
+            pixels = indexed_image.tobytes()
+
+        column_count = sheet_width // font.glyph_width
+        row_count = sheet_height // font.glyph_height
+        framebuffer_width = column_count * font.glyph_width
+        framebuffer = bytearray(framebuffer_width * font.page_count * row_count)
+
+        # Characters are drawn through the same code point lookup a caller would use, so a mistake in the table shows up too.
+        # Glyphs without a code point can't be drawn, so they are left out of the comparison.
+        code_points = {glyph_index: code_point for code_point, glyph_index in font.glyph_indexes.items()}
+        for glyph_row in range(row_count):
+            text = ''.join(chr(code_points.get(glyph_index, 0)) for glyph_index in range(glyph_row * column_count, (glyph_row + 1) * column_count))
+            font.draw_text(framebuffer, framebuffer_width, 0, glyph_row * font.page_count, text)
+
+        ok = True
+        for glyph_row in range(row_count):
+            for y in range(font.glyph_height):
+                for x in range(framebuffer_width):
+                    index = pixels[(glyph_row * font.glyph_height + y) * sheet_width + x]
+                    if glyph_row * column_count + x // font.glyph_width not in code_points:
+                        continue
+                    expected = generate_sheets.COLOR_MAPPING_1BPP[index]
+                    actual = framebuffer[(glyph_row * font.page_count + y // 8) * framebuffer_width + x] >> (y % 8) & 1
+                    if actual != expected:
+                        ok = False
+
+        checked_count += 1
+        if not ok:
+            failed_count += 1
+            print('MISMATCH: "' + font_path + '" does not match "' + indexed_filename + '"')
+
+    print('Checked ' + str(checked_count) + ' page font files, ' + str(failed_count) + ' failed.')
+    sys.exit(1 if failed_count else 0)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# Portable Compiled Format (PCF) bitmap fonts, the binary counterpart of BDF that X11 and many embedded toolkits load directly.
+# Only uses the Python standard library.
+# https://fontforge.org/docs/techref/pcf-format.html
+# https://gitlab.freedesktop.org/xorg/lib/libxfont/-/blob/master/src/bitmap/pcfread.c
+import collections
+import struct
+
+PCF_FILE_VERSION = b'\x01fcp'
+
+PCF_PROPERTIES = 1 << 0
+PCF_ACCELERATORS = 1 << 1
+PCF_METRICS = 1 << 2
+PCF_BITMAPS = 1 << 3
+PCF_INK_METRICS = 1 << 4
+PCF_BDF_ENCODINGS = 1 << 5
+PCF_SWIDTHS = 1 << 6
+PCF_GLYPH_NAMES = 1 << 7
+PCF_BDF_ACCELERATORS = 1 << 8
+
+PCF_DEFAULT_FORMAT = 0x00000000
+PCF_FORMAT_MASK = 0xFFFFFF00
+PCF_GLYPH_PAD_MASK = 3 << 0
+PCF_BYTE_MASK = 1 << 2
+PCF_BIT_MASK = 1 << 3
+PCF_SCAN_UNIT_MASK = 3 << 4
+PCF_COMPRESSED_METRICS = 0x00000100
+
+# Tables are written big-endian, most significant bit first, with glyph rows padded to 4 bytes (the usual bdftopcf layout).
+PCF_GLYPH_PAD_INDEX = 2
+PCF_WRITE_FORMAT = PCF_DEFAULT_FORMAT | PCF_BYTE_MASK | PCF_BIT_MASK | PCF_GLYPH_PAD_INDEX
+
+PCF_NO_GLYPH = 0xFFFF
+
+PcfMetrics = collections.namedtuple('PcfMetrics', ['left_side_bearing', 'right_side_bearing', 'character_width', 'character_ascent', 'character_descent', 'character_attributes'])
+
+# rows: one bytes object per row of the glyph bitmap, most significant bit first, padded to whole bytes.
+PcfGlyph = collections.namedtuple('PcfGlyph', ['name', 'encoding', 'metrics', 'swidth', 'rows'])
+
+# properties: (name, value) pairs, where a str value is a string property and an int value is an integer property.
+PcfFont = collections.namedtuple('PcfFont', ['properties', 'ascent', 'descent', 'default_char', 'glyphs'])
+
+def get_row_pad(row_byte_count, pad_index):
+    pad = 1 << pad_index
+    return (row_byte_count + pad - 1) // pad * pad
+
+def get_accelerators(font):
+    metrics = [glyph.metrics for glyph in font.glyphs]
+    min_bounds = PcfMetrics(*[min(values) for values in zip(*metrics)])
+    max_bounds = PcfMetrics(*[max(values) for values in zip(*metrics)])
+    max_overlap = max(m.right_side_bearing - m.character_width for m in metrics)
+    constant_metrics = min_bounds == max_bounds
+    ink_inside = all(m.left_side_bearing >= 0 and m.right_side_bearing <= m.character_width
+        and m.character_ascent <= font.ascent and m.character_descent <= font.descent for m in metrics)
+    terminal_font = constant_metrics and ink_inside and min_bounds.left_side_bearing == 0 \
+        and min_bounds.right_side_bearing == min_bounds.character_width \
+        and min_bounds.character_ascent == font.ascent and min_bounds.character_descent == font.descent
+
+    return {
+        'no_overlap': max_overlap <= min_bounds.left_side_bearing,
+        'constant_metrics': constant_metrics,
+        'terminal_font': terminal_font,
+        'constant_width': min_bounds.character_width == max_bounds.character_width,
+        'ink_inside': ink_inside,
+        'max_overlap': max(max_overlap, 0),
+        'min_bounds': min_bounds,
+        'max_bounds': max_bounds,
+    }
+
+def pack_properties_table(font):
+    strings = bytearray()
+    entries = bytearray()
+
+    def add_string(value):
+        offset = len(strings)
+        strings.extend(value.encode('latin-1') + b'\0')
+        return offset
+
+    for name, value in font.properties:
+        name_offset = add_string(name)
+        if isinstance(value, str):
+            entries += struct.pack('>iBi', name_offset, 1, add_string(value))
+        else:
+            entries += struct.pack('>iBi', name_offset, 0, value)
+
+    padding = (4 - (len(font.properties) & 3)) & 3
+    return struct.pack('>i', len(font.properties)) + bytes(entries) + bytes(padding) + struct.pack('>i', len(strings)) + bytes(strings)
+
+def pack_accelerators_table(font):
+    accelerators = get_accelerators(font)
+    return struct.pack('>8B3i', accelerators['no_overlap'], accelerators['constant_metrics'], accelerators['terminal_font'],
+            accelerators['constant_width'], accelerators['ink_inside'], 0, 0, 0,
+            font.ascent, font.descent, accelerators['max_overlap']) \
+        + struct.pack('>6h', *accelerators['min_bounds']) \
+        + struct.pack('>6h', *accelerators['max_bounds'])
+
+def pack_metrics_table(font):
+    return struct.pack('>i', len(font.glyphs)) + b''.join(struct.pack('>6h', *glyph.metrics) for glyph in font.glyphs)
+
+def pack_bitmaps_table(font):
+    offsets = []
+    bitmap_data = bytearray()
+    bitmap_sizes = [0, 0, 0, 0]
+
+    for glyph in font.glyphs:
+        offsets.append(len(bitmap_data))
+        for row in glyph.rows:
+            bitmap_data += row + bytes(get_row_pad(len(row), PCF_GLYPH_PAD_INDEX) - len(row))
+        for pad_index in range(4):
+            bitmap_sizes[pad_index] += sum(get_row_pad(len(row), pad_index) for row in glyph.rows)
+
+    return struct.pack('>i', len(font.glyphs)) \
+        + struct.pack('>' + str(len(offsets)) + 'i', *offsets) \
+        + struct.pack('>4i', *bitmap_sizes) \
+        + bytes(bitmap_data)
+
+def pack_encodings_table(font):
+    encodings = [glyph.encoding for glyph in font.glyphs]
+    min_byte1, max_byte1 = min(e >> 8 for e in encodings), max(e >> 8 for e in encodings)
+    min_byte2, max_byte2 = min(e & 0xFF for e in encodings), max(e & 0xFF for e in encodings)
+    row_size = max_byte2 - min_byte2 + 1
+    glyph_indexes = [PCF_NO_GLYPH] * (row_size * (max_byte1 - min_byte1 + 1))
+
+    for glyph_index, encoding in enumerate(encodings):
+        glyph_indexes[((encoding >> 8) - min_byte1) * row_size + (encoding & 0xFF) - min_byte2] = glyph_index
+
+    return struct.pack('>5h', min_byte2, max_byte2, min_byte1, max_byte1, font.default_char) \
+        + struct.pack('>' + str(len(glyph_indexes)) + 'H', *glyph_indexes)
+
+def pack_swidths_table(font):
+    return struct.pack('>i', len(font.glyphs)) + b''.join(struct.pack('>i', glyph.swidth) for glyph in font.glyphs)
+
+def pack_glyph_names_table(font):
+    offsets = []
+    strings = bytearray()
+
+    for glyph in font.glyphs:
+        offsets.append(len(strings))
+        strings += glyph.name.encode('latin-1') + b'\0'
+
+    return struct.pack('>i', len(font.glyphs)) \
+        + struct.pack('>' + str(len(offsets)) + 'i', *offsets) \
+        + struct.pack('>i', len(strings)) + bytes(strings)
+
+PCF_TABLE_PACKERS = [
+    (PCF_PROPERTIES, pack_properties_table),
+    (PCF_ACCELERATORS, pack_accelerators_table),
+    (PCF_METRICS, pack_metrics_table),
+    (PCF_BITMAPS, pack_bitmaps_table),
+    (PCF_BDF_ENCODINGS, pack_encodings_table),
+    (PCF_SWIDTHS, pack_swidths_table),
+    (PCF_GLYPH_NAMES, pack_glyph_names_table),
+    (PCF_BDF_ACCELERATORS, pack_accelerators_table),
+]
+
+def write_pcf(output_file, font):
+    tables = []
+
+    for table_type, pack_func in PCF_TABLE_PACKERS:
+        # The format of each table is stored in front of it in LSB order, regardless of the table's own byte order.
+        table_data = struct.pack('<i', PCF_WRITE_FORMAT) + pack_func(font)
+        tables.append((table_type, table_data + bytes((4 - (len(table_data) & 3)) & 3)))
+
+    offset = 8 + 16 * len(tables)
+    header = bytearray(PCF_FILE_VERSION + struct.pack('<i', len(tables)))
+
+    for table_type, table_data in tables:
+        header += struct.pack('<4i', table_type, PCF_WRITE_FORMAT, len(table_data), offset)
+        offset += len(table_data)
+
+    output_file.write(bytes(header))
+    for table_type, table_data in tables:
+        output_file.write(table_data)
+
+class PcfTableReader:
+    def __init__(self, data, offset):
+        self.data = data
+        self.format = struct.unpack_from('<i', data, offset)[0]
+        self.byte_order = '>' if self.format & PCF_BYTE_MASK else '<'
+        self.offset = offset + 4
+
+    def read(self, fields):
+        values = struct.unpack_from(self.byte_order + fields, self.data, self.offset)
+        self.offset += struct.calcsize(self.byte_order + fields)
+        return values
+
+    def read_metrics(self):
+        if self.format & PCF_COMPRESSED_METRICS:
+            values = struct.unpack_from('5B', self.data, self.offset)
+            self.offset += 5
+            return PcfMetrics(*[value - 0x80 for value in values], 0)
+        return PcfMetrics(*self.read('6h'))
+
+def read_string(data, offset):
+    return data[offset:data.index(b'\0', offset)].decode('latin-1')
+
+def read_pcf(data):
+    if data[:4] != PCF_FILE_VERSION:
+        raise Exception('Not a PCF file')
+
+    table_count = struct.unpack_from('<i', data, 4)[0]
+    table_offsets = {}
+
+    for i in range(table_count):
+        table_type, table_format, table_size, table_offset = struct.unpack_from('<4i', data, 8 + 16 * i)
+        table_offsets[table_type] = table_offset
+
+    reader = PcfTableReader(data, table_offsets[PCF_PROPERTIES])
+    property_count = reader.read('i')[0]
+    raw_properties = [reader.read('iBi') for i in range(property_count)]
+    reader.offset += (4 - (property_count & 3)) & 3
+    string_size = reader.read('i')[0]
+    strings = data[reader.offset:reader.offset + string_size]
+    properties = [(read_string(strings, name_offset), read_string(strings, value) if is_string else value)
+        for name_offset, is_string, value in raw_properties]
+
+    reader = PcfTableReader(data, table_offsets.get(PCF_BDF_ACCELERATORS, table_offsets[PCF_ACCELERATORS]))
+    reader.read('8B')
+    ascent, descent, max_overlap = reader.read('3i')
+
+    reader = PcfTableReader(data, table_offsets[PCF_METRICS])
+    metrics_count = reader.read('h' if reader.format & PCF_COMPRESSED_METRICS else 'i')[0]
+    metrics = [reader.read_metrics() for i in range(metrics_count)]
+
+    reader = PcfTableReader(data, table_offsets[PCF_BITMAPS])
+    bitmap_count = reader.read('i')[0]
+    bitmap_offsets = reader.read(str(bitmap_count) + 'i')
+    reader.read('4i')
+    bitmap_start = reader.offset
+    pad_index = reader.format & PCF_GLYPH_PAD_MASK
+    if not reader.format & PCF_BIT_MASK:
+        raise Exception('Only PCF bitmaps with the most significant bit first are supported')
+
+    glyph_rows = []
+    for glyph_index in range(bitmap_count):
+        glyph_metrics = metrics[glyph_index]
+        row_byte_count = (glyph_metrics.right_side_bearing - glyph_metrics.left_side_bearing + 7) // 8
+        padded_row_byte_count = get_row_pad(row_byte_count, pad_index)
+        row_offset = bitmap_start + bitmap_offsets[glyph_index]
+        rows = []
+        for j in range(glyph_metrics.character_ascent + glyph_metrics.character_descent):
+            rows.append(data[row_offset:row_offset + row_byte_count])
+            row_offset += padded_row_byte_count
+        glyph_rows.append(rows)
+
+    reader = PcfTableReader(data, table_offsets[PCF_BDF_ENCODINGS])
+    min_byte2, max_byte2, min_byte1, max_byte1, default_char = reader.read('5h')
+    row_size = max_byte2 - min_byte2 + 1
+    encoding_count = row_size * (max_byte1 - min_byte1 + 1)
+    encodings = [None] * bitmap_count
+    for i, glyph_index in enumerate(reader.read(str(encoding_count) + 'H')):
+        if glyph_index != PCF_NO_GLYPH:
+            encodings[glyph_index] = ((i // row_size + min_byte1) << 8) | (i % row_size + min_byte2)
+
+    swidths = [0] * bitmap_count
+    if PCF_SWIDTHS in table_offsets:
+        reader = PcfTableReader(data, table_offsets[PCF_SWIDTHS])
+        swidths = list(reader.read(str(reader.read('i')[0]) + 'i'))
+
+    names = [''] * bitmap_count
+    if PCF_GLYPH_NAMES in table_offsets:
+        reader = PcfTableReader(data, table_offsets[PCF_GLYPH_NAMES])
+        name_count = reader.read('i')[0]
+        name_offsets = reader.read(str(name_count) + 'i')
+        string_size = reader.read('i')[0]
+        strings = data[reader.offset:reader.offset + string_size]
+        names = [read_string(strings, name_offset) for name_offset in name_offsets]
+
+    return PcfFont(properties, ascent, descent, default_char,
+        [PcfGlyph(names[i], encodings[i], metrics[i], swidths[i], glyph_rows[i]) for i in range(bitmap_count)])
+
+if __name__ == '__main__':
+    import glob
+    import os.path
+    import sys
+    import common
+
+    # Checks every PCF file against the bitmaps of the BDF file with the same name.
+    # Usage: pcf.py [assets folder]
+    assets_folder = sys.argv[1] if len(sys.argv) > 1 else common.FONT_OUTPUT_FOLDER
+    checked_count = 0
+    failed_count = 0
+
+    for pcf_path in sorted(glob.glob(os.path.join(assets_folder, 'pcf', '*.pcf'))):
+        bdf_path = os.path.join(assets_folder, 'bdf', os.path.splitext(os.path.basename(pcf_path))[0] + '.bdf')
+
+        with open(pcf_path, 'rb') as pcf_file, open(bdf_path, 'r') as bdf_file:
+            font = read_pcf(pcf_file.read())
+            bdf_lines = bdf_file.read().split('\n')
+
+        bdf_glyphs = {}
+        for i, line in enumerate(bdf_lines):
+            if line.startswith('ENCODING '):
+                encoding = int(line.split()[1])
+            elif line == 'BITMAP':
+                bdf_glyphs[encoding] = bdf_lines[i + 1:bdf_lines.index('ENDCHAR', i)]
+
+        ok = bdf_glyphs == {glyph.encoding: [row.hex().upper() for row in glyph.rows] for glyph in font.glyphs}
+
+        checked_count += 1
+        if not ok:
+            failed_count += 1
+            print('MISMATCH: "' + pcf_path + '" does not match "' + bdf_path + '"')
+
+    print('Checked ' + str(checked_count) + ' PCF files, ' + str(failed_count) + ' failed.')
+    sys.exit(1 if failed_count else 0)
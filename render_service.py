@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# A small HTTP service that renders text with any subsheet/variant, for labels and badges.
+# Only uses the Python standard library on top of what generate_sheets.py already needs (Pillow).
+#
+#   GET /render?text=Hello&subsheet=thin&variant=plain&scale=2&format=png
+#
+# format is 'png' (default) or 'rgba', which returns raw RGBA bytes with the size in the X-Width/X-Height headers.
+# Concurrent requests are gathered into batches and composited on a worker pool, and the results are kept in an LRU cache.
+import asyncio
+import collections
+import concurrent.futures
+import io
+import os
+import threading
+import urllib.parse
+import PIL.Image # requires Pillow / PIL -- pip install pillow
+import generate_sheets
+
+RENDER_SERVICE_MAX_TEXT_LENGTH = 256
+RENDER_SERVICE_MAX_SCALE = 8
+RENDER_SERVICE_BATCH_SIZE = 32
+RENDER_SERVICE_BATCH_WINDOW = 0.002
+RENDER_SERVICE_CACHE_SIZE = 4096
+RENDER_SERVICE_MAX_REQUEST_SIZE = 8192
+
+RenderKey = collections.namedtuple('RenderKey', ['text', 'subsheet', 'variant', 'scale'])
+RenderResult = collections.namedtuple('RenderResult', ['width', 'height', 'rgba', 'png'])
+
+class RenderError(Exception):
+    pass
+
+class FontBankCache:
+    """Generates each (subsheet, variant) glyph bank on first use, the same way generate_sheets.py does. Safe to use from worker threads."""
+
+    def __init__(self):
+        self.banks = {}
+        self.code_point_maps = {}
+        self.lock = threading.Lock()
+
+    def get(self, subsheet, variant):
+        key = (subsheet.name, variant.name)
+        bank = self.banks.get(key)
+        if bank is None:
+            with self.lock:
+                bank = self.banks.get(key)
+                if bank is None:
+                    source_image = generate_sheets.load_subsheet_source(generate_sheets.FontSourcePages([subsheet]), subsheet)
+                    rgba_image = variant.generate_func(source_image, subsheet, variant)
+                    if rgba_image is None:
+                        raise RenderError('Variant "' + variant.name + '" is not implemented')
+                    bank = generate_sheets.GlyphBank.from_indexed_image(subsheet, generate_sheets.generate_indexed_image(rgba_image))
+                    self.code_point_maps[key] = bank.get_code_point_map()
+                    self.banks[key] = bank
+        return bank
+
+    def get_code_point_map(self, subsheet, variant):
+        self.get(subsheet, variant)
+        return self.code_point_maps[(subsheet.name, variant.name)]
+
+def render_text(bank_cache, key):
+    subsheet = generate_sheets.FONT_SUBSHEETS[key.subsheet]
+    variant = generate_sheets.FONT_VARIANTS[key.variant]
+    bank = bank_cache.get(subsheet, variant)
+    code_point_map = bank_cache.get_code_point_map(subsheet, variant)
+    glyph_width, glyph_height = bank.glyph_size
+
+    lines = key.text.split('\n')
+    width = max(len(line) for line in lines) * glyph_width
+    height = len(lines) * glyph_height
+    index_plane = bytearray(width * height)
+
+    for line_index, line in enumerate(lines):
+        for column, character in enumerate(line):
+            glyph_index = code_point_map.lookup(ord(character))
+            offset = line_index * glyph_height * width + column * glyph_width
+            for j in range(glyph_height):
+                index_plane[offset + j * width:offset + j * width + glyph_width] = bank.get_glyph_row(glyph_index, j)
+
+    image = generate_sheets.create_rgba_from_index_plane((width, height), bytes(index_plane), bank.palette)
+    if key.scale != 1:
+        image = image.resize((image.size[0] * key.scale, image.size[1] * key.scale), PIL.Image.NEAREST)
+
+    png_file = io.BytesIO()
+    generate_sheets.write_png_rgba(png_file, subsheet, variant, image, None, None)
+    return RenderResult(image.size[0], image.size[1], image.tobytes(), png_file.getvalue())
+
+def render_batch(bank_cache, keys):
+    results = []
+    for key in keys:
+        try:
+            results.append(render_text(bank_cache, key))
+        except Exception as e:
+            results.append(e)
+    return results
+
+class RenderService:
+    def __init__(self, worker_count=None, cache_size=RENDER_SERVICE_CACHE_SIZE):
+        self.executor = concurrent.futures.ThreadPoolExecutor(worker_count or os.cpu_count())
+        self.bank_cache = FontBankCache()
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.pending = {}
+        self.queue = None
+        self.batch_task = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.batch_task = asyncio.ensure_future(self.run_batches())
+
+    async def render(self, key):
+        result = self.cache.get(key)
+        if result is not None:
+            self.cache.move_to_end(key)
+            return result
+
+        # Identical requests that arrive while one is already queued or rendering share its result.
+        future = self.pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[key] = future
+            self.queue.put_nowait(key)
+        return await asyncio.shield(future)
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            keys = [await self.queue.get()]
+            deadline = loop.time() + RENDER_SERVICE_BATCH_WINDOW
+            while len(keys) < RENDER_SERVICE_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    keys.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            asyncio.ensure_future(self.finish_batch(keys, loop.run_in_executor(self.executor, render_batch, self.bank_cache, keys)))
+
+    async def finish_batch(self, keys, batch_future):
+        try:
+            results = await batch_future
+        except Exception as e:
+            results = [e] * len(keys)
+
+        for key, result in zip(keys, results):
+            future = self.pending.pop(key)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                self.cache[key] = result
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                future.set_result(result)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                if len(request) > RENDER_SERVICE_MAX_REQUEST_SIZE:
+                    break
+                lines = request.decode('latin-1').split('\r\n')
+                method, target, version = lines[0].split(' ', 2)
+                headers = dict((name.strip().lower(), value.strip()) for name, value in (line.split(':', 1) for line in lines[1:] if ':' in line))
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                status, content_type, extra_headers, body = await self.handle_request(method, target)
+
+                response_headers = ['HTTP/1.1 ' + status, 'Content-Type: ' + content_type, 'Content-Length: ' + str(len(body)),
+                    'Connection: ' + ('keep-alive' if keep_alive else 'close')] + extra_headers
+                writer.write(('\r\n'.join(response_headers) + '\r\n\r\n').encode('latin-1') + body)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, method, target):
+        url = urllib.parse.urlsplit(target)
+        if method != 'GET':
+            return '405 Method Not Allowed', 'text/plain', [], b'Only GET is supported\n'
+        if url.path != '/render':
+            return '404 Not Found', 'text/plain', [], b'Not found\n'
+
+        try:
+            key, format_name = parse_render_query(url.query)
+            result = await self.render(key)
+        except RenderError as e:
+            return '400 Bad Request', 'text/plain', [], (str(e) + '\n').encode('utf-8')
+        except Exception as e:
+            return '500 Internal Server Error', 'text/plain', [], (str(e) + '\n').encode('utf-8')
+
+        if format_name == 'rgba':
+            return '200 OK', 'application/octet-stream', ['X-Width: ' + str(result.width), 'X-Height: ' + str(result.height)], result.rgba
+        return '200 OK', 'image/png', [], result.png
+
+def parse_render_query(query):
+    params = urllib.parse.parse_qs(query)
+
+    def get_param(name, default):
+        values = params.get(name)
+        return values[-1] if values else default
+
+    text = get_param('text', '')
+    subsheet_name = get_param('subsheet', 'thin')
+    variant_name = get_param('variant', 'plain')
+    format_name = get_param('format', 'png')
+
+    subsheet = generate_sheets.FONT_SUBSHEETS.get(subsheet_name)
+    if subsheet is None:
+        raise RenderError('Unknown subsheet "' + subsheet_name + '"')
+    if variant_name not in subsheet.variants:
+        raise RenderError('Unknown variant "' + variant_name + '" for subsheet "' + subsheet_name + '"')
+    if format_name not in ('png', 'rgba'):
+        raise RenderError('Unknown format "' + format_name + '"')
+    if not text.replace('\n', ''):
+        raise RenderError('Text is empty')
+    if len(text) > RENDER_SERVICE_MAX_TEXT_LENGTH:
+        raise RenderError('Text is longer than ' + str(RENDER_SERVICE_MAX_TEXT_LENGTH) + ' characters')
+
+    try:
+        scale = int(get_param('scale', '1'))
+    except ValueError:
+        raise RenderError('Scale must be an integer')
+    if not 1 <= scale <= RENDER_SERVICE_MAX_SCALE:
+        raise RenderError('Scale must be between 1 and ' + str(RENDER_SERVICE_MAX_SCALE))
+
+    return RenderKey(text, subsheet_name, variant_name, scale), format_name
+
+async def serve(host, port, worker_count, cache_size):
+    service = RenderService(worker_count, cache_size)
+    service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print('Serving on http://' + host + ':' + str(port) + '/render')
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    import sys
+
+    host = '127.0.0.1'
+    port = 8080
+    worker_count = None
+    cache_size = RENDER_SERVICE_CACHE_SIZE
+
+    for arg in sys.argv[1:]:
+        if arg.startswith('--host='):
+            host = arg[len('--host='):]
+        elif arg.startswith('--port='):
+            port = int(arg[len('--port='):])
+        elif arg.startswith('--workers='):
+            worker_count = int(arg[len('--workers='):])
+        elif arg.startswith('--cache-size='):
+            cache_size = int(arg[len('--cache-size='):])
+        else:
+            raise Exception('Unrecognized argument "' + arg + "'")
+
+    asyncio.run(serve(host, port, worker_count, cache_size))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Load test for render_service.py. Sends concurrent keep-alive requests and reports latency percentiles.
+# Starts its own in-process service unless --url is given.
+# Only uses the Python standard library.
+import asyncio
+import random
+import time
+import urllib.parse
+
+LOAD_TEST_WORDS = ['Hello', 'World', 'Omelette', 'Score', 'Level', 'Lives', 'Game Over', 'Press Start', 'Pause', 'High Score']
+LOAD_TEST_SUBSHEET_VARIANTS = [('thin', 'plain'), ('thick', 'hshadow'), ('tall', 'hvshadow_outline'), ('large', 'plain'), ('small', 'vshadow')]
+
+# Sent once each on top of the random requests. The window subsheet's map in common lists A-Z,
+# but its sheet only has 24 glyphs, so 'Y' and 'Z' have to fall back instead of reading past the end.
+LOAD_TEST_FIXED_TARGETS = [
+    '/render?' + urllib.parse.urlencode({'text': 'XYZ', 'subsheet': 'window', 'variant': 'plain'}),
+]
+
+def get_percentile(sorted_values, percentile):
+    index = min(int(round(percentile / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def create_request_targets(request_count, unique_count, seed):
+    generator = random.Random(seed)
+    targets = []
+
+    for i in range(unique_count):
+        subsheet_name, variant_name = generator.choice(LOAD_TEST_SUBSHEET_VARIANTS)
+        text = generator.choice(LOAD_TEST_WORDS) + ' ' + str(i)
+        targets.append('/render?' + urllib.parse.urlencode({
+            'text': text,
+            'subsheet': subsheet_name,
+            'variant': variant_name,
+            'scale': generator.choice([1, 2, 4]),
+            'format': generator.choice(['png', 'rgba']),
+        }))
+
+    return LOAD_TEST_FIXED_TARGETS + [generator.choice(targets) for i in range(max(0, request_count - len(LOAD_TEST_FIXED_TARGETS)))]
+
+async def read_response(reader):
+    header = await reader.readuntil(b'\r\n\r\n')
+    lines = header.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    content_length = 0
+    for line in lines[1:]:
+        if line.lower().startswith('content-length:'):
+            content_length = int(line.split(':', 1)[1])
+    await reader.readexactly(content_length)
+    return status
+
+async def run_client(host, port, targets, latencies, failures):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while targets:
+            target = targets.pop()
+            start = time.perf_counter()
+            writer.write(('GET ' + target + ' HTTP/1.1\r\nHost: ' + host + '\r\n\r\n').encode('latin-1'))
+            await writer.drain()
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                failures.append((target, status))
+    finally:
+        writer.close()
+
+async def run_load_test(url, concurrency, request_count, unique_count, seed):
+    server = None
+
+    if url is None:
+        import render_service
+
+        service = render_service.RenderService()
+        service.start()
+        server = await asyncio.start_server(service.handle_connection, '127.0.0.1', 0)
+        host, port = server.sockets[0].getsockname()[:2]
+    else:
+        split_url = urllib.parse.urlsplit(url)
+        host, port = split_url.hostname, split_url.port or 80
+
+    targets = create_request_targets(request_count, unique_count, seed)
+    latencies = []
+    failures = []
+
+    print('Sending ' + str(request_count) + ' requests (' + str(unique_count) + ' unique) over ' + str(concurrency) + ' connections to ' + host + ':' + str(port) + '...')
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(host, port, targets, latencies, failures) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+    latencies.sort()
+    print('Completed ' + str(len(latencies)) + ' requests in {:.2f}s ({:.0f} requests/s), {} failed.'.format(elapsed, len(latencies) / elapsed, len(failures)))
+    print('Latency p50 {:.2f}ms, p90 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms.'.format(
+        get_percentile(latencies, 50) * 1000, get_percentile(latencies, 90) * 1000, get_percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+
+    for target, status in failures[:10]:
+        print('FAILED (' + str(status) + '): ' + target)
+
+    return not failures
+
+if __name__ == '__main__':
+    import sys
+
+    url = None
+    concurrency = 64
+    request_count = 5000
+    unique_count = 500
+    seed = 0
+
+    for arg in sys.argv[1:]:
+        if arg.startswith('--url='):
+            url = arg[len('--url='):]
+        elif arg.startswith('--concurrency='):
+            concurrency = int(arg[len('--concurrency='):])
+        elif arg.startswith('--requests='):
+            request_count = int(arg[len('--requests='):])
+        elif arg.startswith('--unique='):
+            unique_count = int(arg[len('--unique='):])
+        elif arg.startswith('--seed='):
+            seed = int(arg[len('--seed='):])
+        else:
+            raise Exception('Unrecognized argument "' + arg + "'")
+
+    sys.exit(0 if asyncio.run(run_load_test(url, concurrency, request_count, unique_count, seed)) else 1)
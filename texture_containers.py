@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# Uncompressed DDS and KTX2 texture containers, so the pixel data (including every mip level) can be copied straight into GPU memory.
+# Only uses the Python standard library.
+# https://learn.microsoft.com/en-us/windows/win32/direct3ddds/dds-header
+# https://registry.khronos.org/KTX/specs/2.0/ktxspec.v2.html
+import collections
+import io
+import struct
+
+# pixel_format: 'rgba' (8-bit sRGB color with premultiplied alpha) or 'r8' (8-bit linear single channel).
+# levels: pixel data of each mip level, largest first, rows tightly packed top to bottom.
+TextureImage = collections.namedtuple('TextureImage', ['width', 'height', 'pixel_format', 'levels'])
+
+TexturePixelFormat = collections.namedtuple('TexturePixelFormat', ['bytes_per_pixel', 'dxgi_format', 'vk_format', 'premultiplied'])
+
+TEXTURE_PIXEL_FORMATS = {
+    'rgba': TexturePixelFormat(4, 29, 43, True), # DXGI_FORMAT_R8G8B8A8_UNORM_SRGB, VK_FORMAT_R8G8B8A8_SRGB
+    'r8': TexturePixelFormat(1, 61, 9, False), # DXGI_FORMAT_R8_UNORM, VK_FORMAT_R8_UNORM
+}
+
+def get_level_size(texture, level):
+    return max(texture.width >> level, 1), max(texture.height >> level, 1)
+
+def check_texture(texture):
+    pixel_format = TEXTURE_PIXEL_FORMATS[texture.pixel_format]
+    for level, level_data in enumerate(texture.levels):
+        level_width, level_height = get_level_size(texture, level)
+        if len(level_data) != level_width * level_height * pixel_format.bytes_per_pixel:
+            raise Exception('Mip level ' + str(level) + ' has ' + str(len(level_data)) + ' bytes, expected ' + str(level_width) + 'x' + str(level_height) + ' ' + texture.pixel_format + ' pixels')
+
+DDS_MAGIC = b'DDS '
+DDS_HEADER_SIZE = 124
+DDS_PIXEL_FORMAT_SIZE = 32
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PITCH = 0x8
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDPF_FOURCC = 0x4
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400000
+DDS_DIMENSION_TEXTURE2D = 3
+DDS_ALPHA_MODE_STRAIGHT = 1
+DDS_ALPHA_MODE_PREMULTIPLIED = 2
+DDS_ALPHA_MODE_OPAQUE = 3
+
+def write_dds(output_file, texture):
+    # Always uses the DX10 extended header, since it is the only way for DDS to describe sRGB, premultiplied alpha and R8 data.
+    check_texture(texture)
+    pixel_format = TEXTURE_PIXEL_FORMATS[texture.pixel_format]
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PITCH | DDSD_PIXELFORMAT
+    caps = DDSCAPS_TEXTURE
+
+    if len(texture.levels) > 1:
+        flags |= DDSD_MIPMAPCOUNT
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+
+    output_file.write(DDS_MAGIC)
+    # size, flags, height, width, pitchOrLinearSize, depth, mipMapCount, reserved1[11]
+    output_file.write(struct.pack('<7I44x', DDS_HEADER_SIZE, flags, texture.height, texture.width, texture.width * pixel_format.bytes_per_pixel, 0, len(texture.levels)))
+    # pixel format: size, flags, fourCC, RGBBitCount, RBitMask, GBitMask, BBitMask, ABitMask
+    output_file.write(struct.pack('<II4s5I', DDS_PIXEL_FORMAT_SIZE, DDPF_FOURCC, b'DX10', 0, 0, 0, 0, 0))
+    # caps, caps2, caps3, caps4, reserved2
+    output_file.write(struct.pack('<5I', caps, 0, 0, 0, 0))
+    # dxgiFormat, resourceDimension, miscFlag, arraySize, miscFlags2 (alpha mode)
+    output_file.write(struct.pack('<5I', pixel_format.dxgi_format, DDS_DIMENSION_TEXTURE2D, 0, 1,
+        DDS_ALPHA_MODE_PREMULTIPLIED if pixel_format.premultiplied else DDS_ALPHA_MODE_STRAIGHT))
+
+    for level_data in texture.levels:
+        output_file.write(level_data)
+
+def read_dds(data):
+    if data[:4] != DDS_MAGIC:
+        raise Exception('Not a DDS file')
+
+    header_size, flags, height, width, pitch, depth, level_count = struct.unpack_from('<7I', data, 4)
+    fourcc = struct.unpack_from('<4s', data, 4 + 72 + 8)[0]
+    if fourcc != b'DX10':
+        raise Exception('Only DDS files with the DX10 header are supported')
+
+    dxgi_format = struct.unpack_from('<I', data, 4 + DDS_HEADER_SIZE)[0]
+    pixel_format_names = [name for name, pixel_format in TEXTURE_PIXEL_FORMATS.items() if pixel_format.dxgi_format == dxgi_format]
+    if not pixel_format_names:
+        raise Exception('Unsupported DXGI format ' + str(dxgi_format))
+
+    texture = TextureImage(width, height, pixel_format_names[0], [])
+    offset = 4 + DDS_HEADER_SIZE + 20
+    for level in range(max(level_count, 1)):
+        level_width, level_height = get_level_size(texture, level)
+        level_byte_count = level_width * level_height * TEXTURE_PIXEL_FORMATS[texture.pixel_format].bytes_per_pixel
+        texture.levels.append(data[offset:offset + level_byte_count])
+        offset += level_byte_count
+
+    check_texture(texture)
+    return texture
+
+KTX2_IDENTIFIER = b'\xabKTX 20\xbb\r\n\x1a\n'
+KTX2_HEADER_SIZE = 80
+KTX2_LEVEL_INDEX_ENTRY_SIZE = 24
+KHR_DF_VERSION = 2
+KHR_DF_MODEL_RGBSDA = 1
+KHR_DF_PRIMARIES_BT709 = 1
+KHR_DF_TRANSFER_LINEAR = 1
+KHR_DF_TRANSFER_SRGB = 2
+KHR_DF_FLAG_ALPHA_PREMULTIPLIED = 1
+KHR_DF_CHANNEL_RGBSDA_RED = 0
+KHR_DF_CHANNEL_RGBSDA_GREEN = 1
+KHR_DF_CHANNEL_RGBSDA_BLUE = 2
+KHR_DF_CHANNEL_RGBSDA_ALPHA = 15
+KHR_DF_SAMPLE_DATATYPE_LINEAR = 0x10
+KTX2_WRITER = 'omelette generate_sheets.py'
+
+def align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+def create_ktx2_data_format_descriptor(pixel_format):
+    if pixel_format.bytes_per_pixel == 4:
+        channels = [KHR_DF_CHANNEL_RGBSDA_RED, KHR_DF_CHANNEL_RGBSDA_GREEN, KHR_DF_CHANNEL_RGBSDA_BLUE, KHR_DF_CHANNEL_RGBSDA_ALPHA]
+        transfer = KHR_DF_TRANSFER_SRGB
+    else:
+        channels = [KHR_DF_CHANNEL_RGBSDA_RED]
+        transfer = KHR_DF_TRANSFER_LINEAR
+
+    samples = b''
+    for i, channel in enumerate(channels):
+        # Alpha is never sRGB encoded, so its sample is flagged linear even in an sRGB texture.
+        channel_type = channel | (KHR_DF_SAMPLE_DATATYPE_LINEAR if channel == KHR_DF_CHANNEL_RGBSDA_ALPHA else 0)
+        # bitOffset, bitLength - 1, channelType, samplePosition[4], sampleLower, sampleUpper
+        samples += struct.pack('<HBB4BII', i * 8, 7, channel_type, 0, 0, 0, 0, 0, 255)
+
+    block_size = 24 + len(samples)
+    # vendorId | descriptorType, versionNumber | descriptorBlockSize, colorModel, colorPrimaries, transferFunction, flags, texelBlockDimension[4], bytesPlane[8]
+    block = struct.pack('<IHH4B4B8B', 0, KHR_DF_VERSION, block_size,
+        KHR_DF_MODEL_RGBSDA, KHR_DF_PRIMARIES_BT709, transfer, KHR_DF_FLAG_ALPHA_PREMULTIPLIED if pixel_format.premultiplied else 0,
+        0, 0, 0, 0,
+        pixel_format.bytes_per_pixel, 0, 0, 0, 0, 0, 0, 0) + samples
+
+    return struct.pack('<I', 4 + len(block)) + block
+
+def create_ktx2_key_value_data(entries):
+    data = b''
+    for key, value in sorted(entries.items()):
+        key_and_value = key.encode('utf-8') + b'\0' + value.encode('utf-8') + b'\0'
+        data += struct.pack('<I', len(key_and_value)) + key_and_value
+        data += bytes(align(len(data), 4) - len(data))
+    return data
+
+def write_ktx2(output_file, texture):
+    check_texture(texture)
+    pixel_format = TEXTURE_PIXEL_FORMATS[texture.pixel_format]
+    # Mip levels are aligned to lcm(texel block size, 4), which is 4 for both supported formats.
+    level_alignment = 4
+
+    dfd = create_ktx2_data_format_descriptor(pixel_format)
+    kvd = create_ktx2_key_value_data({'KTXwriter': KTX2_WRITER, 'KTXorientation': 'rd'})
+    dfd_offset = KTX2_HEADER_SIZE + KTX2_LEVEL_INDEX_ENTRY_SIZE * len(texture.levels)
+    kvd_offset = dfd_offset + len(dfd)
+    offset = kvd_offset + len(kvd)
+
+    # Level data is stored smallest level first, so a streaming loader can show a blurry texture as soon as possible.
+    level_offsets = [0] * len(texture.levels)
+    for level in reversed(range(len(texture.levels))):
+        offset = align(offset, level_alignment)
+        level_offsets[level] = offset
+        offset += len(texture.levels[level])
+
+    output_file.write(KTX2_IDENTIFIER)
+    # vkFormat, typeSize, pixelWidth, pixelHeight, pixelDepth, layerCount, faceCount, levelCount, supercompressionScheme
+    output_file.write(struct.pack('<9I', pixel_format.vk_format, 1, texture.width, texture.height, 0, 0, 1, len(texture.levels), 0))
+    # dfdByteOffset, dfdByteLength, kvdByteOffset, kvdByteLength, sgdByteOffset, sgdByteLength
+    output_file.write(struct.pack('<4I2Q', dfd_offset, len(dfd), kvd_offset, len(kvd), 0, 0))
+    for level_offset, level_data in zip(level_offsets, texture.levels):
+        # byteOffset, byteLength, uncompressedByteLength
+        output_file.write(struct.pack('<3Q', level_offset, len(level_data), len(level_data)))
+    output_file.write(dfd)
+    output_file.write(kvd)
+
+    position = kvd_offset + len(kvd)
+    for level in reversed(range(len(texture.levels))):
+        output_file.write(bytes(level_offsets[level] - position))
+        output_file.write(texture.levels[level])
+        position = level_offsets[level] + len(texture.levels[level])
+
+def read_ktx2(data):
+    if data[:12] != KTX2_IDENTIFIER:
+        raise Exception('Not a KTX2 file')
+
+    vk_format, type_size, width, height, depth, layer_count, face_count, level_count, supercompression = struct.unpack_from('<9I', data, 12)
+    if supercompression != 0:
+        raise Exception('Supercompressed KTX2 files are not supported')
+
+    pixel_format_names = [name for name, pixel_format in TEXTURE_PIXEL_FORMATS.items() if pixel_format.vk_format == vk_format]
+    if not pixel_format_names:
+        raise Exception('Unsupported Vulkan format ' + str(vk_format))
+
+    texture = TextureImage(width, height, pixel_format_names[0], [])
+    for level in range(max(level_count, 1)):
+        level_offset, level_byte_count, uncompressed_byte_count = struct.unpack_from('<3Q', data, KTX2_HEADER_SIZE + KTX2_LEVEL_INDEX_ENTRY_SIZE * level)
+        texture.levels.append(data[level_offset:level_offset + level_byte_count])
+
+    check_texture(texture)
+    return texture
+
+TEXTURE_CONTAINERS = {
+    'dds': (write_dds, read_dds),
+    'ktx2': (write_ktx2, read_ktx2),
+}
+
+def write_verified(container_name, output_file, texture):
+    write_func, read_func = TEXTURE_CONTAINERS[container_name]
+    buffer = io.BytesIO()
+    write_func(buffer, texture)
+
+    if read_func(buffer.getvalue()) != texture:
+        raise Exception('Round trip through the "' + container_name + '" container did not reproduce the texture')
+
+    output_file.write(buffer.getvalue())
+
+if __name__ == '__main__':
+    import glob
+    import os.path
+    import sys
+    import common
+
+    # Checks that every DDS/KTX2 file in the assets folder parses, and that the DDS and KTX2 copies of each texture hold the same pixels.
+    # Usage: texture_containers.py [assets folder]
+    assets_folder = sys.argv[1] if len(sys.argv) > 1 else common.FONT_OUTPUT_FOLDER
+    checked_count = 0
+    failed_count = 0
+
+    for dds_path in sorted(glob.glob(os.path.join(assets_folder, 'dds_*', '*.dds'))):
+        ktx2_folder = 'ktx2_' + os.path.basename(os.path.dirname(dds_path))[len('dds_'):]
+        ktx2_path = os.path.join(assets_folder, ktx2_folder, os.path.splitext(os.path.basename(dds_path))[0] + '.ktx2')
+
+        with open(dds_path, 'rb') as dds_file, open(ktx2_path, 'rb') as ktx2_file:
+            ok = read_dds(dds_file.read()) == read_ktx2(ktx2_file.read())
+
+        checked_count += 1
+        if not ok:
+            failed_count += 1
+            print('MISMATCH: "' + dds_path + '" does not match "' + ktx2_path + '"')
+
+    print('Checked ' + str(checked_count) + ' texture pairs, ' + str(failed_count) + ' failed.')
+    sys.exit(1 if failed_count else 0)